@@ -0,0 +1,60 @@
+#!/usr/bin/env python
+
+from __future__ import print_function
+
+from optparse import OptionParser
+import os
+import sys
+import json
+import time
+import datetime
+
+bindir, basename = os.path.split(sys.argv[0])
+sys.path.insert(0, os.path.join(bindir, ".."))
+
+from perftrackerlib.client import ptSuite, ptTest, ptHost, ptJsonEncoder, orjson
+
+
+def build_suite(tests):
+    suite = ptSuite(suite_ver="1.0.0", product_name="My product", product_ver="1.0-123", project_name="Benchmark")
+    suite.addNode(ptHost("host1", ip="10.0.0.1", cpus=32, ram_mb=65536))
+    now = datetime.datetime.now()
+    for n in range(tests):
+        suite.addTest(ptTest("test %d" % n, group="group %d" % (n % 100), category="%d threads" % (n % 8),
+                             metrics="loops/sec", scores=[1.5 + n % 10, 2.5, 3.5], loops=100,
+                             begin=now, end=now))
+    return suite
+
+
+def measure(title, func, repeat, baseline=None):
+    best = None
+    for _ in range(repeat):
+        t = time.time()
+        func()
+        d = time.time() - t
+        best = d if best is None else min(best, d)
+    speedup = " (x%.1f)" % (baseline / best) if baseline else ""
+    print("%-30s %8.3f sec%s" % (title, best, speedup))
+    return best
+
+
+def main():
+    op = OptionParser(description="Compare the job json encoders speed")
+    op.add_option("-n", "--tests", type="int", default=100000, help="number of tests in the suite, default %default")
+    op.add_option("-r", "--repeat", type="int", default=3, help="number of runs, the best one is reported")
+    opts, args = op.parse_args()
+
+    suite = build_suite(opts.tests)
+    print("suite with %d tests" % opts.tests)
+
+    reflective = json.dumps(suite, cls=ptJsonEncoder, reflective=True)
+    assert suite.toJson() == reflective, "generated encoder output differs from the reflective one"
+    assert json.loads(ptJsonEncoder.wire(suite)) == json.loads(reflective)
+
+    base = measure("reflective encoder", lambda: json.dumps(suite, cls=ptJsonEncoder, reflective=True), opts.repeat)
+    measure("generated encoder", lambda: suite.toJson(), opts.repeat, base)
+    measure("wire (%s)" % ("orjson" if orjson else "json"), lambda: ptJsonEncoder.wire(suite), opts.repeat, base)
+
+
+if __name__ == "__main__":
+    main()
@@ -17,6 +17,7 @@ bindir, basename = os.path.split(sys.argv[0])
 sys.path.insert(0, os.path.join(bindir, ".."))
 
 from perftrackerlib.client import ptSuite, ptHost, ptVM, ptComponent, ptProduct, ptTest
+from perftrackerlib.executor import ptExecutor, ptConvergence
 from perftrackerlib import __version__
 
 reRPS = re.compile("Requests per second:\s+(\d+\.\d+).*")
@@ -29,7 +30,8 @@ EXIT_NO_URLS = -3
 
 
 class ABLauncher:
-    def __init__(self, suite, urls, concurrencies=None, iterations=3, requests=0, time=5):
+    def __init__(self, suite, urls, concurrencies=None, iterations=3, requests=0, time=5, parallel=1, converge=0,
+                 warmup=0):
         if concurrencies is None:
             concurrencies = []
         assert type(concurrencies) == list
@@ -45,6 +47,9 @@ class ABLauncher:
         self.iterations = int(iterations)
         self.requests = int(requests)
         self.time = int(time)
+        self.parallel = int(parallel)
+        self.converge = float(converge)
+        self.warmup = int(warmup)
 
         self.fmt = "%11s %8s %8s %8s  %s"
 
@@ -74,6 +79,14 @@ class ABLauncher:
                 continue
         print(self.fmt % (str(concurrency), "%.1f" % score, str(loops), str(errors), cmdline))
 
+    def _ab_parser(self, concurrency):
+        def parse(test, status, stdout, stderr):
+            # runs in the executor threads, the failed test is marked FAILED and its stderr is logged there
+            if status:
+                return
+            self.parse_ab_stdout(concurrency, test.cmdline, stdout, test)
+        return parse
+
     def _validate_urls(self):
         for url in self.urls:
             for pfx in ("http://", "https://"):
@@ -90,6 +103,7 @@ class ABLauncher:
         self.print_ab_header()
 
     def launch(self):
+        executor = ptExecutor(self.suite, parallelism=self.parallel, upload_interval=0)
         for concurrency in self.concurrencies:
             for url in self.urls:
                 if self.requests:
@@ -102,15 +116,15 @@ class ABLauncher:
                               group="Throughput", metrics="req/sec",
                               errors=0, loops=0, cmdline=cmdline)
 
-                for i in range(0, self.iterations):
-                    status, stdout, stderr = test.execute()
-                    if status:
-                        print(stderr, file=sys.stderr)
-                        sys.exit(EXIT_AB_ERROR)
-                    self.parse_ab_stdout(concurrency, test.cmdline, stdout, test)
+                if self.converge:
+                    iterations = ptConvergence(ci=self.converge / 100.0, warmup=self.warmup,
+                                               max_iterations=max(self.iterations, 2))
+                else:
+                    iterations = self.iterations
+                executor.add(test, iterations=iterations, parse=self._ab_parser(concurrency))
 
-                self.suite.addTest(test)
-                self.suite.upload()
+        if any(test.status == 'FAILED' for test in executor.run()):
+            sys.exit(EXIT_AB_ERROR)
 
 
 def main():
@@ -121,6 +135,12 @@ def main():
     op.add_option("-n", "--requests", default=0, type=int,
                   help="limit every test by given number of requests (time limit is default, see -t)")
     op.add_option("-i", "--iterations", default=3, type=int, help="number of iterations for every test")
+    op.add_option("-a", "--converge", default=0, type=float, metavar="PCT",
+                  help="repeat every test until the 95% confidence interval of the mean is within +-PCT%, "
+                       "-i is the max number of iterations then")
+    op.add_option("-w", "--warmup", default=0, type=int, help="number of warm-up iterations with -a, default: %default")
+    op.add_option("-p", "--parallel", default=1, type=int,
+                  help="number of tests running at once (they share the client CPUs), default: %default")
     op.add_option("-f", "--from-file", default="", help="get URLs from given file")
     op.add_option("-t", "--time", default=5, type=int,
                   help="limit every test by given time (sec), default %default")
@@ -146,7 +166,8 @@ def main():
     suite.handleOptions(opts)
 
     ab = ABLauncher(suite, urls, concurrencies=[int(c.strip()) for c in opts.concurrency.split(",")],
-                    requests=opts.requests, iterations=opts.iterations, time=opts.time)
+                    requests=opts.requests, iterations=opts.iterations, time=opts.time, parallel=opts.parallel,
+                    converge=opts.converge, warmup=opts.warmup)
     ab.init()
     ab.launch()
 
@@ -0,0 +1,622 @@
+#!/usr/bin/env python
+
+from __future__ import print_function, absolute_import
+
+# -*- coding: utf-8 -*-
+__author__ = "perfguru87@gmail.com"
+__copyright__ = "Copyright 2018, The PerfTracker project"
+__license__ = "MIT"
+
+"""
+asyncio API for the perftracker client (python >= 3.5, requires aiohttp)
+
+The requests are sent by aiohttp from the event loop thread, so hundreds of uploads in flight don't need
+hundreds of threads. The retry policy, circuit breaker, compression and caches of the ptServer are shared
+with the blocking client. The CPU heavy steps (job json encoding, artifacts compression and hashing) and the
+offline mode (spool_dir, the spool is on the disk) run in the event loop default executor.
+
+    async with ptAsyncServer("http://perftracker.localdomain:9000", concurrency=64) as pt_server:
+        suite = ptSuite(project_name="Test", pt_server=pt_server.pt_server)
+        ...
+        artifacts = [ptAsyncArtifact(pt_server, filename=f) for f in files]
+        await asyncio.gather(*[a.upload(f) for a, f in zip(artifacts, files)])
+        await pt_server.uploadSuite(suite)
+"""
+
+import os
+import asyncio
+import datetime
+import functools
+import logging
+import weakref
+
+import requests
+
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+from perftrackerlib.client import ptServer, ptArtifact, ptRuntimeException, ptServerUnavailableException, \
+    httplib, _retry_after, _ptBz2Decompressor, PT_IDEMPOTENT_METHODS, PT_OUTAGE_STATUSES, PT_ARTIFACT_BLOCK_SIZE
+from perftrackerlib.helpers.retry import ptCircuitBreaker, CircuitOpenException
+
+PT_ASYNC_CONCURRENCY = 32  # requests in flight per ptAsyncServer
+
+
+def _ptResponse(r, content):
+    # the aiohttp response is converted to the requests one the blocking client returns
+    resp = requests.models.Response()
+    resp.status_code = r.status
+    resp.headers = requests.structures.CaseInsensitiveDict(r.headers)
+    resp.url = str(r.url)
+    resp.encoding = requests.utils.get_encoding_from_headers(resp.headers) or 'utf-8'
+    resp._content = content
+    return resp
+
+
+class _ptAsyncBlocks:
+    """
+    Async iterator over the multipart body blocks, the file is read in the default executor
+    """
+    def __init__(self, body, progress=None):
+        self._body = body
+        self._blocks = body._blocks()
+        self._progress = progress
+        self._sent = 0
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        block = await asyncio.get_event_loop().run_in_executor(None, next, self._blocks, None)
+        if block is None:
+            raise StopAsyncIteration
+        self._sent += len(block)
+        if self._progress:
+            self._progress(self._sent, len(self._body))
+        return block
+
+
+class ptAsyncServer:
+    def __init__(self, pt_server_url=None, concurrency=PT_ASYNC_CONCURRENCY, pt_server=None, **kwargs):
+        """
+        pt_server_url - perftracker url: 'http://perftracker.localdomain:9000'
+        concurrency   - max number of requests in flight, the rest wait for a free slot without
+                        blocking the event loop
+        pt_server     - ptServer to take the settings from instead of creating a new one, it is not
+                        closed by close()
+        kwargs        - ptServer() arguments: spool_dir, compression, retry_policy, timeout, ...
+        """
+        if aiohttp is None:
+            raise ptRuntimeException("ptAsyncServer requires aiohttp: pip install aiohttp")
+
+        self._own_server = pt_server is None
+        self.pt_server = pt_server if pt_server is not None else ptServer(pt_server_url, **kwargs)
+        self.concurrency = concurrency
+        self._session = None
+        self._semaphore = None
+        self._suite_locks = weakref.WeakKeyDictionary()
+
+    def __repr__(self):
+        return "ptAsyncServer('%s', concurrency=%d)" % (self.pt_server.url, self.concurrency)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.close()
+
+    def _http_session(self):
+        # created in the running loop, the connector keeps the connections alive
+        if self._session is None:
+            timeout = self.pt_server._timeout
+            connect, read = timeout if isinstance(timeout, tuple) else (timeout, timeout)
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=self.concurrency),
+                timeout=aiohttp.ClientTimeout(total=None, sock_connect=connect, sock_read=read))
+            self._semaphore = asyncio.Semaphore(self.concurrency)
+        return self._session
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+        if self._own_server:
+            self.pt_server.close()
+
+    async def run(self, func, *args, **kwargs):
+        """
+        Run the blocking func(*args, **kwargs) in the event loop default executor
+        """
+        return await asyncio.get_event_loop().run_in_executor(None, functools.partial(func, *args, **kwargs))
+
+    async def request(self, method, url, decode_json=True, idempotent=None, data=None, headers=None, params=None,
+                      sink=None):
+        """
+        The async ptServer._http_request(): the same retries, circuit breaker and response checks
+
+        data - request body, a function returning a new body for every attempt if it can be read once
+        sink - async function(aiohttp response) reading the body of the successful response, e.g. to a file
+        """
+        pt_server = self.pt_server
+        url = "%s/%s" % (pt_server.api_url, url.lstrip("/"))
+
+        logging.debug("%s %s ..." % (method, url))
+
+        if idempotent is None:
+            idempotent = method in PT_IDEMPOTENT_METHODS
+
+        headers = dict(headers or {})
+        session = self._http_session()
+
+        policy = pt_server._retry_policy
+        breaker = pt_server._circuit_breaker
+        attempt = 0
+        while True:
+            attempt += 1
+            try:
+                breaker.before_request()
+            except CircuitOpenException as e:
+                raise ptServerUnavailableException("%s %s: %s" % (method, url, str(e)))
+
+            error, failed, retry = None, None, False
+            try:
+                async with self._semaphore:
+                    async with session.request(method, url, data=data() if callable(data) else data,
+                                               headers=headers, params=params) as r:
+                        failed = r.status in PT_OUTAGE_STATUSES
+                        retry = idempotent and attempt < policy.max_attempts and policy.retry_status(r.status)
+                        content = b""
+                        if retry:
+                            pass
+                        elif sink is not None and r.status in (httplib.OK, httplib.PARTIAL_CONTENT):
+                            await sink(r)
+                        else:
+                            content = await r.read()
+                        response = _ptResponse(r, content)
+            except (aiohttp.ClientConnectionError, asyncio.TimeoutError) as e:
+                error, failed = e, True
+            finally:
+                if failed is None:
+                    breaker.release()  # a local error, see ptServer._http_request()
+                elif failed:
+                    breaker.failure()
+                else:
+                    breaker.success()
+
+            if error is not None:
+                if attempt < policy.max_attempts and (idempotent or isinstance(error, aiohttp.ClientConnectorError)) \
+                        and breaker.state != ptCircuitBreaker.OPEN:
+                    logging.warning("%s %s failed, attempt %d of %d: %s" %
+                                    (method, url, attempt, policy.max_attempts, str(error) or repr(error)))
+                    await asyncio.sleep(policy.delay(attempt))
+                    continue
+                raise ptServerUnavailableException(str(error) or repr(error))
+
+            if retry:
+                logging.warning("%s %s status %d, attempt %d of %d" %
+                                (method, url, response.status_code, attempt, policy.max_attempts))
+                await asyncio.sleep(policy.delay(attempt, _retry_after(response)))
+                continue
+            break
+
+        return pt_server._checkResponse(method, url, response, decode_json, ranged='Range' in headers,
+                                        streamed=sink is not None)
+
+    async def get(self, url, *args, **kwargs):
+        return await self.request('get', url, *args, **kwargs)
+
+    async def post(self, url, decode_json=True, idempotent=False, *args, **kwargs):
+        return await self.request('post', url, decode_json, idempotent, *args, **kwargs)
+
+    async def delete(self, url, *args, **kwargs):
+        return await self.request('delete', url, *args, **kwargs)
+
+    async def patch(self, url, *args, **kwargs):
+        return await self.request('patch', url, *args, **kwargs)
+
+    async def getProjectId(self, project_name):
+        if not project_name:
+            return None
+
+        pt_server = self.pt_server
+        project_id = pt_server._cachedProjectId(project_name)
+        if project_id is not None:
+            return project_id
+
+        projects = pt_server._projectsListed(await self.get("/0/project/", params={'name': project_name}))
+        for project_json in projects:
+            if project_json['name'] == project_name:
+                pt_server._cacheProjectId(project_name, project_json['id'])
+                return project_json['id']
+
+        if not projects:
+            projects = pt_server._projectsListed(await self.get("/0/project/"))
+        raise pt_server._projectNotFound(project_name, projects)
+
+    async def _refreshProjectId(self, project_id):
+        # see ptServer._refreshProjectId()
+        pt_server = self.pt_server
+        project_name = pt_server._project_names.get(project_id)
+        if project_name is None:
+            return None
+        pt_server.forgetProjectId(project_name)
+        try:
+            new_id = await self.getProjectId(project_name)
+        except ptRuntimeException as e:
+            logging.debug(str(e))
+            return None
+        if new_id == project_id:
+            return None
+        pt_server._project_names[project_id] = project_name
+        logging.warning("project '%s' id has changed: %d -> %d" % (project_name, project_id, new_id))
+        return new_id
+
+    async def postJob(self, project_id, json_data, job_uuid=None):
+        """
+        json_data - job json text
+
+        Returns the server response or None if the server is unreachable and the job json is spooled
+        """
+        pt_server = self.pt_server
+        if pt_server.spool is not None:
+            return await self.run(pt_server.postJob, project_id, json_data, job_uuid)
+
+        data = json_data if isinstance(json_data, bytes) else json_data.encode('utf-8')
+
+        project_name = pt_server._project_names.get(project_id)
+        project_id = (pt_server._cachedProjectId(project_name) if project_name else None) or project_id
+
+        response = await self._postJobTo(project_id, data)
+        if response.status_code in (httplib.NOT_FOUND, httplib.BAD_REQUEST):
+            new_id = await self._refreshProjectId(project_id)
+            if new_id is not None:
+                response = await self._postJobTo(new_id, data)
+        return pt_server._jobPosted(response)
+
+    async def _postJobTo(self, project_id, data):
+        # see ptServer._postJobTo()
+        url = '%d/job/' % project_id
+        compressor = self.pt_server._compressor
+        if compressor is None or len(data) < self.pt_server._compression_min_size:
+            return await self.post(url, decode_json=False, data=data, idempotent=True)
+
+        compressed = await self.run(compressor.compress, data)
+        try:
+            response = await self.post(url, decode_json=False, data=compressed, idempotent=True,
+                                       headers={'Content-Encoding': compressor.encoding})
+            rejected = response.status_code in (httplib.UNSUPPORTED_MEDIA_TYPE, httplib.BAD_REQUEST)
+        except ptServerUnavailableException:
+            raise
+        except ptRuntimeException as e:
+            rejected = True
+            logging.debug(str(e))
+
+        if rejected:
+            logging.warning("%s compressed job upload is rejected, retrying uncompressed" % compressor.encoding)
+            response = await self.post(url, decode_json=False, data=data, idempotent=True)
+            if response.status_code == httplib.OK:
+                logging.warning("the server doesn't accept %s compressed uploads, compression is switched off" %
+                                compressor.encoding)
+                self.pt_server._compressor = None
+        return response
+
+    async def flushSpool(self):
+        return await self.run(self.pt_server.flushSpool)
+
+    async def uploadSuite(self, suite):
+        """
+        The async ptSuite.upload() to this server: the job json is encoded in the default executor, so the
+        event loop is not blocked by big suites. The uploads of the same suite are sent one by one.
+        """
+        if not suite.project_name or suite._save_to_file:
+            return await self.run(suite.upload)
+
+        lock = self._suite_locks.get(suite)
+        if lock is None:
+            lock = self._suite_locks[suite] = asyncio.Lock()
+
+        async with lock:
+            if not suite.project_id:
+                suite.project_id = await self.getProjectId(suite.project_name)
+            if suite._auto_end is None:
+                suite.end = datetime.datetime.now()
+
+            json_data, tests, env_nodes, touched = await self.run(suite._uploadJob, snapshot=True)
+            await self.postJob(suite.project_id, json_data, suite.uuid)
+            suite._uploadDone(tests, env_nodes, touched)
+        return True
+
+
+class ptAsyncArtifact:
+    def __init__(self, pt_server, **kwargs):
+        """
+        pt_server - ptAsyncServer instance
+        kwargs    - ptArtifact() arguments: uuid1, filename, description, ttl_days, dedup, ...
+
+        The ptArtifact is available as .artifact, the progress callbacks are called in the event loop thread
+        """
+        self._pt_server = pt_server
+        self.artifact = ptArtifact(pt_server.pt_server, **kwargs)
+
+    def __repr__(self):
+        return "ptAsyncArtifact('%s')" % self.artifact.uuid
+
+    @property
+    def uuid(self):
+        return self.artifact.uuid
+
+    async def upload(self, filepath, progress=None):
+        """
+        See ptArtifact.upload()
+        """
+        a = self.artifact
+        if a._pt_server.spool is not None:
+            return await self._pt_server.run(a.upload, filepath, progress=progress)
+
+        cache = a._pt_server.cache('artifacts') if a._dedup else None
+        if cache:
+            ttl_sec = a._cacheTtlSec()
+            digest = await self._pt_server.run(a._fileDigest, cache, filepath, ttl_sec)
+            key = a._contentKey(digest, filepath)
+            resp = await self._linkExisting(cache, key)
+            if resp is not None:
+                return resp
+
+        resp = await self._upload(filepath, progress)
+
+        if cache and resp.status_code == httplib.OK:
+            cache.set(key, str(a.uuid), ttl_sec=ttl_sec)
+        return resp
+
+    async def _linkExisting(self, cache, key):
+        # see ptArtifact._linkExisting()
+        a = self.artifact
+        uuid1 = cache.get(key)
+        if uuid1 is None:
+            return None
+
+        try:
+            resp = await self._pt_server.get(ptArtifact(a._pt_server, uuid1=uuid1)._url)
+            if resp.status_code != httplib.OK:
+                cache.delete(key)
+                return None
+            existing = a._reused(resp.json)
+            if existing is None:
+                return None
+            resp = await self._pt_server.post(existing._url, data=existing._updateData(), idempotent=True)
+        except ptRuntimeException as e:
+            logging.debug("can't reuse artifact %s: %s" % (uuid1, str(e)))
+            return None
+        return a._adopt(existing, resp)
+
+    async def _upload(self, filepath, progress):
+        a = self.artifact
+        tmp = await self._pt_server.run(a._compress, filepath) if a.compression else None
+        try:
+            body = a._uploadBody(filepath, tmp)
+            return await self._pt_server.post(a._url, data=lambda: _ptAsyncBlocks(body, progress), idempotent=True,
+                                              headers={'Content-Type': body.content_type,
+                                                       'Content-Length': str(len(body))})
+        finally:
+            if tmp:
+                os.unlink(tmp)
+
+    async def update(self):
+        return await self._pt_server.post(self.artifact._url, data=self.artifact._updateData(), idempotent=True)
+
+    async def download(self, filepath=None, decompress=False, resume=False, progress=None):
+        """
+        See ptArtifact.download()
+        """
+        a = self.artifact
+        if filepath is None:
+            return await self._pt_server.get(a._url_download, decode_json=False)
+
+        assert not (resume and decompress), "a decompressed download can't be resumed"
+
+        offset = os.path.getsize(filepath) if resume and os.path.exists(filepath) else 0
+        resp = await self._download(filepath, offset, decompress, progress)
+        if resp.status_code == httplib.REQUESTED_RANGE_NOT_SATISFIABLE:
+            if a._rangeTotal(resp) == offset:
+                resp.status_code = httplib.OK
+                return resp
+            resp = await self._download(filepath, 0, decompress, progress)
+        return resp
+
+    async def _download(self, filepath, offset, decompress, progress):
+        async def _sink(r):
+            start = offset if r.status == httplib.PARTIAL_CONTENT else 0
+            size = r.headers.get('Content-Length')
+            total = start + int(size) if size is not None else None
+            d = _ptBz2Decompressor() if decompress else None
+            n = start
+            with open(filepath, 'ab') as f:
+                f.truncate(start)  # the same file position on every attempt
+                async for chunk in r.content.iter_chunked(PT_ARTIFACT_BLOCK_SIZE):
+                    n += len(chunk)
+                    f.write(d.decompress(chunk) if d else chunk)
+                    if progress:
+                        progress(n, total)
+                if d:
+                    f.write(d.flush())
+
+        headers = {'Range': 'bytes=%d-' % offset} if offset else None
+        return await self._pt_server.get(self.artifact._url_download, decode_json=False, headers=headers, sink=_sink)
+
+    async def info(self):
+        return await self._pt_server.get(self.artifact._url)
+
+    async def delete(self):
+        return await self._pt_server.delete(self.artifact._url)
+
+    async def link(self, uuids):
+        return await self._pt_server.post(self.artifact._url, data=self.artifact._linkData(uuids), idempotent=True)
+
+    async def unlink(self, uuids):
+        return await self._pt_server.post(self.artifact._url, data=self.artifact._unlinkData(uuids), idempotent=True)
+
+
+##############################################################################
+# Autotests
+##############################################################################
+
+
+def _coverage():
+    import shutil
+    import tempfile
+    import threading
+    from perftrackerlib.client import ptSuite, ptTest
+    from perftrackerlib.helpers.retry import ptRetryPolicy
+
+    async def _test():
+        async with ptAsyncServer(concurrency=4, compression='gzip', compression_min_size=0) as pt_server:
+            print(repr(pt_server))
+            suite = ptSuite(project_name="Test", uuid1="11111111-6666-11e8-85cb-8c85907924aa",
+                            pt_server=pt_server.pt_server)
+
+            async def _run_test(n):
+                suite.addTest(ptTest("Async test", category=str(n), scores=[n]))
+                await pt_server.uploadSuite(suite)
+
+            await asyncio.gather(*[_run_test(n) for n in range(8)])
+            assert suite.project_id == await pt_server.getProjectId("Test")
+            assert not suite._dirty_tests
+
+            # the requests are multiplexed on the event loop, no thread per request
+            threads = threading.active_count()
+            resps = await asyncio.gather(*[pt_server.get("/0/project/") for n in range(32)])
+            assert [r.status_code for r in resps] == [httplib.OK] * 32 and threading.active_count() == threads
+            assert pt_server._semaphore._value == 4
+
+            progress = []
+            artifacts = [ptAsyncArtifact(pt_server, description="async %d" % n, inline=True) for n in range(8)]
+            resps = await asyncio.gather(*[a.upload(os.path.abspath(__file__), progress=lambda *p: progress.append(p))
+                                           for a in artifacts])
+            assert [r.status_code for r in resps] == [httplib.OK] * len(artifacts)
+            assert progress[-1][0] == progress[-1][1]
+            print(repr(artifacts[0]))
+
+            a = artifacts[0]
+            assert (await a.link([suite.uuid])).status_code == httplib.OK
+            assert (await a.unlink([suite.uuid])).status_code == httplib.OK
+            assert (await a.info()).status_code == httplib.OK
+            a.artifact.description = "updated"
+            assert (await a.update()).status_code == httplib.OK
+            assert (await a.info()).json['description'] == "updated"
+
+            path = tempfile.mktemp()
+            assert (await a.download(path)).status_code == httplib.OK
+            assert open(path, 'rb').read() == open(os.path.abspath(__file__), 'rb').read()
+            with open(path, 'r+b') as f:
+                f.truncate(100)
+            assert (await a.download(path, resume=True)).status_code in (httplib.OK, httplib.PARTIAL_CONTENT)
+            assert open(path, 'rb').read() == open(os.path.abspath(__file__), 'rb').read()
+            assert (await a.download(path, resume=True)).status_code == httplib.OK  # complete already
+            assert open(path, 'rb').read() == open(os.path.abspath(__file__), 'rb').read()
+            with open(path, 'ab') as f:
+                f.write(b"garbage")
+            assert (await a.download(path, resume=True)).status_code == httplib.OK
+            assert open(path, 'rb').read() == open(os.path.abspath(__file__), 'rb').read()
+            assert (await a.download()).content == open(os.path.abspath(__file__), 'rb').read()
+            os.unlink(path)
+
+            packed = ptAsyncArtifact(pt_server, compression=True)
+            assert (await packed.upload(os.path.abspath(__file__))).status_code == httplib.OK
+            assert (await packed.download(path, decompress=True)).status_code == httplib.OK
+            assert open(path, 'rb').read() == open(os.path.abspath(__file__), 'rb').read()
+            os.unlink(path)
+            artifacts.append(packed)
+
+            resps = await asyncio.gather(*[a.delete() for a in artifacts])
+            assert [r.status_code for r in resps] == [httplib.OK] * len(artifacts)
+            assert (await pt_server.get("/0/artifact/%s" % a.uuid)).status_code == httplib.NOT_FOUND
+
+        cache_dir = tempfile.mkdtemp()
+        async with ptAsyncServer(cache_dir=cache_dir) as pt_server:
+            first = ptAsyncArtifact(pt_server, filename="same.txt", dedup=True)
+            again = ptAsyncArtifact(pt_server, filename="same.txt", dedup=True, description="again")
+            assert (await first.upload(os.path.abspath(__file__))).status_code == httplib.OK
+            assert (await again.upload(os.path.abspath(__file__))).status_code == httplib.OK
+            assert str(again.uuid) == str(first.uuid) and (await first.info()).json['description'] == "again"
+            await first.delete()
+            third = ptAsyncArtifact(pt_server, filename="same.txt", dedup=True)
+            assert (await third.upload(os.path.abspath(__file__))).status_code == httplib.OK
+            assert str(third.uuid) != str(first.uuid)  # the deleted one is not reused
+            await third.delete()
+
+            class _MovedProjectServer(ptAsyncServer):
+                # the project is re-created with another id, the old one is not found
+                async def post(self, url, *args, **kwargs):
+                    if url.startswith('999/'):
+                        resp = requests.models.Response()
+                        resp.status_code = httplib.NOT_FOUND
+                        resp._content = b'{"message": "project not found"}'
+                        return resp
+                    return await ptAsyncServer.post(self, url, *args, **kwargs)
+
+            async with _MovedProjectServer(pt_server=pt_server.pt_server) as moved:
+                moved.pt_server._cacheProjectId("Test", 999)
+                assert (await moved.postJob(999, suite.toJson())).status_code == httplib.OK
+                assert await moved.getProjectId("Test") == suite.project_id
+        shutil.rmtree(cache_dir)
+
+        async with ptAsyncServer(project_cache_ttl=0) as pt_server:
+            assert await pt_server.getProjectId("Test") == suite.project_id and await pt_server.getProjectId("") is None
+            try:
+                await pt_server.getProjectId("No such project")
+                assert False, "project doesn't exist"
+            except ptRuntimeException:
+                pass
+
+            def _broken_body():
+                raise IOError("broken body")
+
+            try:
+                await pt_server.post("/0/job/", data=_broken_body)
+                assert False, "the body is broken"
+            except IOError:
+                assert pt_server.pt_server.circuit_breaker._failures == 0  # a local error is not an outage
+
+            path = tempfile.mktemp()
+            assert await pt_server.uploadSuite(ptSuite(project_name="Test", save_to_file=path))
+            os.unlink(path)
+
+        spool_dir = tempfile.mkdtemp()
+        async with ptAsyncServer("http://127.0.0.1:1", spool_dir=spool_dir,
+                                 retry_policy=ptRetryPolicy(max_attempts=2, backoff_sec=0.01)) as down:
+            try:
+                await down.get("/0/project/")
+                assert False, "the server is down"
+            except ptServerUnavailableException as e:
+                print(e)
+            assert await down.postJob(1, suite.toJson(), suite.uuid) is None
+            assert await ptAsyncArtifact(down).upload(os.path.abspath(__file__)) is None
+            try:
+                await down.flushSpool()
+                assert False, "the server is still down"
+            except ptServerUnavailableException:
+                assert not down.pt_server.spool.empty()
+            assert down.pt_server.circuit_breaker.state == ptCircuitBreaker.OPEN
+            try:
+                await down.get("/0/project/")
+                assert False, "the circuit is open"
+            except ptServerUnavailableException as e:
+                print(e)
+        shutil.rmtree(spool_dir)
+
+        # the server passed in is not closed with the async one
+        async with ptAsyncServer(pt_server=suite.pt_server) as shared:
+            assert (await shared.get("/0/artifact/%s" % a.uuid)).status_code == httplib.NOT_FOUND
+        suite.pt_server.close()
+
+    if hasattr(asyncio, 'run'):
+        asyncio.run(_test())
+    else:
+        asyncio.get_event_loop().run_until_complete(_test())
+    print("OK")
+
+
+if __name__ == "__main__":
+    _coverage()
@@ -7,10 +7,12 @@ __license__ = "MIT"
 
 import sys
 import os
+import re
 import optparse
 import requests
 import json
 import datetime
+import time
 import uuid
 import inspect
 import logging
@@ -18,9 +20,17 @@ import pipes
 import subprocess
 import bz2
 import random
+import hashlib
+import bisect
+import shutil
+import tempfile
+import threading
+import weakref
+import atexit
+import functools
 import citizenshell
-import ast
-from math import sqrt
+from math import sqrt, ceil
+from array import array
 from dateutil import parser
 
 from optparse import OptionParser, OptionGroup
@@ -28,17 +38,66 @@ from optparse import OptionParser, OptionGroup
 from perftrackerlib.helpers.tee import Tee
 from perftrackerlib.helpers.decorators import cached_property
 from perftrackerlib.helpers.ptshell import ptShell, ptShellFromFile
+from perftrackerlib.helpers.retry import ptRetryPolicy, ptCircuitBreaker, CircuitOpenException
+from perftrackerlib.helpers.spool import ptSpool
+from perftrackerlib.helpers.compress import ptCompressor, ptBlockCompressor, pt_compress_encodings
+from perftrackerlib.helpers.multipart import ptMultipartBody
+from perftrackerlib.helpers.diskcache import ptDiskCache
+from perftrackerlib.helpers.stats import ptStats
 
 from dateutil.tz import tzlocal
 from collections import OrderedDict
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+try:
+    import ijson
+    from ijson.common import ObjectBuilder as _ptJsonObjectBuilder
+except ImportError:
+    ijson = None
+
 if sys.version_info >= (3, 0):
     import http.client as httplib
+    import queue
 else:
     import httplib
+    import Queue as queue
 
 API_VER = '1.0'
 PT_SERVER_DEFAULT_URL = "http://127.0.0.1:9000"
+PT_SERVER_POOL_CONNECTIONS = 4
+PT_SERVER_POOL_MAXSIZE = 16
+PT_SERVER_TIMEOUT = (10, None)  # (connect, read) seconds, None - wait forever
+
+PT_IDEMPOTENT_METHODS = ('get', 'head', 'options', 'put', 'delete')
+PT_OUTAGE_STATUSES = (502, 503, 504)  # failures for the circuit breaker, 500 can be caused by the request itself
+
+PT_UPLOAD_QUEUE_SIZE = 64
+PT_JSON_STREAM_BATCH = 1000  # tests loaded by ptSuite.readJson() at once
+PT_UPLOAD_FLUSH_TIMEOUT = 600  # seconds
+PT_UPLOAD_EXIT_TIMEOUT = 30  # seconds to wait at exit for the background uploads not flushed by ptSuite.fini()
+
+PT_CACHE_DIR = os.path.join(os.environ.get('XDG_CACHE_HOME', os.path.join(os.path.expanduser("~"), ".cache")),
+                            "perftrackerlib")
+
+PT_PROJECT_CACHE_TTL = 3600  # seconds, project name -> id lookups are cached for this time
+
+PT_ARTIFACT_BLOCK_SIZE = 1024 * 1024  # artifacts are read and sent by blocks of this size
+PT_ARTIFACT_COMPRESSION_BLOCK_SIZE = 4 * 1024 * 1024  # blocks compressed in parallel to a multi-stream bz2
+PT_ARTIFACT_LIST_PAGE_SIZE = 1000  # artifacts fetched per request by ptArtifact.iterate()
+
+PT_COMPRESSION_MIN_SIZE = 16 * 1024  # smaller job uploads are sent as is
+
+PT_JSON_CHUNK_SIZE = 64 * 1024
+PT_JSON_STREAM_THRESHOLD = 16 * 1024 * 1024  # jobs with bigger estimated json are streamed
 
 TEST_STATUSES = ['NOTTESTED', 'SKIPPED', 'INPROGRESS', 'SUCCESS', 'FAILED']
 
@@ -59,6 +118,94 @@ def pt_float(value):
     return float(fmt % (val)) * (1 if value > 0 else -1)
 
 
+# the pt_float() thresholds in ascending order, computed the same way: the number of thresholds
+# greater than the value is the number of decimal digits to keep
+_pt_float_thresholds = [100]
+while len(_pt_float_thresholds) < 24:
+    _pt_float_thresholds.append(_pt_float_thresholds[-1] / 10.0)
+_pt_float_thresholds.reverse()
+
+PT_FLOATS_NUMPY_MIN_SIZE = 64  # smaller lists are rounded by python code, numpy has a fixed overhead
+
+
+def _ptFloatsPython(values):
+    ret = array('d')
+    append = ret.append
+    nthr = len(_pt_float_thresholds)
+    for value in values:
+        if value > 100 or value < -100:
+            r = int(round(value))
+            if r > 2 ** 53 or r < -2 ** 53 or r == 100 or r == -100:
+                return None
+            append(r)
+        elif value < 0.00000001:
+            append(0)
+        else:
+            val = float(value)
+            append(float("%.*f" % (nthr - bisect.bisect_right(_pt_float_thresholds, val), val)))
+    return ret
+
+
+def _ptFloatsNumpy(values):
+    try:
+        v = numpy.asarray(values, dtype=numpy.float64).ravel()
+    except (OverflowError, TypeError, ValueError):
+        return None
+    if not numpy.isfinite(v).all() or (numpy.abs(v) > 2 ** 53).any():
+        return None
+
+    ret = numpy.zeros(len(v))
+    big = (v > 100) | (v < -100)
+    ret[big] = numpy.rint(v[big])
+    if (numpy.abs(ret[big]) == 100).any():
+        return None
+
+    mid = ~big & (v >= 0.00000001)
+    m = v[mid]
+    prec = len(_pt_float_thresholds) - numpy.searchsorted(_pt_float_thresholds, m, side='right')
+    scale = 10.0 ** prec
+    scaled = m * scale
+    r = numpy.rint(scaled) / scale  # the same as float("%.*f" % (prec, m)) unless m * scale is close to a tie
+    near = numpy.abs(scaled - numpy.floor(scaled) - 0.5) < 0.000001
+    if near.any():
+        r[near] = [float("%.*f" % (p, x)) for p, x in zip(prec[near].tolist(), m[near].tolist())]
+    ret[mid] = r
+
+    a = array('d')
+    if hasattr(a, 'frombytes'):
+        a.frombytes(ret.tobytes())
+    else:
+        a.fromstring(ret.tostring())
+    return a
+
+
+def _ptFloats(values):
+    """
+    pt_float() of the values packed to array('d') (see _ptCompactValues), or the list of pt_float() results
+    if the array can't hold them exactly: ints beyond 2**53, int 100 (values in (100, 100.5] are rounded to
+    int 100, but 100.0 is a float), not finite values
+    """
+    ret = None
+    if numpy is not None and len(values) >= PT_FLOATS_NUMPY_MIN_SIZE:
+        ret = _ptFloatsNumpy(values)
+    else:
+        try:
+            ret = _ptFloatsPython(values)
+        except (OverflowError, ValueError):
+            ret = None
+    return ret if ret is not None else [pt_float(v) for v in values]
+
+
+def pt_floats(values):
+    """
+    [pt_float(v) for v in values] computed at once, vectorized with numpy if it is installed
+
+    values - list, tuple, array or numpy array of numbers
+    """
+    ret = _ptFloats(values)
+    return _ptValues(ret) if type(ret) is array else ret
+
+
 def get_timestamp_from_datetime(time):
     assert isinstance(time, datetime.datetime)
     time = time.replace(tzinfo=tzlocal())
@@ -66,11 +213,294 @@ def get_timestamp_from_datetime(time):
     return int((time - epoch - time.utcoffset()).total_seconds() * 1000)
 
 
+_fromisoformat = getattr(datetime.datetime, 'fromisoformat', None)
+
+
+def _ptParseDatetime(s):
+    # the server returns ISO 8601 dates, datetime.fromisoformat() is two orders of magnitude faster than dateutil
+    if _fromisoformat:
+        try:
+            return _fromisoformat(s)
+        except ValueError:
+            pass
+    return parser.parse(s)
+
+
 class ptRuntimeException(Exception):
     pass
 
 
+class ptServerUnavailableException(ptRuntimeException):
+    # connection failed, circuit breaker is open or the server responded with 5xx status
+    pass
+
+
+def _request_not_sent(exc):
+    # the connection has not been established, so the request is safe to repeat even if it is not idempotent
+    if isinstance(exc, requests.exceptions.ConnectTimeout):
+        return True
+    reason = getattr(exc.args[0], 'reason', None) if exc.args else None
+    return isinstance(reason, requests.packages.urllib3.exceptions.NewConnectionError)
+
+
+def _retry_after(response):
+    try:
+        return float(response.headers.get('Retry-After'))
+    except (TypeError, ValueError):
+        return None
+
+
+# converters from pt objects to plain dicts generated from the classes _pt_json_fields, one per class
+_pt_json_converters = {}
+_pt_json_tz = tzlocal()
+_pt_json_tz_suffix = {}  # local time minute -> utc offset suffix, the offset can't change within a minute
+
+
+def _ptJsonDatetime(dt):
+    if type(dt) is not datetime.datetime or dt.tzinfo is not None:
+        return dt.replace(tzinfo=_pt_json_tz).isoformat()
+
+    key = (dt.year, dt.month, dt.day, dt.hour, dt.minute, getattr(dt, 'fold', 0))
+    suffix = _pt_json_tz_suffix.get(key)
+    if suffix is None:
+        if len(_pt_json_tz_suffix) > 4096:
+            _pt_json_tz_suffix.clear()
+        minute = dt.replace(second=0, microsecond=0)
+        suffix = minute.replace(tzinfo=_pt_json_tz).isoformat()[len(minute.isoformat()):]
+        _pt_json_tz_suffix[key] = suffix
+    return dt.isoformat() + suffix
+
+
+def _ptLocalDatetime(s):
+    # the json dates written by _ptJsonDatetime() are the local time with the utc offset, so the naive local
+    # time is the parsed one if the offset matches, the offset lookup is cached unlike the astimezone() one
+    dt = _ptParseDatetime(s)
+    if dt.tzinfo is None:
+        return dt
+    naive = dt.replace(tzinfo=None)
+    if _ptJsonDatetime(naive) == s:
+        return naive
+    return dt.astimezone(_pt_json_tz).replace(tzinfo=None)
+
+
+_pt_slots = {}  # class -> set of the slots of the class and its bases, None for the regular classes
+
+
+def _ptSlots(cls):
+    slots = _pt_slots.get(cls, False)
+    if slots is False:
+        if getattr(cls, '__slots__', None) is None:
+            slots = None
+        else:
+            slots = set(s for c in cls.__mro__ for s in c.__dict__.get('__slots__', ()))
+        _pt_slots[cls] = slots
+    return slots
+
+
+def _ptCompactValues(values):
+    """
+    Pack the scores or deviations list to an array of doubles if _ptValues() restores it exactly:
+    pt_float() returns floats within [-100, 100] and ints out of this range (and 0)
+    """
+    if type(values) not in (list, tuple):
+        return values
+    for v in values:
+        t = type(v)
+        if t is float:
+            if v == 0 or not -100 <= v <= 100:
+                return values
+        elif t is int:
+            if v != 0 and not 100 < abs(v) <= 2 ** 53:
+                return values
+        else:
+            return values
+    return array('d', values)
+
+
+def _ptCompactable(value):
+    # the value appended to the array of doubles is restored exactly by _ptValues(), see _ptCompactValues()
+    t = type(value)
+    if t is float:
+        return value != 0 and -100 <= value <= 100
+    if t is int:
+        return value == 0 or 100 < abs(value) <= 2 ** 53
+    return False
+
+
+def _ptValues(values):
+    return [int(v) if v > 100 or v < -100 or v == 0 else v for v in values]
+
+
+def _ptList(values):
+    return _ptValues(values) if type(values) is array else list(values)
+
+
+def _ptJsonExtras(obj):
+    """
+    Returns the (name, value) list of the object attributes not declared in _pt_json_fields
+    """
+    cls = type(obj)
+    if _ptSlots(cls) is not None and not cls.__dictoffset__:
+        return list(obj._extras.items()) if obj._extras else []
+    declared = cls._pt_json_fields
+    return [(k, v) for k, v in obj.__dict__.items() if k not in declared]
+
+
+def _ptJsonItems(obj):
+    """
+    Returns the (name, value) list of the object attributes in the json order: the declared
+    _pt_json_fields and then the other attributes
+    """
+    cls = type(obj)
+    if getattr(cls, '_pt_json_fields', None) is None:
+        return list(obj.__dict__.items())
+    slots = _ptSlots(cls)
+    if slots is None:
+        d = obj.__dict__
+        items = [(k, d.get(k)) for k in cls._pt_json_fields]
+    else:
+        items = [(k, getattr(obj, k if k in slots else "_" + k)) for k in cls._pt_json_fields]
+    return items + _ptJsonExtras(obj)
+
+
+class _ptSlotsView:
+    """
+    dict-like access to the json fields of a slotted object (see ptTest)
+    """
+
+    def __init__(self, obj):
+        self._obj = obj
+
+    def __contains__(self, name):
+        return name in type(self._obj)._pt_json_fields
+
+    def __getitem__(self, name):
+        return getattr(self._obj, name)
+
+    def __setitem__(self, name, value):
+        setattr(self._obj, name, value)
+
+    def __repr__(self):
+        return repr(dict(_ptJsonItems(self._obj)))
+
+
+def _ptJsonCompile(cls):
+    """
+    Generate the function converting the objects of the class to dicts from the class _pt_json_fields:
+    the declared fields are read directly (from the slots of the slotted classes) and the other attributes
+    are added after them, the same keys order and filtering as the reflective encoder: no private and
+    empty values. The classes without _pt_json_fields are walked by the reflective code.
+    """
+    fields = getattr(cls, '_pt_json_fields', None)
+    if fields is None:
+        return _ptJsonReflect
+
+    slots = _ptSlots(cls)
+    # the values needing a conversion go through the same _ptJsonValue() as the reflective encoder
+    value = ["    if type(v) in _converted: v = _value(v)"]
+
+    src = ["def convert(o):", "    j = _dict()"]
+    if slots is None:
+        src.append("    d = o.__dict__")
+    for key in fields:
+        if slots is None:
+            src.append("    v = d.get(%r)" % key)
+        else:
+            src.append("    v = o.%s" % (key if key in slots else "_" + key))
+        src += value
+        src.append("    if v: j[%r] = v" % key)
+    if slots is not None and not cls.__dictoffset__:
+        src.append("    for k, v in (o._extras.items() if o._extras else ()):")
+    else:
+        src.append("    for k, v in _extras(o):")
+    src += ["    " + line for line in value]
+    src.append("        if v and k[0] != '_': j[k] = v")
+    src.append("    return j")
+
+    ns = {'_dict': dict if sys.version_info >= (3, 7) else OrderedDict, '_converted': _pt_json_converted,
+          '_value': _ptJsonValue, '_extras': _ptJsonExtras}
+    exec("\n".join(src), ns)
+    return ns['convert']
+
+
+# the value types written to json after a _ptJsonValue() conversion
+_pt_json_converted = (array,) if sys.version_info >= (3, 0) else (array, str)
+
+
+def _ptJsonValue(val):
+    if type(val) is array:
+        return _ptValues(val)
+    if sys.version_info < (3, 0) and type(val) is str:
+        return val.decode(errors='ignore').encode('utf-8')
+    return val
+
+
+def _ptJsonReflect(obj):
+    j = dict() if sys.version_info >= (3, 7) else OrderedDict()
+    for key, val in _ptJsonItems(obj):
+        if key.startswith("_"):
+            continue
+        val = _ptJsonValue(val)
+        if val:
+            j[key] = val
+    return j
+
+
+def _ptJsonDefault(obj):
+    if isinstance(obj, datetime.datetime):
+        return _ptJsonDatetime(obj)
+    if isinstance(obj, uuid.UUID):
+        return str(obj)
+    if isinstance(obj, ptStats):
+        return obj.summary()
+
+    convert = _pt_json_converters.get(type(obj))
+    if convert is None:
+        convert = _pt_json_converters[type(obj)] = _ptJsonCompile(type(obj))
+    return convert(obj)
+
+
+# the floats which repr() writes with an exponent (out of [1e-4, 1e16)) and the not finite ones,
+# the strings are matched to skip them
+_pt_json_float_re = re.compile(r'"(?:[^"\\]|\\.)*"|(-?)(\d)(?:\.(\d+))?e([-+]\d+)|-?Infinity|NaN')
+_pt_json_float_hint = re.compile(r'\de[-+]\d|Infinity|NaN')
+
+
+def _ptJsonFloat(m):
+    # format the float the way orjson (ryu) does: 1.5e-05 -> 0.000015, 1e+16 -> 1e16, NaN -> null
+    text = m.group(0)
+    if text[0] == '"':
+        return text
+    if m.group(2) is None:
+        return "null"
+    sign, digits = m.group(1), m.group(2) + (m.group(3) or "")
+    point = int(m.group(4)) + 1  # the decimal point position after the first digit
+    if -5 < point <= 0:
+        return "%s0.%s%s" % (sign, "0" * -point, digits)
+    return "%s%s%se%d" % (sign, digits[0], "." + digits[1:] if len(digits) > 1 else "", point - 1)
+
+
+def _ptJsonWire(obj):
+    text = json.dumps(obj, cls=ptJsonEncoder, separators=(',', ':'), ensure_ascii=False)
+    if _pt_json_float_hint.search(text):
+        text = _pt_json_float_re.sub(_ptJsonFloat, text)
+    return text
+
+
 class ptJsonEncoder(json.JSONEncoder):
+    """
+    The pt* classes declare their wire fields in _pt_json_fields (in the order they are set in __init__),
+    the encoding code is generated once per class and produces the same json as the reflective one
+    """
+
+    def __init__(self, reflective=False, **kwargs):
+        """
+        reflective - walk the objects attributes on every call instead of the generated code (slow)
+        """
+        json.JSONEncoder.__init__(self, **kwargs)
+        if not reflective:
+            self.default = _ptJsonDefault
+
     def default(self, obj):
         j = OrderedDict()
         if not inspect.isclass(type(obj)):
@@ -79,18 +509,15 @@ class ptJsonEncoder(json.JSONEncoder):
             return obj.replace(tzinfo=tzlocal()).isoformat()
         if isinstance(obj, uuid.UUID):
             return str(obj)
+        if isinstance(obj, ptStats):
+            return obj.summary()
 
-        for key in obj.__dict__.keys():
+        for key, val in _ptJsonItems(obj):
             if key.startswith("_"):
                 continue
-            val = obj.__dict__[key]
+            val = _ptJsonValue(val)
             if val is None or not val:
                 continue
-            if type(val) == str:
-                try:
-                    val = val.decode(errors='ignore').encode('utf-8')
-                except AttributeError as e:
-                    pass
             j[key] = val
         return j
 
@@ -98,15 +525,176 @@ class ptJsonEncoder(json.JSONEncoder):
     def pretty(obj):
         return json.dumps(obj, cls=ptJsonEncoder, sort_keys=True, indent=4, separators=(',', ': '))
 
+    @staticmethod
+    def chunks(obj, pretty=False, chunk_size=PT_JSON_CHUNK_SIZE):
+        """
+        Generate the json of the object (e.g. ptSuite) in pieces of about chunk_size, the top level lists
+        are encoded item by item, so the whole json text is never kept in memory. The concatenated
+        chunks are the same as json.dumps(obj, cls=ptJsonEncoder, ...) output
+        """
+        if pretty:
+            enc = ptJsonEncoder(indent=4, separators=(',', ': '))
+            open_, sep, close, item_pad, value_pad = "{\n    ", ",\n    ", "\n}", "\n        ", "\n    "
+        else:
+            enc = ptJsonEncoder()
+            open_, sep, close, item_pad, value_pad = "{", ", ", "}", "", ""
+
+        if not isinstance(obj, dict):
+            obj = enc.default(obj)
+        if not obj:
+            yield "{}"
+            return
+
+        buf = []
+        size = 0
+        for n, (key, val) in enumerate(obj.items()):
+            buf.append("%s%s: " % (sep if n else open_, json.dumps(key)))
+            if isinstance(val, (list, tuple)) and val:
+                buf.append("[" + item_pad)
+                for i, item in enumerate(val):
+                    text = enc.encode(item)
+                    if pretty:
+                        text = text.replace("\n", item_pad)
+                    buf.append(("," + item_pad if pretty else ", ") + text if i else text)
+                    size += len(text)
+                    if size >= chunk_size:
+                        yield "".join(buf)
+                        buf = []
+                        size = 0
+                buf.append(value_pad + "]")
+            else:
+                text = enc.encode(val)
+                buf.append(text.replace("\n", value_pad) if pretty else text)
+        buf.append(close)
+        yield "".join(buf)
+
+    @staticmethod
+    def wire(obj):
+        """
+        Compact json for the server: no whitespace, the non-ascii characters are not escaped. It is encoded
+        by orjson if it is installed, the json module fallback produces the same text (see _ptJsonWire)
+        """
+        if orjson is not None:
+            try:
+                return orjson.dumps(obj, default=_ptJsonDefault,
+                                    option=orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_NON_STR_KEYS).decode('utf-8')
+            except TypeError as e:
+                logging.debug("orjson failed, falling back to json: %s" % str(e))
+        return _ptJsonWire(obj)
+
 
 class ptServer:
-    def __init__(self, pt_server_url=None):
+    _pt_json_fields = ('url', 'api_url')
+
+    def __init__(self, pt_server_url=None, pool_connections=PT_SERVER_POOL_CONNECTIONS,
+                 pool_maxsize=PT_SERVER_POOL_MAXSIZE, pool_block=False, timeout=PT_SERVER_TIMEOUT,
+                 retry_policy=None, circuit_breaker=None, spool_dir=None, compression=None,
+                 compression_min_size=PT_COMPRESSION_MIN_SIZE, cache_dir=PT_CACHE_DIR,
+                 project_cache_ttl=PT_PROJECT_CACHE_TTL):
+        """
+        pt_server_url    - perftracker url: 'http://perftracker.localdomain:9000'
+        pool_connections - number of per-host connection pools to keep
+        pool_maxsize     - max number of keep-alive connections kept per host
+        pool_block       - wait for a free connection instead of opening an extra one when
+                           all pool_maxsize connections are busy
+        timeout          - default requests timeout: 30 or (connect, read) tuple: (10, 300)
+        retry_policy     - ptRetryPolicy instance, ptRetryPolicy(max_attempts=1) disables retries
+        circuit_breaker  - ptCircuitBreaker instance, pass the same one to several ptServer
+                           instances to share the server state between them
+        spool_dir        - keep job uploads and artifacts in this directory while the server is
+                           unreachable and replay them later, see flushSpool()
+        compression      - Content-Encoding of the job uploads: 'gzip', 'deflate', 'zstd' or None,
+                           see pt_compress_encodings(). The server must support it, otherwise
+                           compression is switched off after the first rejected upload
+        compression_min_size - compress job uploads starting from this size (bytes)
+        cache_dir        - directory for the persistent caches (e.g. artifacts deduplication),
+                           None - disable them
+        project_cache_ttl - keep the getProjectId() results for this time (seconds) in memory and
+                           in cache_dir, so they are shared by the processes, 0 - disable. The project is
+                           looked up again once if the server rejects a job with the cached id
+        """
         if pt_server_url is None:
             pt_server_url = PT_SERVER_DEFAULT_URL
         self.url = None
         self.api_url = None
         self.setUrl(pt_server_url)
 
+        self._pool_connections = pool_connections
+        self._pool_maxsize = pool_maxsize
+        self._pool_block = pool_block
+        self._timeout = timeout
+        self._retry_policy = retry_policy if retry_policy else ptRetryPolicy()
+        self._circuit_breaker = circuit_breaker if circuit_breaker else ptCircuitBreaker()
+        self._session = None
+        self._session_lock = threading.Lock()
+
+        self._spool_lock = threading.Lock()
+        self._spooled = {}  # (kind, uuid) -> ids of the undelivered records in the spool
+        self._spool_replaying = None  # (kind, uuid) of the records being replayed
+        self.setSpool(spool_dir)
+
+        self._compressor = None
+        self._compression_min_size = compression_min_size
+        self.setCompression(compression)
+
+        self._cache_dir = cache_dir
+
+        self._project_cache_ttl = project_cache_ttl
+        self._project_ids = {}  # project name -> (id, expiration time)
+        self._project_names = {}  # cached project id -> name, to look the project up again if the id is stale
+
+    def setCompression(self, encoding):
+        """
+        encoding - 'gzip', 'deflate', 'zstd' or None - send the job uploads uncompressed
+        """
+        self._compressor = ptCompressor(encoding) if encoding else None
+
+    @property
+    def compression(self):
+        return self._compressor.encoding if self._compressor else None
+
+    @property
+    def retry_policy(self):
+        return self._retry_policy
+
+    @property
+    def circuit_breaker(self):
+        return self._circuit_breaker
+
+    def cache(self, namespace, ttl_sec=None):
+        """
+        Returns the ptDiskCache for the namespace of this server or None if the caches are disabled
+        """
+        if not self._cache_dir:
+            return None
+        host = self.url.split("://", 1)[-1].replace("/", "_").replace(":", "_")
+        return ptDiskCache(self._cache_dir, namespace=os.path.join(host, namespace), ttl_sec=ttl_sec)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def _http_session(self):
+        # requests.Session keeps connections alive, the adapter pools are thread-safe
+        with self._session_lock:
+            if self._session is None:
+                session = requests.Session()
+                adapter = requests.adapters.HTTPAdapter(pool_connections=self._pool_connections,
+                                                        pool_maxsize=self._pool_maxsize,
+                                                        pool_block=self._pool_block)
+                session.mount("http://", adapter)
+                session.mount("https://", adapter)
+                self._session = session
+            return self._session
+
+    def close(self):
+        with self._session_lock:
+            if self._session is not None:
+                self._session.close()
+                self._session = None
+
     def setUrl(self, pt_server_url):
         if not pt_server_url.startswith("http"):
             logging.debug("adding http:// prefix to server url: %s" % pt_server_url)
@@ -118,46 +706,160 @@ class ptServer:
         if not project_name:
             return None
 
-        resp = self.get("/0/project/")
-
-        if resp.status_code != httplib.OK:
-            raise ptRuntimeException("can't get the list of existing projects: %d, %s" %
-                                     (j['http_status'], j.get('message', str(j))))
+        project_id = self._cachedProjectId(project_name)
+        if project_id is not None:
+            return project_id
 
-        for project_json in resp.json:
+        # the servers not supporting the name filter return all the projects
+        projects = self._getProjects(name=project_name)
+        for project_json in projects:
             if project_json['name'] == project_name:
+                self._cacheProjectId(project_name, project_json['id'])
                 return project_json['id']
 
+        if not projects:
+            projects = self._getProjects()
+        raise self._projectNotFound(project_name, projects)
+
+    @staticmethod
+    def _projectNotFound(project_name, projects):
         msg = "\n".join(["project name validation failed, project '%s' doesn't exist" % project_name,
-                         "available projects are: %s" % (", ".join(["'%s'" % p['name'] for p in resp.json]))])
-        raise ptRuntimeException(msg)
+                         "available projects are: %s" % (", ".join(["'%s'" % p['name'] for p in projects]))])
+        return ptRuntimeException(msg)
+
+    def _getProjects(self, **params):
+        return self._projectsListed(self.get("/0/project/", params=params))
+
+    @staticmethod
+    def _projectsListed(resp):
+        if resp.status_code != httplib.OK:
+            j = resp.json
+            raise ptRuntimeException("can't get the list of existing projects: %d, %s" %
+                                     (resp.status_code, j.get('message', str(j)) if isinstance(j, dict) else str(j)))
+        return resp.json
+
+    def _cachedProjectId(self, project_name):
+        if not self._project_cache_ttl:
+            return None
+
+        project_id, expires = self._project_ids.get(project_name, (None, 0))
+        if expires > time.time():
+            return project_id
+
+        cache = self.cache('projects', ttl_sec=self._project_cache_ttl)
+        project_id = cache.get(project_name) if cache else None
+        if project_id is not None:
+            # the disk entry may be older, but it's not worth reading its expiration time
+            self._project_ids[project_name] = (project_id, time.time() + self._project_cache_ttl)
+            self._project_names[project_id] = project_name
+        return project_id
+
+    def _cacheProjectId(self, project_name, project_id):
+        if not self._project_cache_ttl:
+            return
+        self._project_ids[project_name] = (project_id, time.time() + self._project_cache_ttl)
+        self._project_names[project_id] = project_name
+        cache = self.cache('projects', ttl_sec=self._project_cache_ttl)
+        if cache:
+            cache.set(project_name, project_id)
+
+    def forgetProjectId(self, project_name):
+        """
+        Drop the cached project id, e.g. if the project was re-created on the server
+        """
+        project_id, expires = self._project_ids.pop(project_name, (None, 0))
+        self._project_names.pop(project_id, None)
+        cache = self.cache('projects')
+        if cache:
+            cache.delete(project_name)
 
-    def _http_request(self, method, url, decode_json=True, *args, **kwargs):
+    def _http_request(self, method, url, decode_json=True, idempotent=None, *args, **kwargs):
 
         url = "%s/%s" % (self.api_url, url.lstrip("/"))
 
         logging.debug("%s %s ..." % (method, url))
 
-        # FIXME: handle retry
+        if idempotent is None:
+            idempotent = method in PT_IDEMPOTENT_METHODS
+
         headers = {'Content-Type': 'application/json'} if method == "GET" else {}
-        try:
-            response = requests.__dict__[method](url, headers=headers, *args, **kwargs)
-        except requests.exceptions.ConnectionError as e:
-            raise ptRuntimeException(str(e))
+        headers.update(kwargs.pop('headers', None) or {})
+        kwargs.setdefault('timeout', self._timeout)
+
+        policy = self._retry_policy
+        attempt = 0
+        while True:
+            attempt += 1
+            try:
+                self._circuit_breaker.before_request()
+            except CircuitOpenException as e:
+                raise ptServerUnavailableException("%s %s: %s" % (method, url, str(e)))
+
+            error, failed = None, None
+            try:
+                request_kwargs = kwargs
+                if callable(kwargs.get('data')):
+                    # a streamed body can be read only once, so every attempt gets a new one
+                    request_kwargs = dict(kwargs, data=kwargs['data']())
+                response = self._http_session().request(method, url, headers=headers, *args, **request_kwargs)
+                failed = response.status_code in PT_OUTAGE_STATUSES
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+                error, failed = e, True
+            finally:
+                if failed is None:
+                    # a local error (broken body, invalid url, ...) doesn't tell anything about the server,
+                    # but a half-open trial request must not leave the circuit stuck
+                    self._circuit_breaker.release()
+                elif failed:
+                    self._circuit_breaker.failure()
+                else:
+                    self._circuit_breaker.success()
+
+            if error is not None:
+                if attempt < policy.max_attempts and (idempotent or _request_not_sent(error)) and \
+                        self._circuit_breaker.state != ptCircuitBreaker.OPEN:
+                    logging.warning("%s %s failed, attempt %d of %d: %s" %
+                                    (method, url, attempt, policy.max_attempts, str(error)))
+                    policy.sleep(attempt)
+                    continue
+                raise ptServerUnavailableException(str(error))
 
-        if decode_json or response.status_code != httplib.OK:
+            if idempotent and attempt < policy.max_attempts and policy.retry_status(response.status_code):
+                logging.warning("%s %s status %d, attempt %d of %d" %
+                                (method, url, response.status_code, attempt, policy.max_attempts))
+                response.close()
+                policy.sleep(attempt, _retry_after(response))
+                continue
+            break
+
+        return self._checkResponse(method, url, response, decode_json, ranged='Range' in headers,
+                                   streamed=kwargs.get('stream'))
+
+    def _checkResponse(self, method, url, response, decode_json, ranged=False, streamed=False):
+        """
+        Decode the json response (and the json error message of failed requests), log it
+        """
+        ok = response.status_code in (httplib.OK, httplib.PARTIAL_CONTENT)
+        if response.status_code == httplib.REQUESTED_RANGE_NOT_SATISFIABLE and ranged:
+            ok = True  # the range starts at the end, the caller checks the Content-Range
+        if decode_json or not ok:
             text = response.text.encode(response.encoding if response.encoding else 'utf-8', 'strict')
             text = text.decode('utf-8', 'strict')
             try:
                 j = json.loads(text)
                 response.json = j
             except ValueError as e:
-                raise ptRuntimeException("%s\nresponse:%s" % (str(e), str(text.encode('utf-8'))))
+                exc = ptServerUnavailableException if response.status_code >= httplib.INTERNAL_SERVER_ERROR \
+                    else ptRuntimeException
+                raise exc("%s\nresponse:%s" % (str(e), str(text.encode('utf-8'))))
 
-        if response.status_code == httplib.OK:
-            if logging.getLogger().getEffectiveLevel() >= logging.DEBUG:
+        if ok:
+            if logging.getLogger().isEnabledFor(logging.DEBUG):
                 if decode_json:
                     logging.debug("%s %s ... response:\n%s" % (method, url, ptJsonEncoder.pretty(j)))
+                elif streamed:
+                    logging.debug("%s %s ... response size %s" %
+                                  (method, url, response.headers.get('Content-Length', 'unknown')))
                 else:
                     logging.debug("%s %s ... response size %d" % (method, url, len(response.content)))
         else:
@@ -166,8 +868,229 @@ class ptServer:
 
         return response
 
-    def post(self, url, decode_json=True, *args, **kwargs):
-        return self._http_request('post', url, decode_json=decode_json, *args, **kwargs)
+    def setSpool(self, spool_dir):
+        """
+        spool_dir - directory to keep job uploads and artifacts in while the server is unreachable, None - disable
+        """
+        self._spool = ptSpool(spool_dir) if spool_dir else None
+        self._spool_replayed = False
+
+    @property
+    def spool(self):
+        return self._spool
+
+    def _spoolRecord(self, kind, key, exc, **kwargs):
+        log = logging.debug if (kind, str(key)) in self._spooled else logging.warning
+        log("%s %s upload failed, spooling it to %s: %s" % (kind, key, self._spool.spool_dir, str(exc)))
+        rec_id = self._spool.append(kind, key, **kwargs)
+        self._spooled.setdefault((kind, str(key)), set()).add(rec_id)
+
+    def _replaySpool(self, kind, key):
+        # keep the order: leftovers of previous runs and everything spooled for this object go first
+        with self._spool_lock:
+            if self._spool_replaying is not None or self._spool.empty() or \
+                    self._circuit_breaker.state == ptCircuitBreaker.OPEN:
+                return
+            if self._spool_replayed and (kind, str(key)) not in self._spooled:
+                return
+        try:
+            self.flushSpool()
+        except ptServerUnavailableException as e:
+            logging.debug("spool replay failed: %s" % str(e))
+
+    def flushSpool(self):
+        """
+        Replay the spool in order, job documents are merged by job uuid and artifacts deduplicated
+        by artifact uuid. Returns the number of delivered jobs and artifacts (0 if the spool is being
+        replayed by another thread), raises ptServerUnavailableException if the server is still unreachable.
+        The records are sent without holding the spool lock, the objects being replayed are spooled meanwhile.
+        """
+        assert self._spool is not None
+
+        groups = OrderedDict()
+        with self._spool_lock:
+            if self._spool_replaying is not None:
+                return 0
+            for rec in self._spool.records():
+                groups.setdefault((rec['kind'], rec['key']), []).append(rec)
+            self._spool_replaying = set(groups)
+
+        done = []
+        delivered = 0
+        try:
+            for (kind, key), recs in groups.items():
+                last = recs[-1]
+                if kind == 'job':
+                    doc = _mergeJobDocs([r['data'] for r in recs])
+                    try:
+                        self._postJob(last['meta']['project_id'], json.dumps(doc))
+                        delivered += 1
+                    except ptServerUnavailableException:
+                        raise
+                    except ptRuntimeException as e:
+                        logging.error("dropping spooled job %s rejected by the server: %s" % (key, str(e)))
+                elif kind == 'artifact':
+                    resp = ptArtifact(self, uuid1=key, **last['meta'])._upload(last['blob'])
+                    if resp.status_code >= httplib.INTERNAL_SERVER_ERROR:
+                        raise ptServerUnavailableException("artifact %s upload failed, status %d" %
+                                                           (key, resp.status_code))
+                    if resp.status_code == httplib.OK:
+                        delivered += 1
+                    else:
+                        logging.error("dropping spooled artifact %s rejected by the server, status %d" %
+                                      (key, resp.status_code))
+                else:
+                    logging.warning("dropping spooled record of unknown kind: %s" % kind)
+                done += [r['id'] for r in recs]
+        finally:
+            done = set(done)
+            with self._spool_lock:
+                self._spool.remove(done)
+                for (kind, key), recs in groups.items():
+                    ids = self._spooled.get((kind, key))
+                    if ids is not None:
+                        ids.difference_update(r['id'] for r in recs if r['id'] in done)
+                        if not ids:
+                            del self._spooled[(kind, key)]
+                self._spool_replayed = True
+                self._spool_replaying = None
+
+        if delivered:
+            logging.info("%d spooled jobs and artifacts uploaded from %s" % (delivered, self._spool.spool_dir))
+        return delivered
+
+    def _refreshProjectId(self, project_id):
+        """
+        Drop the cached project id rejected by the server and look the project up again,
+        returns the new id or None if it is the same or unknown
+        """
+        project_name = self._project_names.get(project_id)
+        if project_name is None:
+            return None
+        self.forgetProjectId(project_name)
+        try:
+            new_id = self.getProjectId(project_name)
+        except ptRuntimeException as e:
+            logging.debug(str(e))
+            return None
+        if new_id == project_id:
+            return None
+        # the stale id still leads to the project, see _postJob()
+        self._project_names[project_id] = project_name
+        logging.warning("project '%s' id has changed: %d -> %d" % (project_name, project_id, new_id))
+        return new_id
+
+    def _postJob(self, project_id, json_data):
+        def stream():
+            return (chunk.encode('utf-8') for chunk in json_data())
+
+        if callable(json_data):
+            data = stream
+        else:
+            data = json_data if isinstance(json_data, bytes) else json_data.encode('utf-8')
+
+        # the caller may still hold the project id which was looked up again after it became stale
+        project_name = self._project_names.get(project_id)
+        project_id = (self._cachedProjectId(project_name) if project_name else None) or project_id
+
+        response = self._postJobTo(project_id, data)
+        if response.status_code in (httplib.NOT_FOUND, httplib.BAD_REQUEST):
+            # the project could be re-created on the server after its id was cached
+            new_id = self._refreshProjectId(project_id)
+            if new_id is not None:
+                response = self._postJobTo(new_id, data)
+
+        return self._jobPosted(response)
+
+    @staticmethod
+    def _jobPosted(response):
+        if response.status_code != httplib.OK:
+            exc = ptServerUnavailableException if response.status_code >= httplib.INTERNAL_SERVER_ERROR \
+                else ptRuntimeException
+            logging.error("job json upload failed, status %d, %s" % (response.status_code, response.text))
+            raise exc("Suite run results upload failed, status %d:\n%s" % (response.status_code, response.text))
+        logging.info("status %d - job json uploaded, %s" % (response.status_code, response.text))
+        return response
+
+    def _postJobTo(self, project_id, data):
+        # the job is addressed by uuid, so re-posting it is harmless
+        url = '%d/job/' % project_id
+        compressor = self._compressor
+        if compressor is None or (not callable(data) and len(data) < self._compression_min_size):
+            response = self.post(url, decode_json=False, data=data, idempotent=True)
+        else:
+            def compressed():
+                return compressor.chunks(data())
+
+            try:
+                response = self.post(url, decode_json=False, idempotent=True,
+                                     data=compressed if callable(data) else compressor.compress(data),
+                                     headers={'Content-Encoding': compressor.encoding})
+                rejected = response.status_code in (httplib.UNSUPPORTED_MEDIA_TYPE, httplib.BAD_REQUEST)
+            except ptServerUnavailableException:
+                raise
+            except ptRuntimeException as e:
+                # the error response is not json, e.g. a web server page
+                rejected = True
+                logging.debug(str(e))
+
+            if rejected:
+                logging.warning("%s compressed job upload is rejected, retrying uncompressed" % compressor.encoding)
+                response = self.post(url, decode_json=False, data=data, idempotent=True)
+                if response.status_code == httplib.OK:
+                    logging.warning("the server doesn't accept %s compressed uploads, compression is switched off" %
+                                    compressor.encoding)
+                    self._compressor = None
+        return response
+
+    def _sendOrSpool(self, kind, key, send, **spool_kwargs):
+        """
+        send() uploads the object and returns the response, the object is spooled if the server is
+        unreachable or if its earlier uploads are still in the spool
+        """
+        key = str(key)
+
+        self._replaySpool(kind, key)
+        with self._spool_lock:
+            spooled = (kind, key) in self._spooled or (kind, key) in (self._spool_replaying or ())
+
+        if spooled:
+            exc = "earlier uploads are not delivered yet"
+        else:
+            try:
+                response = send()
+                if response.status_code < httplib.INTERNAL_SERVER_ERROR:
+                    return response
+                exc = "status %d" % response.status_code
+            except ptServerUnavailableException as e:
+                exc = e
+
+        with self._spool_lock:
+            self._spoolRecord(kind, key, exc, **spool_kwargs)
+        return None
+
+    def postJob(self, project_id, json_data, job_uuid=None):
+        """
+        json_data - job json text or a function returning the json text chunks to stream it
+                    (see ptJsonEncoder.chunks), the job_uuid is required then
+
+        Returns the server response or None if the server is unreachable and the job json is spooled
+        """
+        if self._spool is None:
+            return self._postJob(project_id, json_data)
+
+        if job_uuid is None:
+            assert not callable(json_data), "job_uuid is required for streamed job json"
+            job_uuid = json.loads(json_data)['uuid']
+        return self._sendOrSpool('job', job_uuid, lambda: self._postJob(project_id, json_data),
+                                 meta={'project_id': project_id}, data=json_data)
+
+    def post(self, url, decode_json=True, idempotent=False, *args, **kwargs):
+        """
+        idempotent - set to True if repeating the request is harmless (e.g. the object is addressed by uuid),
+                     only such POST requests are retried after they could have reached the server
+        """
+        return self._http_request('post', url, decode_json=decode_json, idempotent=idempotent, *args, **kwargs)
 
     def get(self, url, decode_json=True, *args, **kwargs):
         return self._http_request('get', url, decode_json=decode_json, *args, **kwargs)
@@ -179,9 +1102,177 @@ class ptServer:
         return self._http_request('patch', url, decode_json=decode_json, *args, **kwargs)
 
 
+def _mergeJobDocs(docs):
+    """
+    Coalesce job documents posted one after another into one: the first document defines the
+    append/replace mode, the later ones override the job header and env nodes, tests are merged
+    by uuid keeping the latest state of every test
+    """
+    merged = OrderedDict(docs[0])
+    tests = OrderedDict()
+    for doc in docs:
+        for key, val in doc.items():
+            if key not in ('append', 'replace', 'tests'):
+                merged[key] = val
+        for t in doc.get('tests', []):
+            tests[t.get('uuid', None) or id(t)] = t
+    if tests:
+        merged['tests'] = list(tests.values())
+    return merged
+
+
+_pt_upload_workers = weakref.WeakSet()
+
+
+def _ptCloseUploadWorkers():
+    for worker in list(_pt_upload_workers):
+        try:
+            if not worker.close(PT_UPLOAD_EXIT_TIMEOUT):
+                logging.error("background job upload didn't finish in %d sec at exit" % PT_UPLOAD_EXIT_TIMEOUT)
+        except Exception:
+            logging.exception("background job upload failed at exit")
+
+
+atexit.register(_ptCloseUploadWorkers)
+
+# id(artifact) -> (artifact, filename) of the --pt-log-upload stdout & stderr logs not uploaded by ptSuite.fini() yet
+_pt_pending_outputs = OrderedDict()
+
+
+def _ptUploadOutput(artifact, filename):
+    if _pt_pending_outputs.pop(id(artifact), None) is not None and os.path.getsize(filename):
+        artifact.upload(filename)
+
+
+def _ptUploadPendingOutputs():
+    for artifact, filename in list(_pt_pending_outputs.values()):
+        try:
+            _ptUploadOutput(artifact, filename)
+        except Exception:
+            logging.exception("%s upload failed at exit" % artifact.filename)
+
+
+atexit.register(_ptUploadPendingOutputs)
+
+
+class ptUploadWorker:
+    """
+    Background job uploader: the benchmark thread puts serialized job documents into a bounded
+    queue and waits only if the queue is full, the worker thread coalesces everything queued so
+    far into one document and posts it. A document which failed to upload is merged into the next one.
+    The uploads not flushed by close() are waited for at exit for PT_UPLOAD_EXIT_TIMEOUT at most
+    """
+    def __init__(self, pt_server, queue_size=PT_UPLOAD_QUEUE_SIZE):
+        assert isinstance(pt_server, ptServer)
+
+        self._pt_server = pt_server
+        self._queue = queue.Queue(queue_size)
+        self._lock = threading.Lock()
+        self._thread = None
+        self._failed = None  # (project_id, json_data, job_uuid) not uploaded yet
+
+    def put(self, project_id, json_data, job_uuid=None):
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="ptUploadWorker")
+                self._thread.daemon = True
+                self._thread.start()
+                _pt_upload_workers.add(self)
+        self._queue.put((project_id, json_data, job_uuid))
+
+    def _run(self):
+        while True:
+            items = [self._queue.get()]
+            while items[-1] is not None:
+                try:
+                    items.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            try:
+                jobs = [i for i in items if i is not None]
+                if jobs:
+                    self._upload(jobs)
+            except Exception:
+                # the worker must outlive any failure, otherwise put() blocks forever on the full queue
+                logging.exception("background job upload failed, the queued uploads are dropped")
+            finally:
+                for _ in items:
+                    self._queue.task_done()
+
+            if items[-1] is None:
+                return
+
+    def _upload(self, jobs):
+        with self._lock:
+            if self._failed:
+                jobs.insert(0, self._failed)
+                self._failed = None
+
+        project_id, json_data, job_uuid = jobs[-1]
+        if len(jobs) > 1:
+            logging.debug("coalescing %d job uploads" % len(jobs))
+            json_data = json.dumps(_mergeJobDocs([json.loads(j, object_pairs_hook=OrderedDict) for _, j, _ in jobs]))
+
+        try:
+            self._pt_server.postJob(project_id, json_data, job_uuid)
+        except ptRuntimeException as e:
+            logging.error("background job upload failed, it will be retried with the next one: %s" % str(e))
+            with self._lock:
+                self._failed = (project_id, json_data, job_uuid)
+
+    def flush(self, timeout=None):
+        """
+        Wait until everything queued is uploaded, returns False on timeout
+        """
+        deadline = None if timeout is None else datetime.datetime.now() + datetime.timedelta(seconds=timeout)
+        with self._queue.all_tasks_done:
+            while self._queue.unfinished_tasks:
+                remaining = None
+                if deadline is not None:
+                    remaining = (deadline - datetime.datetime.now()).total_seconds()
+                    if remaining <= 0:
+                        return False
+                self._queue.all_tasks_done.wait(remaining)
+
+        with self._lock:
+            failed, self._failed = self._failed, None
+        if failed:
+            self._pt_server.postJob(*failed)
+        return True
+
+    def close(self, timeout=None):
+        """
+        Flush the queue and stop the worker thread, returns False on timeout
+        """
+        if not self.flush(timeout):
+            return False
+        with self._lock:
+            thread, self._thread = self._thread, None
+        if thread is not None and thread.is_alive():
+            self._queue.put(None)
+            thread.join()
+        _pt_upload_workers.discard(self)
+        return True
+
+
 class ptArtifact:
+    _pt_json_fields = ('uuid', 'mime', 'size', 'filename', 'description', 'ttl_days', 'uploaded_dt', 'expires_dt',
+                       'inline', 'compression', 'linked_uuids', 'unlinked_uuids')
+
     def __init__(self, pt_server=None, uuid1=None, filename='', description='', ttl_days=180,
-                 mime=None, inline=False, compression=False, linked_uuids=None, validate=True):
+                 mime=None, inline=False, compression=False, linked_uuids=None, validate=True,
+                 compression_workers=None, compression_block_size=PT_ARTIFACT_COMPRESSION_BLOCK_SIZE,
+                 dedup=False):
+        """
+        compression_workers    - number of threads compressing the file, None - the number of CPUs
+        compression_block_size - file blocks of this size are compressed in parallel
+        dedup                  - don't upload the file if an artifact with the same content (and name,
+                                 mime, inline and compression) was uploaded from this host before,
+                                 link the existing artifact instead, take its uuid and update its
+                                 description and ttl. The content hash is remembered by the file path,
+                                 size and mtime, so the unchanged files are not read again
+        """
         assert isinstance(pt_server, ptServer)
         assert linked_uuids is None or type(linked_uuids) is list
 
@@ -199,6 +1290,10 @@ class ptArtifact:
         self.unlinked_uuids = set()
 
         self._pt_server = pt_server
+        self._compressor = None  # created on the first compressed upload
+        self._compression_workers = compression_workers
+        self._compression_block_size = compression_block_size
+        self._dedup = dedup
         self._url_list = "/0/artifact/"
         self._url = "/0/artifact/%s" % (self.uuid)
         self._url_download = "/0/artifact_content/%s" % (self.uuid)
@@ -216,96 +1311,454 @@ class ptArtifact:
         return self._pt_server.get(self._url)
 
     def link(self, uuids):
+        return self._pt_server.post(self._url, data=self._linkData(uuids), idempotent=True)
+
+    def _linkData(self, uuids):
         assert type(uuids) is list
         uuids = [str(u) for u in uuids]
         self.linked_uuids |= set(uuids)
-        data = {'linked_uuids': json.dumps(list(self.linked_uuids))}
-        return self._pt_server.post(self._url, data=data)
+        return {'linked_uuids': json.dumps(list(self.linked_uuids))}
 
     def unlink(self, uuids):
+        return self._pt_server.post(self._url, data=self._unlinkData(uuids), idempotent=True)
+
+    def _unlinkData(self, uuids):
         assert type(uuids) is list
         uuids = [str(u) for u in uuids]
         self.linked_uuids |= set(uuids)
         self.unlinked_uuids -= set(uuids)
-        data = {'unlinked_uuids': json.dumps(list(self.unlinked_uuids))}
-        return self._pt_server.post(self._url, data=data)
+        return {'unlinked_uuids': json.dumps(list(self.unlinked_uuids))}
 
     def update(self):
+        return self._pt_server.post(self._url, data=self._updateData(), idempotent=True)
+
+    def _updateData(self):
         assert self.uuid is not None
 
         # FIXME: copy-paste
-        data = {'description': self.description, 'ttl_days': self.ttl_days, 'mime': self.mime,
+        return {'description': self.description, 'ttl_days': self.ttl_days, 'mime': self.mime,
                 'filename': self.filename, 'inline': self.inline,
                 'linked_uuids': json.dumps(list(self.linked_uuids)),
                 'unlinked_uuids': json.dumps(list(self.unlinked_uuids))
                 }
 
-        return self._pt_server.post(self._url, data=data)
+    def upload(self, filepath, progress=None):
+        """
+        filepath - file to upload, it is streamed from disk (and bz2-compressed to a temporary file
+                   first if compression is set), so the memory usage doesn't depend on the file size
+        progress - function called with (bytes sent, total bytes) as the upload goes
 
-    def upload(self, filepath):
-        assert self.uuid is not None
+        Returns the server response or None if the server is unreachable and the artifact is spooled
+        """
+        cache = self._pt_server.cache('artifacts') if self._dedup else None
+        if cache:
+            ttl_sec = self._cacheTtlSec()
+            key = self._contentKey(self._fileDigest(cache, filepath, ttl_sec), filepath)
+            resp = self._linkExisting(cache, key)
+            if resp is not None:
+                return resp
+
+        resp = self._sendOrSpool(filepath, progress)
+
+        if cache and resp is not None and resp.status_code == httplib.OK:
+            cache.set(key, str(self.uuid), ttl_sec=ttl_sec)
+        return resp
 
-        if not self.filename:
-            self.filename = os.path.basename(filepath)
+    def _cacheTtlSec(self):
+        # the dedup cache entries live as long as the artifact, None - forever
+        ttl_days = int(self.ttl_days or 0)
+        return ttl_days * 86400 if ttl_days else None
 
-        f = open(filepath, 'rb')
-        if self.compression:
-            data = bz2.compress(f.read())
-        else:
-            data = f.read()
-        f.close()
+    @staticmethod
+    def _fileDigest(cache, filepath, ttl_sec):
+        # the file path, size and mtime -> sha256 shortcut saves re-reading the unchanged files
+        st = os.stat(filepath)
+        file_key = json.dumps(['file', os.path.realpath(filepath), st.st_size, st.st_mtime, st.st_ino])
+        digest = cache.get(file_key)
+        if digest is None:
+            h = hashlib.sha256()
+            with open(filepath, 'rb') as f:
+                while True:
+                    block = f.read(PT_ARTIFACT_BLOCK_SIZE)
+                    if not block:
+                        break
+                    h.update(block)
+            digest = h.hexdigest()
+            cache.set(file_key, digest, ttl_sec=ttl_sec)
+        return digest
+
+    def _contentKey(self, hexdigest, filepath):
+        filename = self.filename or os.path.basename(filepath)
+        return json.dumps([hexdigest, filename, self.mime, bool(self.inline), bool(self.compression)])
+
+    def _coveringTtl(self, existing):
+        """
+        Returns the ttl (days since the existing artifact upload) which keeps it at least as long as this
+        artifact would be kept, 0 - infinite
+        """
+        if not self.ttl_days or not existing.ttl_days:
+            return 0
 
-        files = {'file': data}
+        def _naive(dt):
+            return dt.astimezone(tzlocal()).replace(tzinfo=None) if dt.tzinfo else dt
 
-        # FIXME: copy-paste
-        data = {'description': self.description, 'ttl_days': self.ttl_days, 'mime': self.mime,
-                'filename': self.filename, 'inline': self.inline, 'compression': self.compression,
-                'linked_uuids': json.dumps(list(self.linked_uuids)),
-                'unlinked_uuids': json.dumps(list(self.unlinked_uuids))
-                }
+        wanted = datetime.datetime.now() + datetime.timedelta(days=int(self.ttl_days))
+        if _naive(existing.expires_dt) >= wanted:
+            return existing.ttl_days
+        days = int(ceil((wanted - _naive(existing.uploaded_dt)).total_seconds() / 86400))
+        return max(existing.ttl_days, days)
 
-        return self._pt_server.post(self._url, files=files, data=data)
+    def _linkExisting(self, cache, key):
+        uuid1 = cache.get(key)
+        if uuid1 is None:
+            return None
 
-    def list(self, limit=10, offset=0):
-        resp = self._pt_server.get(self._url_list)
+        try:
+            resp = ptArtifact(self._pt_server, uuid1=uuid1).info()
+            if resp.status_code != httplib.OK:
+                cache.delete(key)
+                return None
+            existing = self._reused(resp.json)
+            if existing is None:
+                return None
+            resp = existing.update()
+        except ptRuntimeException as e:
+            logging.debug("can't reuse artifact %s: %s" % (uuid1, str(e)))
+            return None
+        return self._adopt(existing, resp)
+
+    def _reused(self, info):
+        """
+        Returns the existing artifact (by the info json) to update with this artifact description, ttl and links
+        """
+        try:
+            existing = self._fromListItem(info)
+            existing.description = self.description
+            existing.ttl_days = self._coveringTtl(existing)
+        except (KeyError, ValueError, TypeError) as e:
+            logging.debug("can't reuse artifact, unexpected info: %s" % str(e))
+            return None
+        existing.linked_uuids = set(self.linked_uuids)
+        return existing
+
+    def _adopt(self, existing, resp):
         if resp.status_code != httplib.OK:
-            return resp, []
+            return None
 
-        ret = []
+        logging.info("artifact with the same content is found: %s, linking it instead of upload" % existing.uuid)
+        self.uuid = existing.uuid
+        self._url = existing._url
+        self._url_download = existing._url_download
+        return resp
 
+    def _sendOrSpool(self, filepath, progress):
+        if self._pt_server.spool is None:
+            return self._upload(filepath, progress)
+
+        meta = {'filename': self.filename or os.path.basename(filepath), 'description': self.description,
+                'ttl_days': self.ttl_days, 'mime': self.mime, 'inline': self.inline,
+                'compression': self.compression, 'linked_uuids': list(self.linked_uuids)}
+        return self._pt_server._sendOrSpool('artifact', self.uuid, lambda: self._upload(filepath, progress),
+                                            meta=meta, blob_path=filepath)
+
+    def _compress(self, filepath):
+        if self._compressor is None:
+            self._compressor = ptBlockCompressor('bz2', workers=self._compression_workers,
+                                                 block_size=self._compression_block_size)
+        fd, tmp = tempfile.mkstemp(prefix="pt-artifact-", suffix=".bz2")
+        os.close(fd)
+        try:
+            size = self._compressor.compress_file(filepath, tmp)
+        except Exception:
+            os.unlink(tmp)
+            raise
+        logging.debug("%s compressed by %s: %d -> %d bytes" %
+                      (filepath, repr(self._compressor), os.path.getsize(filepath), size))
+        return tmp
+
+    def _upload(self, filepath, progress=None):
+        assert self.uuid is not None
+
+        tmp = self._compress(filepath) if self.compression else None
+        try:
+            body = self._uploadBody(filepath, tmp, progress)
+            # the body is read from disk again on every retry
+            return self._pt_server.post(self._url, data=body, headers={'Content-Type': body.content_type},
+                                        idempotent=True)
+        finally:
+            if tmp:
+                os.unlink(tmp)
+
+    def _uploadBody(self, filepath, tmp=None, progress=None):
+        """
+        Returns the multipart body with the filepath (or its compressed copy tmp) and the artifact fields
+        """
+        if not self.filename:
+            self.filename = os.path.basename(filepath)
+
+        # FIXME: copy-paste
+        data = OrderedDict([('description', self.description), ('ttl_days', self.ttl_days), ('mime', self.mime),
+                            ('filename', self.filename), ('inline', self.inline), ('compression', self.compression),
+                            ('linked_uuids', json.dumps(list(self.linked_uuids))),
+                            ('unlinked_uuids', json.dumps(list(self.unlinked_uuids)))])
+        return ptMultipartBody(data, 'file', tmp or filepath, filename='file', progress=progress,
+                               block_size=PT_ARTIFACT_BLOCK_SIZE)
+
+    def _fromListItem(self, item):
         def _bool(val):
             return val in ("True", "true", True, "Yes", "yes", "y", 1)
 
-        for item in resp.json:
-            a = ptArtifact(self._pt_server, uuid1=item['uuid'])
-            a.ttl_days = int(item['ttl_days'])
-            a.description = item['description']
-            a.uploaded_dt = parser.parse(item['uploaded_dt'])
-            a.expires_dt = parser.parse(item['expires_dt'])
-            a.mime = item['mime']
-            a.filename = item['filename']
-            a.size = int(item['size'])
-            a.inline = _bool(item['inline'])
-            a.compression = _bool(item['compression'])
-            ret.append(a)
+        a = ptArtifact(self._pt_server, uuid1=item['uuid'])
+        a.ttl_days = int(item['ttl_days'])
+        a.description = item['description']
+        a.uploaded_dt = _ptParseDatetime(item['uploaded_dt'])
+        a.expires_dt = _ptParseDatetime(item['expires_dt'])
+        a.mime = item['mime']
+        a.filename = item['filename']
+        a.size = int(item['size'])
+        a.inline = _bool(item['inline'])
+        a.compression = _bool(item['compression'])
+        return a
+
+    def _pages(self, offset, limit, page_size):
+        """
+        Yields (response, list of json items) per page, the pages are fetched by a background thread
+        one page ahead of the caller. Stops after the first failed response.
+        """
+        pages = queue.Queue(maxsize=1)
+        stop = threading.Event()
+
+        def _put(page):
+            while not stop.is_set():
+                try:
+                    pages.put(page, timeout=0.1)
+                    return True
+                except queue.Full:
+                    pass
+            return False
+
+        def _fetch():
+            off, first = offset, None
+            try:
+                while True:
+                    count = page_size if limit is None else min(page_size, offset + limit - off)
+                    if count <= 0:
+                        break
+                    resp = self._pt_server.get("%s?limit=%d&offset=%d" % (self._url_list, count, off))
+                    if resp.status_code != httplib.OK:
+                        _put((resp, []))
+                        break
+
+                    items = resp.json
+                    if len(items) > count:
+                        # the server doesn't support pagination and returned the whole list
+                        _put((resp, items[off:] if limit is None else items[off:offset + limit]))
+                        break
+                    if items and first is not None and items[0].get('uuid') == first:
+                        # the server doesn't support pagination and returned the whole list again
+                        break
+                    if first is None and items:
+                        first = items[0].get('uuid')
+
+                    off += len(items)
+                    if not _put((resp, items)) or len(items) < count:
+                        break
+            except Exception as e:
+                _put(e)
+            _put(None)
+
+        t = threading.Thread(target=_fetch, name="ptArtifactListPrefetch")
+        t.daemon = True
+        t.start()
+        try:
+            while True:
+                page = pages.get()
+                if page is None:
+                    return
+                if isinstance(page, Exception):
+                    raise page
+                yield page
+        finally:
+            stop.set()
+
+    def iterate(self, offset=0, limit=None, page_size=PT_ARTIFACT_LIST_PAGE_SIZE):
+        """
+        Lazily iterate over the artifacts list, only one page of json items is kept in memory
+
+        offset    - number of artifacts to skip
+        limit     - maximum number of artifacts to return, None - all
+        page_size - artifacts fetched per request
+        """
+        for resp, items in self._pages(offset, limit, page_size):
+            if resp.status_code != httplib.OK:
+                raise ptRuntimeException("can't list artifacts, status: %d" % resp.status_code)
+            for item in items:
+                yield self._fromListItem(item)
 
+    def list(self, limit=10, offset=0):
+        resp, ret = None, []
+        for resp, items in self._pages(offset, limit, PT_ARTIFACT_LIST_PAGE_SIZE):
+            if resp.status_code != httplib.OK:
+                return resp, []
+            ret += [self._fromListItem(item) for item in items]
         return resp, ret
 
-    def download(self, filepath=None):
-        resp = self._pt_server.get(self._url_download, decode_json=False)
-        if resp.status_code == httplib.OK:
-            if filepath is not None:
-                f = open(filepath, 'wb')
-                f.write(resp.content)
-                f.close()
+    def download(self, filepath=None, decompress=False, resume=False, progress=None):
+        """
+        filepath   - file to save the artifact to, the content is streamed to disk by blocks,
+                     None - return the whole content in the response (response.content)
+        decompress - decompress bz2 content (artifacts uploaded with compression=True) on the fly,
+                     the content is saved as is if the server has already decompressed it
+        resume     - continue a partial download of the filepath from its current size,
+                     can't be combined with decompress. The response status is OK if the file is
+                     complete already, the file is downloaded again if it is bigger than the artifact
+        progress   - function called with (bytes received, total bytes or None) after every block
+        """
+        if filepath is None:
+            return self._pt_server.get(self._url_download, decode_json=False)
+
+        assert not (resume and decompress), "a decompressed download can't be resumed"
+
+        offset = os.path.getsize(filepath) if resume and os.path.exists(filepath) else 0
+        resp = self._get(offset)
+        if resp.status_code == httplib.REQUESTED_RANGE_NOT_SATISFIABLE:
+            resp.close()
+            if self._rangeTotal(resp) == offset:
+                resp.status_code = httplib.OK
+                return resp
+            resp = self._get(0)
+        try:
+            if resp.status_code == httplib.PARTIAL_CONTENT:
+                with open(filepath, 'ab') as f:
+                    self._copy(resp, f, decompress, offset, progress)
+            elif resp.status_code == httplib.OK:
+                with open(filepath, 'wb') as f:
+                    self._copy(resp, f, decompress, 0, progress)
+        finally:
+            resp.close()
+        return resp
+
+    def write(self, f, decompress=False, offset=0, progress=None):
+        """
+        Stream the artifact content to the binary file-like object (see download()), the offset is
+        the number of bytes the object already has, the content is rewritten if the server doesn't
+        support ranges
+        """
+        resp = self._get(offset)
+        if resp.status_code == httplib.REQUESTED_RANGE_NOT_SATISFIABLE:
+            resp.close()
+            if self._rangeTotal(resp) == offset:
+                resp.status_code = httplib.OK
+                return resp
+            resp = self._get(0)
+        try:
+            if resp.status_code == httplib.PARTIAL_CONTENT:
+                self._copy(resp, f, decompress, offset, progress)
+            elif resp.status_code == httplib.OK:
+                if offset:
+                    f.seek(0)
+                    f.truncate()
+                self._copy(resp, f, decompress, 0, progress)
+        finally:
+            resp.close()
         return resp
 
+    def _get(self, offset):
+        headers = {'Range': 'bytes=%d-' % offset} if offset else None
+        return self._pt_server.get(self._url_download, decode_json=False, stream=True, headers=headers)
+
+    @staticmethod
+    def _rangeTotal(resp):
+        # 416 responses carry the content size: 'bytes */12345'
+        try:
+            return int(resp.headers.get('Content-Range', '').rsplit('/', 1)[1])
+        except (IndexError, ValueError):
+            return None
+
+    @staticmethod
+    def _copy(resp, f, decompress, offset, progress):
+        size = resp.headers.get('Content-Length')
+        total = offset + int(size) if size is not None else None
+
+        def received():
+            n = offset
+            for chunk in resp.iter_content(chunk_size=PT_ARTIFACT_BLOCK_SIZE):
+                n += len(chunk)
+                yield chunk
+                if progress:
+                    progress(n, total)
+
+        chunks = _bz2DecompressChunks(received()) if decompress else received()
+        for chunk in chunks:
+            f.write(chunk)
+        f.flush()
+
+
+class _ptBz2Decompressor:
+    """
+    Decompress bz2 data (which can be several concatenated streams, e.g. from parallel bzip2) chunk by chunk
+    or pass the data through as is if it is not bz2
+    """
+    def __init__(self):
+        self._head = b""
+        self._d = None
+        self._plain = False
+
+    def decompress(self, data):
+        if self._d is None and not self._plain:
+            self._head += data
+            if len(self._head) < 3:
+                return b""
+            data, self._head = self._head, b""
+            if data.startswith(b"BZh"):
+                self._d = bz2.BZ2Decompressor()
+            else:
+                self._plain = True
+
+        if self._plain:
+            return data
+
+        out = []
+        while data:
+            if self._d.eof:
+                self._d = bz2.BZ2Decompressor()
+            out.append(self._d.decompress(data))
+            data = self._d.unused_data if self._d.eof else b""
+        return b"".join(out)
+
+    def flush(self):
+        # the data shorter than the bz2 header is passed as is
+        head, self._head = self._head, b""
+        return head
+
+
+def _bz2DecompressChunks(chunks):
+    d = _ptBz2Decompressor()
+    for chunk in chunks:
+        out = d.decompress(chunk)
+        if out:
+            yield out
+    tail = d.flush()
+    if tail:
+        yield tail
+
+
+class ptTest(object):
+    _pt_json_fields = ('seq_num', 'uuid', 'tag', 'group', 'binary', 'cmdline', 'description', 'scores', 'loops',
+                       'deviations', 'category', 'metrics', 'links', 'attribs', 'less_better', 'errors', 'warnings',
+                       'begin', 'end', 'duration_sec', 'status', 'stats')
+
+    # suites can have lots of tests, so the attributes are kept in slots, the scores and deviations in arrays
+    # of doubles (see _ptCompactValues), the links and attribs dicts are created on first access and the
+    # attributes not declared here go to the _extras dict
+    __slots__ = ('seq_num', 'uuid', 'tag', 'group', 'binary', 'cmdline', 'description', 'scores', 'loops',
+                 'deviations', 'category', 'metrics', '_links', '_attribs', 'less_better', 'errors', 'warnings',
+                 'begin', 'end', 'duration_sec', 'status', '_stats', '_auto_end', '_auto_begin', '_suite', '_extras')
 
-class ptTest:
     def __init__(self, tag=None, uuid1=None, group=None, binary=None, cmdline=None, description=None,
                  loops=None, scores=None, deviations=None, category=None, metrics="loops/sec",
                  links=None, attribs=None, less_better=False, errors=None, warnings=None,
-                 begin=None, end=None, duration_sec=0, status='SUCCESS', validate=True):
+                 begin=None, end=None, duration_sec=0, status='SUCCESS', validate=True, stats=False):
         """
         tag         - keyword used to match tests results in different suites: hdd sequential read
         group       - test group: memory, disk, cpu, ...)
@@ -329,8 +1782,12 @@ class ptTest:
         end         - time when the test ended in datetime.datetime format
         duration_sec - test duration (sec)
         status      - test status: PASS, FAIL, SKIPPED, INPROGRESS, NOTSTARTED
+        stats       - account the scores in the test stats too (see add_samples()),
+                      the stats summary is sent with the test: {'count': 10, 'mean': 12.3, 'p99': 14.2, ...}
         """
 
+        self._extras = None
+        self._suite = None
         self.seq_num = None
         self.uuid = uuid1 if uuid1 else uuid.uuid1()
         self.tag = tag
@@ -338,13 +1795,13 @@ class ptTest:
         self.binary = binary
         self.cmdline = cmdline
         self.description = description
-        self.scores = [pt_float(s) for s in scores] if scores else []
+        self.scores = _ptFloats(scores) if scores is not None and len(scores) else []
         self.loops = loops
-        self.deviations = [pt_float(d) for d in deviations] if deviations else []
+        self.deviations = _ptFloats(deviations) if deviations is not None and len(deviations) else []
         self.category = category
         self.metrics = metrics
-        self.links = links if links else {}
-        self.attribs = attribs if attribs else {}
+        self.links = links if links else None
+        self.attribs = attribs if attribs else None
         self.less_better = less_better
         self.errors = errors
         self.warnings = warnings
@@ -356,24 +1813,95 @@ class ptTest:
         self._auto_end = end
         self._auto_begin = begin
 
+        self._stats = None
+        if stats:
+            self.stats.add_many(scores if scores is not None else [])
+
         if validate:
             self.validate()
 
+    def __setattr__(self, name, value):
+        if name in ('scores', 'deviations'):
+            value = _ptCompactValues(value)
+        try:
+            object.__setattr__(self, name, value)
+        except AttributeError:
+            if getattr(self, '_extras', None) is None:
+                object.__setattr__(self, '_extras', {})
+            self._extras[name] = value
+        if name[0] != '_':
+            self._touch()
+
+    def __getattr__(self, name):
+        # called only for the attributes which are not in the slots
+        try:
+            return object.__getattribute__(self, '_extras')[name]
+        except (KeyError, TypeError):
+            raise AttributeError("'ptTest' object has no attribute '%s'" % name)
+
+    def __delattr__(self, name):
+        try:
+            object.__delattr__(self, name)
+        except AttributeError:
+            try:
+                del self._extras[name]
+            except (KeyError, TypeError):
+                raise AttributeError(name)
+
+    @property
+    def links(self):
+        if self._links is None:
+            self._links = {}
+        return self._links
+
+    @links.setter
+    def links(self, value):
+        self._links = value
+
+    @property
+    def stats(self):
+        """
+        ptStats of the samples and the scores (if the test is created with stats=True)
+        """
+        if self._stats is None:
+            self._stats = ptStats()
+        return self._stats
+
+    @stats.setter
+    def stats(self, value):
+        self._stats = value
+
+    @property
+    def attribs(self):
+        if self._attribs is None:
+            self._attribs = {}
+        return self._attribs
+
+    @attribs.setter
+    def attribs(self, value):
+        self._attribs = value
+
+    def _touch(self):
+        # let the owning suite know the test must be sent with the next incremental upload
+        suite_ref = getattr(self, '_suite', None)
+        suite = suite_ref() if suite_ref is not None else None
+        if suite is not None:
+            suite._touchTest(self)
+
     def __eq__(self, other):
         assert isinstance(other, ptTest)
-        attributes = ["tag", "group", "category", "metrics", "less_better"]
-        return all(map(lambda attr: getattr(self, attr) == getattr(other, attr),
-                       attributes))
+        return (self.tag, self.group, self.category, self.metrics, self.less_better) == \
+            (other.tag, other.group, other.category, other.metrics, other.less_better)
 
     def validate(self):
         assert self.tag is not None
-        assert self.links is None or type(self.links) is dict
-        assert self.attribs is None or type(self.attribs) is dict
+        assert self._links is None or type(self._links) is dict
+        assert self._attribs is None or type(self._attribs) is dict
         assert self.errors is None or type(self.errors) is int or type(self.errors) is list
         assert self.warnings is None or type(self.warnings) is int or type(self.warnings) is list
-        assert self.scores is None or type(self.scores) is list
+        assert self.scores is None or type(self.scores) in (list, array)
         assert self.loops is None or type(self.loops) is int
-        assert self.deviations is None or type(self.deviations) is list
+        assert self.deviations is None or type(self.deviations) in (list, array)
         assert (self.deviations is None) or len(self.deviations) == 0 or \
                (self.scores is not None and len(self.scores) == len(self.deviations))
         assert self.begin is None or type(self.begin) is datetime.datetime
@@ -383,7 +1911,7 @@ class ptTest:
 
     def __repr__(self):
         return "ptTest('%s', group='%s', category='%s' scores=%s, duration_sec=%.1f, less_better=%s, status=%s)" % \
-               (self.tag, self.group, self.category, str(self.scores),
+               (self.tag, self.group, self.category, str(_ptValues(self.scores) if self.scores else self.scores),
                 self.duration_sec, str(self.less_better), self.status)
 
     def execute(self, cmdline=None, shell=None, exc_on_err=False, log_file=None):
@@ -424,14 +1952,58 @@ class ptTest:
         return status, out, err
 
     def add_score(self, score):
-        if isinstance(score, list):
-            for s in score:
-                self.scores.append(pt_float(s))
+        # the stats go first: they reject the not finite scores before the scores are changed
+        if isinstance(score, (list, tuple, array)) or (numpy is not None and isinstance(score, numpy.ndarray)):
+            if self._stats is not None:
+                self._stats.add_many(score)
+            values = _ptFloats(score)
+            if type(self.scores) is array and type(values) is array:
+                self.scores.extend(values)
+            else:
+                self.scores = _ptList(self.scores) + _ptList(values)
         else:
-            self.scores.append(pt_float(score))
+            if self._stats is not None:
+                self._stats.add(score)
+            value = pt_float(score)
+            if type(self.scores) is array and not _ptCompactable(value):
+                self.scores = _ptList(self.scores) + [value]
+            else:
+                self.scores.append(value)
+        self._touch()
+
+    def _mergeScores(self, other):
+        # the other test scores are rounded already
+        if other.scores:
+            if type(self.scores) is array and type(other.scores) is array:
+                self.scores.extend(other.scores)
+            else:
+                self.scores = _ptList(self.scores) + _ptList(other.scores)
+        if other._stats:
+            self.stats.merge(other._stats)
+        self._touch()
 
     def add_deviation(self, dev):
-        self.scores.append(pt_float(dev))
+        value = pt_float(dev)
+        if type(self.deviations) is array and not _ptCompactable(value):
+            self.deviations = _ptList(self.deviations) + [value]
+        else:
+            self.deviations.append(value)
+        self._touch()
+
+    def add_sample(self, value):
+        """
+        Account the value in the test stats only, e.g. a single request latency
+        """
+        self.stats.add(value)
+        self._touch()
+
+    def add_samples(self, values):
+        """
+        Account the values (list, array or numpy array) in the test stats only, the stats memory
+        doesn't depend on the number of samples and only the summary is sent to the server
+        """
+        self.stats.add_many(values)
+        self._touch()
 
     def add_artifact(self, artifact):
         assert isinstance(artifact, ptArtifact)
@@ -439,6 +2011,9 @@ class ptTest:
 
 
 class ptEnvNode:
+    _pt_json_fields = ('name', 'version', 'node_type', 'ip', 'ssh_user', 'ssh_password', 'hostname', 'uuid', 'params',
+                       'cpus', 'cpus_topology', 'cpu_info', 'ram_info', 'ram_mb', 'disk_gb', 'links', 'children')
+
     def __init__(self, name=None, version=None, node_type=None, ip=None, hostname=None, params=None,
                  cpus=0, cpus_topology=None, cpu_info=None, ram_info=None,
                  ram_mb=0, ram_gb=0, disk_gb=0, links=None, scan_info=False,
@@ -505,6 +2080,8 @@ class ptEnvNode:
 
 
 class ptHost(ptEnvNode):
+    _pt_json_fields = ptEnvNode._pt_json_fields + ('model', 'hw_uuid', 'serial_num')
+
     def __init__(self, name=None, model=None, hw_uuid=None, serial_num=None, numa_nodes=None, **kwargs):
         ptEnvNode.__init__(self, name=name, **kwargs)
         self.node_type = "Host"
@@ -539,17 +2116,119 @@ class ptComponent(ptEnvNode):
 
 
 class ptProduct:
+    _pt_json_fields = ('name', 'version')
+
     def __init__(self, name="", version=None):
         self.name = name
         self.version = str(version)
 
 
+_pt_test_json_defaults = (('seq_num', None), ('tag', None), ('group', None), ('binary', None), ('cmdline', None),
+                          ('description', None), ('loops', None), ('category', None), ('metrics', "loops/sec"),
+                          ('less_better', False), ('errors', None), ('warnings', None), ('duration_sec', 0),
+                          ('status', 'SUCCESS'))
+
+
+def _ptTestFromJson(d):
+    """
+    Build ptTest from its json dict directly, ~10x faster than ptTest() + setattr(). The begin and end
+    are converted to the local time, the stats are restored by ptStats.from_summary(), unknown keys are skipped.
+    """
+    t = ptTest.__new__(ptTest)
+    for name, default in _pt_test_json_defaults:
+        object.__setattr__(t, name, d.get(name, default))
+
+    get = d.get
+    uuid1 = get('uuid')
+    object.__setattr__(t, 'uuid', uuid.UUID(uuid1) if uuid1 else uuid.uuid1())
+    for name in ('scores', 'deviations'):
+        values = get(name)
+        object.__setattr__(t, name, _ptCompactValues(values) if values else [])
+    for name in ('begin', 'end'):
+        value = get(name)
+        object.__setattr__(t, name, _ptLocalDatetime(value) if value else datetime.datetime.now())
+    object.__setattr__(t, '_links', get('links') or None)
+    object.__setattr__(t, '_attribs', get('attribs') or None)
+    stats = get('stats')
+    object.__setattr__(t, '_stats', ptStats.from_summary(stats) if stats else None)
+    object.__setattr__(t, '_auto_end', t.end)
+    object.__setattr__(t, '_auto_begin', t.begin)
+    object.__setattr__(t, '_suite', None)
+    object.__setattr__(t, '_extras', None)
+    return t
+
+
+def _ptEnvNodeFromJson(d):
+    node = (ptHost if d.get('node_type') == "Host" else ptEnvNode)(validate=False)
+    for name in type(node)._pt_json_fields:
+        if name not in d:
+            continue
+        if name == 'uuid':
+            node.uuid = uuid.UUID(d['uuid'])
+        elif name == 'children':
+            node.children = [_ptEnvNodeFromJson(c) for c in d['children']]
+        else:
+            setattr(node, name, d[name])
+    return node
+
+
+def _ptEnvNodesMerge(nodes, others):
+    # the nodes of the same type and name are the same node, their children are merged
+    key2node = dict(((n.node_type, n.name), n) for n in nodes)
+    for node in others:
+        n = key2node.get((node.node_type, node.name))
+        if n is None:
+            nodes.append(node)
+            key2node[(node.node_type, node.name)] = node
+        else:
+            _ptEnvNodesMerge(n.children, node.children)
+    return nodes
+
+
+def _ptJsonStream(f):
+    """
+    Yields (key, value) of the top level json object from the seekable file-like object parsed by ijson:
+    the first pass yields all the keys but 'tests', the second one yields the tests as ('tests', [test, ...])
+    batches without building the whole list
+    """
+    start = f.tell()
+    key, builder = None, None
+    for prefix, event, value in ijson.parse(f, use_float=True):
+        if prefix == '':
+            if event == 'map_key':
+                key = value
+            continue
+        if key == 'tests':
+            continue
+        if builder is None:
+            builder = _ptJsonObjectBuilder()
+        builder.event(event, value)
+        if prefix == key and event not in ('start_map', 'start_array', 'map_key'):
+            yield key, builder.value
+            builder = None
+
+    f.seek(start)
+    tests = []
+    for test in ijson.items(f, 'tests.item', use_float=True):
+        tests.append(test)
+        if len(tests) == PT_JSON_STREAM_BATCH:
+            yield 'tests', tests
+            tests = []
+    if tests:
+        yield 'tests', tests
+
+
 class ptSuite:
+    _pt_json_fields = ('job_title', 'cmdline', 'project_name', 'project_id', 'product_name', 'regression_name',
+                       'product_ver', 'suite_name', 'suite_ver', 'uuid', 'append', 'replace', 'begin', 'end',
+                       'env_nodes', 'links', 'tests', 'pt_server')
+
     def __init__(self, job_title='job title', project_name=None, cmdline=None,
                  product_name=None, product_ver=None, regression_name=None,
                  suite_name=None, suite_ver=None,
                  uuid1=None, append=False, replace=False, begin=None, end=None, links=None,
-                 pt_server_url=PT_SERVER_DEFAULT_URL, save_to_file=None):
+                 pt_server_url=PT_SERVER_DEFAULT_URL, save_to_file=None, pt_server=None, incremental_upload=True,
+                 background_upload=False, spool_dir=None):
         """
         job_name   - job title on portal: '[disk tests] KVM 2.6.32'
         suite_name - suite name to filter/search: 'disk tests'
@@ -557,6 +2236,14 @@ class ptSuite:
         append     - set to True to append data to existing job data with given uuid
         begin      - time when job started (must have the datetime.datetime type)
         end        - time when job ended (must have the datetime.datetime type)
+        pt_server  - existing ptServer instance to share its connection pool, pt_server_url is ignored then
+        incremental_upload - after the first successful upload() send only the tests and env nodes changed
+                     since the previous one and append them to the job. Tests are tracked by attribute
+                     assignment and add_score(), call touchTest() after in-place changes like
+                     test.attribs['key'] = value
+        background_upload - upload() serializes the changes and returns, a background thread posts them,
+                     fini() waits for pending uploads (or they are waited for at exit for PT_UPLOAD_EXIT_TIMEOUT)
+        spool_dir  - keep uploads in this directory while the server is unreachable, see ptServer.flushSpool()
         """
 
         self._seq_num = 0
@@ -586,7 +2273,22 @@ class ptSuite:
         self.tests = []
         self._key2test = {}
 
-        self.pt_server = ptServer(pt_server_url)
+        self._incremental_upload = incremental_upload
+        self._uploaded = False
+        self._uploaded_env_nodes = None
+        # the tests changed since the last upload: id(test) -> (test, touch number), the tests are
+        # changed by the executor threads while the suite is being uploaded, hence the lock
+        self._dirty_tests = OrderedDict()
+        self._dirty_lock = threading.Lock()
+        self._touches = 0
+        self._tracked_tests = self.tests
+        self._tracked_tests_num = 0
+
+        self._own_pt_server = pt_server is None
+        self.pt_server = ptServer(pt_server_url) if pt_server is None else pt_server
+        self._upload_worker = ptUploadWorker(self.pt_server) if background_upload else None
+        if spool_dir:
+            self.pt_server.setSpool(spool_dir)
         self._save_to_file = save_to_file
         self._pt_options_added = False
 
@@ -629,80 +2331,179 @@ class ptSuite:
                                                                   datetime.datetime.now()))))
 
     def addTest(self, test):
-        assert isinstance(test, ptTest)
-        if not self.append:
-            self._seq_num += 1
-            test.seq_num = self._seq_num
-        added_test = self.getTest(tag=test.tag, group=test.group, category=test.category)
-        if added_test is None:
-            self.tests.append(test)
-            key = "%s-%s-%s" % (test.tag, str(test.group), str(test.category))
-            self._key2test[key] = test
-        elif added_test == test:
-            # TODO add_deviations
-            added_test.add_score(test.scores)
-        else:
-            raise ptRuntimeException("ptTest with received tag, group, category already exists, but other "
-                                     "attributes differs")
+        self.addTests((test,))
+
+    def addTests(self, tests):
+        """
+        Add the tests from the iterable, the scores of the tests with the same tag, group and category
+        as an already added one are appended to it (the metrics and less_better must be the same)
+        """
+        self._addTests(tests, renumber=not self.append)
+
+    def _addTests(self, tests, renumber):
+        suite_ref = weakref.ref(self)
+        key2test = self._key2test
+        added = []
+        # the new tests are marked dirty below, no need in ptTest.__setattr__() bookkeeping
+        setattr_ = object.__setattr__
+
+        for test in tests:
+            assert isinstance(test, ptTest)
+            if renumber:
+                self._seq_num += 1
+                setattr_(test, 'seq_num', self._seq_num)
+            key = (test.tag, test.group, test.category)
+            added_test = key2test.get(key)
+            if added_test is None:
+                key2test[key] = test
+                added.append(test)
+                setattr_(test, '_suite', suite_ref)
+                self._touchTest(test)
+            elif added_test.metrics == test.metrics and added_test.less_better == test.less_better:
+                # TODO add_deviations
+                added_test._mergeScores(test)
+            else:
+                self._extendTests(added)
+                raise ptRuntimeException("ptTest with received tag, group, category already exists, but other "
+                                         "attributes differs")
+
+        self._extendTests(added)
+
+    def _extendTests(self, tests):
+        if self._tracked_tests is self.tests:
+            self._tracked_tests_num += len(tests)
+        self.tests.extend(tests)
+
+    def touchTest(self, test):
+        """
+        Mark the test as changed, required only after in-place changes the suite can't see,
+        e.g. test.attribs['key'] = 'value'
+        """
+        self._touchTest(test)
+
+    def _touchTest(self, test):
+        with self._dirty_lock:
+            self._touches += 1
+            self._dirty_tests[id(test)] = (test, self._touches)
 
     def addArtifact(self, uuid1=None):
         return ptArtifact(pt_server=self.pt_server, uuid1=uuid1)
 
     def initFromJson(self, json_obj):
-        logging.debug("initializing data from json: %s" % str(json_obj))
+        """
+        Load the job json document (parsed) to this suite, e.g. to append more tests to the job:
+        the header fields are set, the env nodes and tests are added with their uuid and seq_num
+        """
+        self._initFromItems(json_obj.items())
 
-        def _initFromJson(obj, json_obj):
-            for el_name in json_obj:
-                if str(el_name) not in obj.__dict__:
-                    logging.debug("skipping unrecognized element: %s = %s, while obj is: %s" %
-                                  (str(el_name), json_obj[el_name], obj.__dict__))
-                    continue
+    def readJson(self, f):
+        """
+        Load the job json written by writeJson() from the file object, the tests are streamed by
+        ijson if it is installed, so huge jobs don't need the whole document in memory
+        """
+        if ijson is not None:
+            self._initFromItems(_ptJsonStream(f))
+            return
+        data = f.read()
+        self.initFromJson(orjson.loads(data) if orjson is not None else json.loads(data))
+
+    def _initFromItems(self, items):
+        for name, value in items:
+            if name == 'tests':
+                self._loadTests(value)
+            elif name == 'env_nodes':
+                self.env_nodes += [_ptEnvNodeFromJson(n) for n in value]
+            elif name == 'uuid':
+                self.uuid = uuid.UUID(value)
+            elif name in ('begin', 'end'):
+                setattr(self, name, _ptLocalDatetime(value))
+                if name == 'end':
+                    self._auto_end = self.end
+            elif name in self._pt_json_fields and name != 'pt_server':
+                setattr(self, name, value)
+            else:
+                logging.debug("skipping unrecognized element: %s" % name)
 
-                member = obj.__dict__[el_name]
-
-                if member is None:
-                    obj.__dict__[el_name] = json_obj[el_name]
-                elif type(member) is list:
-                    if len(member):
-                        for j in json_obj[el_name]:
-                            if hasattr(member[0], 'validate'):
-                                new_obj = member[0].__class__(validate=False)
-                            else:
-                                try:
-                                    new_obj = member[0].__class__()
-                                except TypeError as e:
-                                    logging.error("EXCEPTION: class: %s, error: %s" %
-                                                  (member[0].__class__.__name__, str(e)))
-                                    raise
-                            _initFromJson(new_obj, j)
-                            member.append(new_obj)
-                    else:
-                        obj.__dict__[el_name] = json_obj[el_name]
-                elif obj.__dict__[el_name].__class__.__name__.startswith('pt'):
-                    # special hack to handle ptServer, ptTest, ptArtifact, ...
-                    new_obj = member.__class__()
-                    _initFromJson(new_obj, json_obj[el_name])
-                elif type(member) is datetime.datetime:
-                    obj.__dict__[el_name] = json_obj[el_name]
-                elif type(member) is dict:
-                    try:
-                        obj.__dict__[el_name] = dict(json_obj[el_name])
-                    except ValueError as e:
-                        obj.__dict__[el_name] = ast.literal_eval(json_obj[el_name])
-                else:
-                    obj.__dict__[el_name] = type(member)(json_obj[el_name])
+    def _loadTests(self, tests_json):
+        tests = [_ptTestFromJson(d) for d in tests_json]
+        seq_num = max([t.seq_num for t in tests if t.seq_num is not None] or [0])
+        self._seq_num = max(self._seq_num, seq_num)
+        self._addTests(tests, renumber=False)
 
-        _initFromJson(self, json_obj)
+    def merge(self, *suites):
+        """
+        Merge the suites, e.g. the shards of one run loaded by readJson(), to this suite: the tests are
+        added by the addTests() rules (the scores of the same tests are concatenated), the env nodes of
+        the same type and name are merged with their children, the job begin and end cover all suites.
+        The header fields not set in this suite are taken from the others. The tests are taken over, not copied.
+        """
+        for suite in suites:
+            self.addTests(suite.tests)
+            _ptEnvNodesMerge(self.env_nodes, suite.env_nodes)
+            for name in ('job_title', 'cmdline', 'project_name', 'project_id', 'product_name', 'regression_name',
+                         'product_ver', 'suite_name', 'suite_ver'):
+                if not getattr(self, name) and getattr(suite, name):
+                    setattr(self, name, getattr(suite, name))
+            for name, url in (suite.links or {}).items():
+                self.links.setdefault(name, url)
+            self.begin = min(self.begin, suite.begin)
+            self.end = self._auto_end = max(self.end, suite.end)
+        return self
 
     def getTest(self, tag, group=None, category=None):
-        key = "%s-%s-%s" % (tag, str(group), str(category))
-        return self._key2test.get(key, None)
+        return self._key2test.get((tag, group, category), None)
 
     def toJson(self, pretty=False):
         if pretty:
             return json.dumps(self, cls=ptJsonEncoder, indent=4, separators=(',', ': '))
         return json.dumps(self, cls=ptJsonEncoder)
 
+    def writeJson(self, f, pretty=False):
+        """
+        Write the same json as toJson() to the file-like object test by test
+        """
+        for chunk in ptJsonEncoder.chunks(self, pretty=pretty):
+            f.write(chunk)
+
+    def _estimateJsonSize(self, tests, samples=16):
+        if not tests:
+            return 0
+        step = max(1, len(tests) // samples)
+        sample = tests[::step][:samples]
+        return len(json.dumps(sample, cls=ptJsonEncoder)) * len(tests) // len(sample)
+
+    def _uploadDoc(self):
+        """
+        Returns the job json to upload, the list of tests it carries, the env nodes json and the touch
+        number of the snapshot: the whole job on the first upload, then only the job header and the tests
+        and env nodes changed since the previous successful upload, appended to the job with the same uuid
+        """
+        with self._dirty_lock:
+            dirty = list(self._dirty_tests.values())
+            touched = self._touches
+        doc = ptJsonEncoder().default(self)
+        env_nodes = json.dumps(self.env_nodes, cls=ptJsonEncoder)
+
+        if self._tracked_tests is not self.tests or self._tracked_tests_num != len(self.tests):
+            # tests were added bypassing addTest(), e.g. appended to suite.tests, so resend all of them
+            self._tracked_tests = self.tests
+            self._tracked_tests_num = len(self.tests)
+            self._uploaded = False
+
+        if not self._incremental_upload or not self._uploaded:
+            return doc, list(self.tests), env_nodes, touched
+
+        tests = [t for t, _ in dirty]
+        doc.pop('replace', None)
+        doc['append'] = True
+        if tests:
+            doc['tests'] = tests
+        else:
+            doc.pop('tests', None)
+        if env_nodes == self._uploaded_env_nodes:
+            doc.pop('env_nodes', None)
+        return doc, tests, env_nodes, touched
+
     def validateProjectName(self):
         if not self.project_name:
             return
@@ -727,30 +2528,57 @@ class ptSuite:
         if self._auto_end is None:
             self.end = datetime.datetime.now()
 
-        json_prettified = self.toJson(pretty=True)
-
+        # every json representation is built only if there is a consumer for it
         if self._save_to_file:
             if self._save_to_file == "-":
                 print("Job json:")
-                print(json_prettified)
+                self.writeJson(sys.stdout, pretty=True)
+                print("")
             else:
                 with open(self._save_to_file, 'w') as f:
-                    f.write(json_prettified)
+                    self.writeJson(f, pretty=True)
                 logging.info("saving json data to %s" % self._save_to_file)
             return True
 
-        json_data = self.toJson()
+        json_data, tests, env_nodes, touched = self._uploadJob(snapshot=self._upload_worker is not None)
+        if self._upload_worker:
+            # from now on the worker is responsible for the delivery
+            self._upload_worker.put(self.project_id, json_data, self.uuid)
+        else:
+            self.pt_server.postJob(self.project_id, json_data, self.uuid)
 
-        logging.debug("posting data to %s:\n%s" % ('/%d/job/' % self.project_id, json_prettified))
+        self._uploadDone(tests, env_nodes, touched)
+        return True
 
-        response = self.pt_server.post('%d/job/' % self.project_id, decode_json=False, data=json_data)
+    def _uploadJob(self, snapshot=False):
+        """
+        Returns the job json to post, the tests and the env nodes it carries and the touch number, see _uploadDoc()
 
-        if response.status_code != httplib.OK:
-            logging.error("job json upload failed, status %d, %s" % (response.status_code, response.text))
-            raise ptRuntimeException("Suite run results upload failed, status %d:\n%s" %
-                                     (response.status_code, response.text))
-        logging.info("status %d - job json uploaded, %s" % (response.status_code, response.text))
-        return True
+        snapshot - always encode the json right away, otherwise big jobs are returned as a function
+                   generating the json while it is being sent (and once again on every retry)
+        """
+        doc, tests, env_nodes, touched = self._uploadDoc()
+        if snapshot or self._estimateJsonSize(tests) < PT_JSON_STREAM_THRESHOLD:
+            json_data = ptJsonEncoder.wire(doc)
+            if logging.getLogger().isEnabledFor(logging.DEBUG):
+                logging.debug("posting %d of %d tests to %s:\n%s" %
+                              (len(tests), len(self.tests), '/%d/job/' % self.project_id,
+                               json.dumps(doc, cls=ptJsonEncoder, indent=4, separators=(',', ': '))))
+        else:
+            json_data = functools.partial(ptJsonEncoder.chunks, doc)
+            logging.debug("streaming %d of %d tests to %s" %
+                          (len(tests), len(self.tests), '/%d/job/' % self.project_id))
+        return json_data, tests, env_nodes, touched
+
+    def _uploadDone(self, tests, env_nodes, touched):
+        # the tests changed after the snapshot (touch number > touched) stay dirty for the next upload
+        with self._dirty_lock:
+            for t in tests:
+                entry = self._dirty_tests.get(id(t))
+                if entry is not None and entry[1] <= touched:
+                    del self._dirty_tests[id(t)]
+        self._uploaded = True
+        self._uploaded_env_nodes = env_nodes
 
     def addOptions(self, option_parser, pt_url=None, pt_project=None):
         self._pt_options_added = True
@@ -778,6 +2606,16 @@ class ptSuite:
                      help="Upload stdout & stderr to perftracker and attach to the job")
         g.add_option("--pt-log-ttl", type="int", default=180,
                      help="stdout & stderr logs time to live (days), default %default")
+        g.add_option("--pt-background-upload", action="store_true",
+                     help="upload results in a background thread, do not block tests on the network")
+        g.add_option("--pt-spool-dir", type="str",
+                     help="keep results in this directory while PerfTracker is unreachable, "
+                          "upload them on the next run or with pt-spool-flush.py")
+        g.add_option("--pt-compression", type="choice", choices=pt_compress_encodings(),
+                     help="compress the results upload: %s (the server must support it)" %
+                          ", ".join(pt_compress_encodings()))
+        g.add_option("--pt-retries", type="int", default=self.pt_server.retry_policy.max_attempts,
+                     help="max number of attempts for every PerfTracker request, default %default")
         option_parser.add_option_group(g)
 
     def handleOptions(self, options):
@@ -811,6 +2649,14 @@ class ptSuite:
         if _exists(options, 'pt_append'):
             self.uuid = options.pt_append
             self.append = True
+        if _exists(options, 'pt_background_upload') and self._upload_worker is None:
+            self._upload_worker = ptUploadWorker(self.pt_server)
+        if _exists(options, 'pt_spool_dir'):
+            self.pt_server.setSpool(options.pt_spool_dir)
+        if _exists(options, 'pt_compression'):
+            self.pt_server.setCompression(options.pt_compression)
+        if _exists(options, 'pt_retries'):
+            self.pt_server.retry_policy.max_attempts = max(1, options.pt_retries)
         if _exists(options, 'pt_log_upload'):
             self._stdout_filename = Tee('stdout').filename
             self._stderr_filename = Tee('stderr').filename
@@ -820,19 +2666,42 @@ class ptSuite:
             self._stderr_artifact = ptArtifact(self.pt_server, filename="stderr.txt", inline=True,
                                                compression=True, ttl_days=options.pt_log_ttl,
                                                linked_uuids=[self.uuid])
+            for artifact, filename in ((self._stdout_artifact, self._stdout_filename),
+                                       (self._stderr_artifact, self._stderr_filename)):
+                _pt_pending_outputs[id(artifact)] = (artifact, filename)
 
         self.validateProjectName()
 
-    def fini(self):
-        if self._stdout_artifact and os.path.getsize(self._stdout_filename):
-            self._stdout_artifact.upload(self._stdout_filename)
+    def fini(self, timeout=PT_UPLOAD_FLUSH_TIMEOUT):
+        """
+        Wait for the background uploads and upload the --pt-log-upload stdout & stderr logs,
+        the ones not uploaded by fini() are uploaded at exit
+
+        timeout - max time (sec) to wait for background uploads
+        """
+        if self._upload_worker:
+            try:
+                if not self._upload_worker.close(timeout):
+                    logging.error("background job upload didn't finish in %d sec" % timeout)
+            except ptRuntimeException as e:
+                logging.error("background job upload failed: %s" % str(e))
+        self._uploadOutputs()
+        if self._own_pt_server:
+            self.pt_server.close()
+
+    def _uploadOutputs(self):
+        if self._stdout_artifact:
+            _ptUploadOutput(self._stdout_artifact, self._stdout_filename)
             self._stdout_artifact = None
-        if self._stderr_artifact and os.path.getsize(self._stderr_filename):
-            self._stderr_artifact.upload(self._stderr_filename)
+        if self._stderr_artifact:
+            _ptUploadOutput(self._stderr_artifact, self._stderr_filename)
             self._stderr_artifact = None
 
     def __del__(self):
-        self.fini()
+        # no network in the garbage collector: the background uploads are flushed and the logs
+        # are uploaded by an explicit fini() or at exit (see ptUploadWorker, _ptUploadPendingOutputs())
+        if self._upload_worker is None and self._own_pt_server:
+            self.pt_server.close()
 
 
 ##############################################################################
@@ -840,6 +2709,8 @@ class ptSuite:
 ##############################################################################
 
 def _coverage():
+    import io
+
     suite = ptSuite(suite_ver="1.0.0", product_name="My web app", product_ver="1.0-1234",
                     project_name="Test", uuid1="11111111-2222-11e8-85cb-8c85907924aa")
 
@@ -883,9 +2754,265 @@ def _coverage():
     a.upload(os.path.abspath(__file__))
     a.link([suite.uuid])
 
+    with ptServer(suite.pt_server.url, pool_maxsize=2) as pt_server:
+        assert ptArtifact(pt_server, uuid1=a.uuid).info().status_code == httplib.OK
+        resp, artifacts = ptArtifact(pt_server).list(limit=3)
+        assert resp.status_code == httplib.OK and 1 <= len(artifacts) <= 3
+        paged = ptArtifact(pt_server).iterate(limit=3, page_size=2)
+        assert [x.uuid for x in paged] == [x.uuid for x in artifacts]
+
+    class _UnpagedServer(ptServer):
+        # returns the whole list whatever the limit and offset are
+        def get(self, url, *args, **kwargs):
+            resp = requests.models.Response()
+            resp.status_code = httplib.OK
+            resp.json = [{'uuid': "11111111-7777-11e8-85cb-8c85907924a%d" % n, 'ttl_days': 1, 'description': "",
+                          'uploaded_dt': "2018-01-01T00:00:00", 'expires_dt': "2018-01-02T00:00:00", 'mime': None,
+                          'filename': "%d.txt" % n, 'size': n, 'inline': False, 'compression': False}
+                         for n in range(3)]
+            return resp
+
+    unpaged = ptArtifact(_UnpagedServer(suite.pt_server.url))
+    for page_size in (2, 3, 4):
+        assert [x.size for x in unpaged.iterate(page_size=page_size)] == [0, 1, 2]
+    assert [x.size for x in unpaged.iterate(offset=1, limit=1, page_size=1)] == [1]
+    assert [x.size for x in unpaged.list(limit=10)[1]] == [0, 1, 2]
+    assert next(unpaged.iterate(page_size=1)).size == 0  # the prefetch thread is stopped
+    assert all(x._compressor is None for x in unpaged.iterate())  # created by the compressed uploads only
+
+    now = datetime.datetime.now()
+    old = unpaged._fromListItem({'uuid': "11111111-7777-11e8-85cb-8c85907924aa", 'ttl_days': 10, 'description': "",
+                                 'uploaded_dt': _ptJsonDatetime(now - datetime.timedelta(days=5, hours=-1)),
+                                 'expires_dt': _ptJsonDatetime(now + datetime.timedelta(days=5)), 'mime': None,
+                                 'filename': "old.txt", 'size': 1, 'inline': False, 'compression': False})
+    assert ptArtifact(suite.pt_server, ttl_days=3)._coveringTtl(old) == 10  # expires later anyway
+    assert ptArtifact(suite.pt_server, ttl_days=30)._coveringTtl(old) == 35
+    assert ptArtifact(suite.pt_server, ttl_days=0)._coveringTtl(old) == 0
+
+    cache_dir = tempfile.mkdtemp()
+    with ptServer(suite.pt_server.url, cache_dir=cache_dir) as pt_server:
+        src = os.path.join(cache_dir, "build-1.bin")
+        with open(src, 'wb') as f:
+            f.write(os.urandom(100000))
+        first = ptArtifact(pt_server, filename="build.bin", dedup=True)
+        assert first.upload(src).status_code == httplib.OK
+        copy = os.path.join(cache_dir, "build-2.bin")  # rebuilt: another path, inode and mtime
+        shutil.copyfile(src, copy)
+        os.utime(copy, (time.time() + 60, time.time() + 60))
+        again = ptArtifact(pt_server, filename="build.bin", dedup=True, description="nightly")
+        assert again.upload(copy).status_code == httplib.OK and str(again.uuid) == str(first.uuid)
+        assert again.info().json['description'] == "nightly"
+        first.delete()
+    shutil.rmtree(cache_dir)
+
+    packed = ptArtifact(suite.pt_server, compression=True, compression_workers=2, compression_block_size=65536)
+    assert packed.upload(os.path.abspath(__file__)).status_code == httplib.OK and packed._compressor.workers == 2
+    path = tempfile.mktemp()
+    packed.download(path, decompress=True)
+    assert open(path, 'rb').read() == open(os.path.abspath(__file__), 'rb').read()
+    os.unlink(path)
+    packed.delete()
+
+    path = tempfile.mktemp()
+    a.download(path)
+    with open(path, 'r+b') as f:
+        f.truncate(100)
+    assert a.download(path, resume=True).status_code in (httplib.OK, httplib.PARTIAL_CONTENT)
+    assert open(path, 'rb').read() == open(os.path.abspath(__file__), 'rb').read()
+    assert a.download(path, resume=True).status_code == httplib.OK  # complete already
+    assert open(path, 'rb').read() == open(os.path.abspath(__file__), 'rb').read()
+    with open(path, 'ab') as f:
+        f.write(b"garbage")
+    assert a.download(path, resume=True).status_code == httplib.OK
+    assert open(path, 'rb').read() == open(os.path.abspath(__file__), 'rb').read()
+    os.unlink(path)
+
+    suite.upload()
+
+    assert suite.pt_server.getProjectId(suite.project_name) == suite.project_id  # cached
+    suite.pt_server.forgetProjectId(suite.project_name)
+    assert suite.pt_server.getProjectId(suite.project_name) == suite.project_id
+    try:
+        suite.pt_server.getProjectId("No such project")
+        assert False, "project doesn't exist"
+    except ptRuntimeException as e:
+        logging.info(str(e))
+
+    t = ptTest("Logout time", group="Latency tests", metrics="sec", less_better=True, scores=[0.1])
+    suite.addTest(t)
+    t.add_score(0.2)
+    assert list(suite._uploadDoc()[0]['tests']) == [t]
+    suite.upload()  # incremental, sends the new test only
+    assert not suite._dirty_tests
+    t.add_score(0.3)
+    json_data, tests, env_nodes, touched = suite._uploadJob()
+    t.add_score(0.4)  # e.g. by an executor thread while the job is being posted
+    suite._uploadDone(tests, env_nodes, touched)
+    assert list(suite._dirty_tests) == [id(t)]
     suite.upload()
+    assert not suite._dirty_tests
+
+    bg = ptSuite(project_name="Test", pt_server=suite.pt_server, background_upload=True)
+    for n in range(3):
+        bg.addTest(ptTest("Background upload", category=str(n), scores=[n]))
+        bg.upload()
+    bg.fini(timeout=60)
+
+    class _FlakyServer(ptServer):
+        def postJob(self, *args, **kwargs):
+            if not self.__dict__.pop('_flaky', None):
+                self._flaky = True
+                raise ValueError("not a ptRuntimeException")
+            return ptServer.postJob(self, *args, **kwargs)
+
+    with _FlakyServer(suite.pt_server.url) as pt_server:
+        worker = ptUploadWorker(pt_server)
+        worker.put(suite.project_id, suite.toJson(), suite.uuid)
+        assert worker.flush(timeout=60) and worker._thread.is_alive()  # the failure is logged, not fatal
+        worker.put(suite.project_id, suite.toJson(), suite.uuid)
+        assert worker.close(timeout=60) and '_flaky' not in pt_server.__dict__ and worker not in _pt_upload_workers
+
+    # the half-open circuit trial request failed by any exception opens the circuit again
+    breaker = ptCircuitBreaker(failure_threshold=1, reset_timeout_sec=0)
+    breaker.failure()
+
+    def _broken_body():
+        raise IOError("broken body")
+
+    with ptServer(suite.pt_server.url, circuit_breaker=breaker) as pt_server:
+        try:
+            pt_server.post("/0/job/", data=_broken_body)
+            assert False, "the body is broken"
+        except IOError:
+            assert breaker.state == ptCircuitBreaker.HALF_OPEN and not breaker._trial_in_progress
+            assert breaker._failures == 1  # the local error is not counted
+        assert pt_server.get("/0/artifact/%s" % a.uuid, decode_json=False).status_code == httplib.OK
+        assert breaker.state == ptCircuitBreaker.CLOSED
+
+    class _MovedProjectServer(ptServer):
+        # the project is re-created with another id, the old one is not found
+        def post(self, url, *args, **kwargs):
+            if url.startswith('999/'):
+                resp = requests.models.Response()
+                resp.status_code = httplib.NOT_FOUND
+                resp._content = b'{"message": "project not found"}'
+                return resp
+            return ptServer.post(self, url, *args, **kwargs)
+
+    with _MovedProjectServer(suite.pt_server.url, cache_dir=tempfile.mkdtemp()) as pt_server:
+        pt_server._cacheProjectId(suite.project_name, 999)
+        assert pt_server.getProjectId(suite.project_name) == 999
+        assert pt_server.postJob(999, suite.toJson()).status_code == httplib.OK
+        assert pt_server.getProjectId(suite.project_name) == suite.project_id
+        assert pt_server.postJob(999, suite.toJson()).status_code == httplib.OK  # the stale id is followed
+        shutil.rmtree(pt_server._cache_dir)
+
+    spool_dir = tempfile.mkdtemp()
+    with ptServer(suite.pt_server.url, spool_dir=spool_dir) as pt_server:
+        pt_server._spoolRecord('job', suite.uuid, "test", meta={'project_id': suite.project_id}, data=suite.toJson())
+        assert pt_server.flushSpool() == 1
+        assert pt_server.spool.empty() and not pt_server._spooled
+    shutil.rmtree(spool_dir)
+
     j = suite.toJson()
+    assert j == json.dumps(suite, cls=ptJsonEncoder, reflective=True)
+    assert json.loads(ptJsonEncoder.wire(suite)) == json.loads(j)
+    doc = {'floats': [1.5e-05, -1e-05, 0.0001, 1e-7, 1.234e-300, 1e16, -2.5e+20, 12345.678, float('nan')],
+           'text': u"\u044e\u043d\u0438\u043a\u043e\u0434 \"1e-05\" \\ \u2028\x1f NaN", 'test': suite.tests[0]}
+    assert json.loads(_ptJsonWire(doc))['text'] == doc['text']
+    if orjson is not None:
+        assert _ptJsonWire(doc) == ptJsonEncoder.wire(doc)
+    assert "".join(ptJsonEncoder.chunks(suite, chunk_size=100)) == j
+    assert "".join(ptJsonEncoder.chunks(suite, pretty=True)) == suite.toJson(pretty=True)
+    t = suite.tests[0]
+    t.custom_field = "extra"  # not declared in _pt_json_fields
+    assert json.dumps(t, cls=ptJsonEncoder) == json.dumps(t, cls=ptJsonEncoder, reflective=True)
+    del t.custom_field
+
+    class _Plain(object):  # no __slots__, the declared fields are read from __dict__
+        _pt_json_fields = ('name', 'values', 'empty')
+
+        def __init__(self):
+            self.name, self.values, self.empty = "plain \xd1\x8e", array('d', [1.5, 2]), array('d')
+            self.extra, self._private = array('i', [3]), "hidden"
+
+    p = _Plain()
+    assert json.dumps(p, cls=ptJsonEncoder) == json.dumps(p, cls=ptJsonEncoder, reflective=True)
+    assert json.loads(json.dumps(p, cls=ptJsonEncoder)) == {'name': p.name, 'values': [1.5, 2], 'extra': [3]}
+    values = [random.uniform(-1, 1) * 10 ** random.randint(-10, 4) for _ in range(1000)] + [2.675, 0.125, 1e-8]
+    for v in (values, values[:10], values + [100.5], values[:10] + [float('nan')]):
+        assert repr(pt_floats(v)) == repr([pt_float(x) for x in v])
+    t = ptTest("Compact test", scores=[1.5, 150.4, 0], deviations=[0.1, 0.2, 0.3])
+    assert type(t.scores) is array and json.loads(json.dumps(t, cls=ptJsonEncoder))['scores'] == [1.5, 150, 0]
+    s = ptSuite(pt_server=suite.pt_server)
+    s.addTests([ptTest("a-b", group="c", scores=[1]), ptTest("a", group="b-c", scores=[2]),
+                ptTest("a-b", group="c", scores=[3.5], stats=True), ptTest("a", group="b-c", scores=[4])])
+    assert len(s.tests) == 2 and list(s.getTest("a-b", group="c").scores) == [1, 3.5]
+    assert list(s.getTest("a", group="b-c").scores) == [2, 4] and s.getTest("a-b", group="c").stats.count == 1
+    try:
+        s.addTests([ptTest("Other metrics", scores=[1]), ptTest("a", group="b-c", metrics="sec")])
+        assert False, "metrics differs"
+    except ptRuntimeException:
+        assert len(s.tests) == 3 and s._tracked_tests_num == 3
+    t = ptTest("Stats test", scores=[1.0, 3.0], stats=True)
+    t.add_score(5.0)
+    t.add_samples(array('d', range(1000)))
+    t.add_sample(-1)
+    try:
+        t.add_score(float('nan'))
+        assert False, "nan in the stats"
+    except ValueError:
+        assert len(t.scores) == 3 and t.stats.count == 1004
+    d = json.loads(json.dumps(t, cls=ptJsonEncoder))
+    assert d['stats']['count'] == 1004 and d['stats']['min'] == -1 and len(d['scores']) == 3
+    assert json.dumps(t, cls=ptJsonEncoder) == json.dumps(t, cls=ptJsonEncoder, reflective=True)
+    assert 'stats' not in json.loads(json.dumps(ptTest("No stats", scores=[1]), cls=ptJsonEncoder))
+    t = ptTest("Compact scores", scores=[1.5, 200], deviations=[1.5, 200])
+    for score in (100.3, 0, 50.5):
+        t.add_score(score)
+        t.add_deviation(score)
+    assert json.dumps(_ptList(t.scores)) == json.dumps(_ptList(t.deviations)) == "[1.5, 200, 100, 0, 50.5]"
+
+    for streaming in (True, False):
+        s = ptSuite(pt_server=suite.pt_server)
+        if streaming:
+            s.readJson(io.BytesIO(suite.toJson(pretty=True).encode('utf-8')))
+        else:
+            s.initFromJson(json.loads(j))
+        assert json.loads(s.toJson()) == json.loads(j) and s._seq_num == suite._seq_num
+        t = suite.tests[-1]
+        assert s.getTest(t.tag, t.group, t.category).uuid == t.uuid and len(s.tests) == len(suite.tests)
+        s.addTest(ptTest("Appended test", scores=[1]))
+        assert s.tests[-1].seq_num == suite._seq_num + 1
+
+    # the tests loaded from json are regular ones
+    t = ptTest("Loaded test", scores=[1.0], stats=True)
+    t = _ptTestFromJson(json.loads(json.dumps(t, cls=ptJsonEncoder)))
+    t.validate()
+    t.add_score(3.0)
+    t.add_samples([5, 7])
+    t.add_sample(9)
+    assert t.stats.count == 5 and t.stats.mean == 5 and t.stats.max == 9 and t.begin <= datetime.datetime.now()
+
+    shards = [ptSuite(pt_server=suite.pt_server, project_name=suite.project_name) for n in range(2)]
+    for n, shard in enumerate(shards):
+        shard.addNode(ptHost("Shard host")).addNode(ptVM("Shard VM %d" % n))
+        shard.addTests([ptTest("Shard test", scores=[n, 1.5], stats=True), ptTest("Shard test %d" % n, scores=[n])])
+    j0, shards[0] = shards[0].toJson(), ptSuite(pt_server=suite.pt_server)
+    shards[0].initFromJson(json.loads(j0))  # the stats summaries loaded from json are merged too
+    m = ptSuite(pt_server=suite.pt_server).merge(*shards)
+    assert len(m.tests) == 3 and list(m.tests[0].scores) == [0, 1.5, 1, 1.5] and m.tests[0].stats.count == 4
+    assert len(m.env_nodes) == 1 and len(m.env_nodes[0].children) == 2 and m.project_name == suite.project_name
+
     suite.initFromJson(json.loads(j))
+
+    # the logs are not uploaded in the garbage collector, but by fini() or at exit
+    suite.__del__()
+    assert [a for a, _ in _pt_pending_outputs.values()] == [suite._stdout_artifact, suite._stderr_artifact]
+    _ptUploadPendingOutputs()
+    assert not _pt_pending_outputs
+    suite.fini()
+    assert suite._stdout_artifact is None
     print("Done, job: %s" % suite.uuid)
 
 
@@ -0,0 +1,464 @@
+#!/usr/bin/env python
+
+from __future__ import print_function, absolute_import
+
+# -*- coding: utf-8 -*-
+__author__ = "perfguru87@gmail.com"
+__copyright__ = "Copyright 2018, The PerfTracker project"
+__license__ = "MIT"
+
+"""
+Parallel tests executor: runs the ptTest command lines on a pool of nodes (local or ssh shells)
+
+    nodes = [ptExecutorNode(ptShell(SecureShellEx("host1", "root")), slots=2, cpusets=["0-3", "4-7"]),
+             ptExecutorNode(ptShell(SecureShellEx("host2", "root")))]
+    executor = ptExecutor(suite, nodes)
+    for c in (1, 8, 64):
+        executor.add(ptTest("ab", category="concurrency=%d" % c, cmdline="ab -c %d ..." % c), parse=parse_ab)
+    executor.add(ptTest("disk io", cmdline="fio ..."), node="host2", exclusive=True)
+    executor.run()
+
+Every node runs up to 'slots' tests at once, an exclusive test runs alone on its node. The finished
+tests are added to the suite and uploaded incrementally while the rest are still running.
+
+Instead of a fixed number of iterations a test can be repeated until its scores converge:
+
+    executor.add(test, iterations=ptConvergence(ci=0.02, warmup=1, max_iterations=20), parse=parse_ab)
+"""
+
+import sys
+import copy
+import time
+import datetime
+import logging
+import threading
+
+from perftrackerlib.client import ptTest, ptRuntimeException
+from perftrackerlib.helpers.ptshell import ptShell
+from perftrackerlib.helpers.stats import ptStats
+
+if sys.version_info >= (3, 0):
+    import queue
+else:
+    import Queue as queue
+
+PT_EXECUTOR_UPLOAD_INTERVAL = 5  # seconds between the incremental uploads of the finished tests
+
+
+def _ptExecute(test, cmdline, shell, parse, name):
+    status, out, err = test.execute(cmdline, shell=shell)
+    if status:
+        test.status = 'FAILED'
+        logging.error("%s: %s: exit status %d\n%s" % (name, cmdline, status, err))
+    if parse:
+        parse(test, status, out, err)
+    return status
+
+
+class ptConvergence:
+    # the test fields the parse function can change, restored after the warm-up iterations
+    _warmup_fields = ('scores', 'deviations', 'loops', 'errors', 'warnings', '_stats')
+
+    def __init__(self, ci=0.02, confidence=0.95, warmup=0, min_iterations=3, max_iterations=30, max_time_sec=None):
+        """
+        ci             - target relative half-width of the confidence interval of the scores mean:
+                         0.02 - the mean is known within +-2%
+        confidence     - the confidence level: 0.9, 0.95 or 0.99
+        warmup         - number of the first iterations which results are discarded
+        min_iterations - min number of the measured iterations
+        max_iterations - max number of the measured iterations, the scores may not converge then
+        max_time_sec   - max time of all the iterations including warm-up, None - no limit
+        """
+        assert ci > 0 and 2 <= min_iterations <= max_iterations
+        self.ci = ci
+        self.confidence = confidence
+        self.warmup = warmup
+        self.min_iterations = min_iterations
+        self.max_iterations = max_iterations
+        self.max_time_sec = max_time_sec
+
+    def __repr__(self):
+        return "ptConvergence(ci=%g, confidence=%g, warmup=%d, iterations=%d..%d)" % \
+            (self.ci, self.confidence, self.warmup, self.min_iterations, self.max_iterations)
+
+    def run(self, test, parse, cmdline=None, shell=None):
+        """
+        Run the command line (test.cmdline by default) on the shell (local by default) until the scores
+        added by parse(test, status, stdout, stderr) converge or a budget is exhausted, stops on errors.
+        The measured iterations number and the achieved confidence interval are recorded in the test
+        attribs: {'iterations': '7', 'ci95': '1.23%', 'converged': 'yes'}. Returns True if converged.
+        """
+        return self._run(test, parse, cmdline, shell, str(shell) if shell else "localhost")
+
+    def _run(self, test, parse, cmdline, shell, name):
+        begin, started = datetime.datetime.now(), time.time()
+
+        def _budget_exhausted():
+            return self.max_time_sec is not None and time.time() - started >= self.max_time_sec
+
+        for i in range(self.warmup):
+            saved = [(f, copy.deepcopy(getattr(test, f))) for f in self._warmup_fields]
+            status = _ptExecute(test, cmdline, shell, parse, name)
+            for f, value in saved:
+                setattr(test, f, value)
+            if status or _budget_exhausted():
+                break
+
+        first = len(test.scores)
+        iterations, rel_ci, converged = 0, None, False
+        while test.status != 'FAILED' and not _budget_exhausted():
+            status = _ptExecute(test, cmdline, shell, parse, name)
+            iterations += 1
+            if status:
+                break
+
+            stats = ptStats()
+            stats.add_many(test.scores[first:])
+            half = stats.confidence_interval(self.confidence)
+            if half is not None:
+                rel_ci = half / abs(stats.mean) if stats.mean else (float('inf') if half else 0.0)
+                if iterations >= self.min_iterations and rel_ci <= self.ci:
+                    converged = True
+                    break
+            if iterations >= self.max_iterations:
+                break
+
+        if test._auto_begin is None:
+            test.begin = begin
+        test.attribs['iterations'] = str(iterations)
+        if rel_ci is not None:
+            test.attribs['ci%g' % (self.confidence * 100)] = "%.2f%%" % (rel_ci * 100)
+        test.attribs['converged'] = "yes" if converged else "no"
+        return converged
+
+
+class ptExecutorNode:
+    def __init__(self, shell=None, name=None, slots=1, cpusets=None):
+        """
+        shell   - ptShell to run the tests on, None - local shell, all the slots share it: every command
+                  runs in its own process (ssh channel for the remote shells)
+        name    - node name to pin the tests to: 'host1', default is the shell name
+        slots   - max number of tests running on the node at once
+        cpusets - CPUs for every slot: ['0-3', '4-7'], the tests are launched by 'taskset -c CPUS cmdline',
+                  so the tests running at once don't share CPUs, the number of slots is len(cpusets) then
+        """
+        self.shell = shell if shell is not None else ptShell()
+        self.name = name if name else str(self.shell)
+        self.cpusets = list(cpusets) if cpusets else None
+        self.slots = len(self.cpusets) if self.cpusets else slots
+        assert self.slots > 0
+
+        self._free = list(range(self.slots))
+
+    def __repr__(self):
+        return "ptExecutorNode('%s', slots=%d)" % (self.name, self.slots)
+
+    def _acquire(self, exclusive):
+        if exclusive:
+            if len(self._free) < self.slots:
+                return None
+            slots, self._free = self._free, []
+            return slots
+        if not self._free:
+            return None
+        return [self._free.pop(0)]
+
+    def _release(self, slots):
+        self._free = sorted(self._free + slots)
+
+    def _cmdline(self, cmdline, slots):
+        if not self.cpusets:
+            return cmdline
+        return "taskset -c %s %s" % (",".join(self.cpusets[s] for s in slots), cmdline)
+
+
+class _ptTask:
+    def __init__(self, test, cmdline, node, exclusive, iterations, parse):
+        self.test = test
+        self.cmdline = cmdline
+        self.node = node
+        self.exclusive = exclusive
+        self.iterations = iterations
+        self.parse = parse
+
+
+class ptExecutor:
+    def __init__(self, suite=None, nodes=None, parallelism=None, upload_interval=PT_EXECUTOR_UPLOAD_INTERVAL):
+        """
+        suite           - ptSuite to add the finished tests to and upload, None - just run the tests
+        nodes           - list of ptExecutorNode, default is the local node with 'parallelism' slots
+        parallelism     - max number of tests running at once, default is the total number of slots
+        upload_interval - min interval (sec) between the suite uploads, 0 - upload every finished test
+        """
+        if not nodes:
+            nodes = [ptExecutorNode(slots=parallelism or 1)]
+        assert len(set(n.name for n in nodes)) == len(nodes), "node names must be unique"
+
+        self.suite = suite
+        self.nodes = nodes
+        self.parallelism = parallelism if parallelism else sum(n.slots for n in nodes)
+        self.upload_interval = upload_interval
+
+        self._tasks = []
+
+    def __repr__(self):
+        return "ptExecutor(%d nodes, parallelism=%d)" % (len(self.nodes), self.parallelism)
+
+    def add(self, test, cmdline=None, node=None, exclusive=False, iterations=1, parse=None):
+        """
+        test       - ptTest to run or a command line: 'ab -c 8 -t 5 http://localhost/'
+        cmdline    - command line to run, default is test.cmdline
+        node       - the node name (or ptExecutorNode) to pin the test to, None - the least loaded node
+        exclusive  - run the test alone on its node
+        iterations - number of the command runs, the test begin and end cover all of them,
+                     or ptConvergence to repeat the test until its scores converge
+        parse      - function(test, status, stdout, stderr) called after every run to add the scores,
+                     it is called in the worker thread
+        """
+        if not isinstance(test, ptTest):
+            test = ptTest(test, cmdline=test)
+        if cmdline is None:
+            cmdline = test.cmdline
+        if cmdline is None:
+            raise ptRuntimeException("%s: the test has no command line" % test.tag)
+        if isinstance(iterations, ptConvergence) and parse is None:
+            raise ptRuntimeException("%s: the scores can't converge without the parse function" % test.tag)
+
+        if node is not None:
+            name = node.name if isinstance(node, ptExecutorNode) else node
+            node = [n for n in self.nodes if n.name == name]
+            if not node:
+                raise ptRuntimeException("%s: unknown node: %s" % (test.tag, name))
+            node = node[0]
+
+        task = _ptTask(test, cmdline, node, exclusive, iterations, parse)
+        self._tasks.append(task)
+        return task.test
+
+    def _place(self, task, blocked):
+        """
+        Returns (node, slots) to run the task on now or (None, None), the nodes a task is waiting for
+        are blocked for the next tasks, so the exclusive and pinned tests don't starve
+        """
+        nodes = [task.node] if task.node else self.nodes
+        candidates = sorted([n for n in nodes if n.name not in blocked], key=lambda n: -len(n._free))
+        for node in candidates:
+            slots = node._acquire(task.exclusive)
+            if slots is not None:
+                return node, slots
+        blocked.update(n.name for n in nodes)
+        return None, None
+
+    def _run(self, task, node, slots, results):
+        test = task.test
+        try:
+            begin = datetime.datetime.now()
+            cmdline = node._cmdline(task.cmdline, slots)
+            if isinstance(task.iterations, ptConvergence):
+                task.iterations._run(test, task.parse, cmdline, node.shell, node.name)
+            else:
+                for i in range(task.iterations):
+                    if _ptExecute(test, cmdline, node.shell, task.parse, node.name):
+                        break
+            if test._auto_begin is None:
+                test.begin = begin
+            results.put((task, node, slots, None))
+        except BaseException as e:
+            results.put((task, node, slots, e))
+
+    def run(self):
+        """
+        Run all the added tests, returns the list of the tests in the order they finished.
+        KeyboardInterrupt, SystemExit and the like stop scheduling the tests, they are re-raised after
+        the running tests finish and the finished ones are uploaded
+        """
+        pending, self._tasks = self._tasks, []
+        results = queue.Queue()
+        running = 0
+        finished = []
+        uploaded = time.time()
+        fatal = None
+
+        while (pending and fatal is None) or running:
+            blocked = set()
+            for task in list(pending) if fatal is None else []:
+                if running >= self.parallelism:
+                    break
+                node, slots = self._place(task, blocked)
+                if node is None:
+                    continue
+                pending.remove(task)
+                test = task.test
+                test.status = 'INPROGRESS'
+                if node.cpusets or len(self.nodes) > 1:
+                    test.attribs['node'] = node.name
+                    if node.cpusets:
+                        test.attribs['cpus'] = ",".join(node.cpusets[s] for s in slots)
+                t = threading.Thread(target=self._run, args=(task, node, slots, results),
+                                     name="ptExecutor-%s" % node.name)
+                t.daemon = True
+                t.start()
+                running += 1
+
+            if not running:
+                raise ptRuntimeException("can't schedule %d tests, e.g. %s" % (len(pending), pending[0].test.tag))
+
+            try:
+                task, node, slots, exc = results.get()
+            except BaseException as e:
+                fatal = fatal or e
+                logging.error("interrupted, waiting for %d running tests" % running)
+                continue
+            running -= 1
+            node._release(slots)
+
+            test = task.test
+            if exc is not None:
+                if not isinstance(exc, Exception) and fatal is None:
+                    fatal = exc
+                    logging.error("interrupted, waiting for %d running tests" % running)
+                test.status = 'FAILED'
+                logging.error("%s: %s: %s" % (node.name, task.cmdline, str(exc)))
+            elif test.status == 'INPROGRESS':
+                test.status = 'SUCCESS'
+            finished.append(test)
+
+            if self.suite is not None:
+                self.suite.addTest(test)
+                if time.time() - uploaded >= self.upload_interval:
+                    self.suite.upload()
+                    uploaded = time.time()
+
+        if self.suite is not None and finished:
+            self.suite.upload()
+        if fatal is not None:
+            raise fatal
+        return finished
+
+
+##############################################################################
+# Autotests
+##############################################################################
+
+
+def _coverage():
+    import os
+    import json
+    import tempfile
+    from perftrackerlib.client import ptSuite
+
+    logging.basicConfig(level=logging.INFO)
+
+    def _parse(test, status, out, err):
+        test.add_score(float(out.split()[0]))
+
+    path = tempfile.mktemp()
+    suite = ptSuite(project_name="Test", save_to_file=path)
+    nodes = [ptExecutorNode(name="node1", slots=2), ptExecutorNode(name="node2", cpusets=["0", "0"])]
+    executor = ptExecutor(suite, nodes, upload_interval=0)
+    print(repr(executor), nodes)
+
+    for n in range(6):
+        executor.add(ptTest("test %d" % n, cmdline="sleep 0.3; echo %d" % n), parse=_parse)
+    excl = executor.add("sleep 0.3; echo 10", node="node1", exclusive=True, iterations=2, parse=_parse)
+    fail = executor.add(ptTest("fail", cmdline="exit 3"), node=nodes[1])
+    broken = executor.add(ptTest("broken", cmdline="echo not-a-number"), parse=_parse)
+
+    begin = time.time()
+    finished = executor.run()
+    duration = time.time() - begin
+    print("%d tests in %.1f sec" % (len(finished), duration))
+
+    assert len(finished) == 9 and duration < 9 * 0.3
+    assert list(excl.scores) == [10, 10] and excl.attribs['node'] == "node1" and excl.status == 'SUCCESS'
+    assert fail.status == 'FAILED' and broken.status == 'FAILED'
+    assert set(t.status for t in finished if t.tag.startswith("test")) == set(['SUCCESS'])
+    assert [t.attribs['cpus'] for t in finished if t.attribs['node'] == "node2"][0] == "0"
+    assert all(list(t.scores) == [int(t.tag.split()[1])] for t in finished if t.tag.startswith("test"))
+
+    # nothing else was running on node1 during the exclusive test
+    for t in finished:
+        if t is not excl and t.attribs['node'] == "node1":
+            assert t.end <= excl.begin or t.begin >= excl.end, (t, t.begin, t.end, excl.begin, excl.end)
+
+    assert len(json.load(open(path))['tests']) == 9
+    os.unlink(path)
+
+    def _scores(values):
+        values = iter(values)
+
+        def _parse(test, status, out, err):
+            test.add_score(next(values))
+            test.loops = (test.loops or 0) + 1
+        return _parse
+
+    stable = ptTest("stable", cmdline="true", stats=True)
+    policy = ptConvergence(ci=0.02, warmup=2, max_iterations=10)
+    print(repr(policy))
+    assert policy.run(stable, _scores([1000, 1000, 10, 10.1, 9.9, 10, 10.1, 9.9]))
+    assert list(stable.scores) == [10, 10.1, 9.9, 10] and stable.loops == 4
+    assert stable.attribs['iterations'] == "4" and stable.attribs['converged'] == "yes" and 'ci95' in stable.attribs
+    assert stable.stats.count == 4 and stable.stats.max == 10.1 and abs(stable.stats.mean - 10) < 1e-9
+
+    noisy = ptTest("noisy", cmdline="true")
+    assert not ptConvergence(max_iterations=6).run(noisy, _scores([1, 100] * 10), shell=ptExecutorNode().shell)
+    assert len(noisy.scores) == 6 and noisy.attribs['converged'] == "no" and float(noisy.attribs['ci95'][:-1]) > 2
+
+    slow = ptTest("slow", cmdline="sleep 0.1")
+    ptConvergence(max_time_sec=0.25, max_iterations=100).run(slow, _scores(range(1, 100)))
+    assert 2 <= len(slow.scores) <= 4 and slow.attribs['converged'] == "no"
+
+    executor = ptExecutor(parallelism=2)
+    failed = executor.add(ptTest("failed", cmdline="exit 1"), iterations=ptConvergence(warmup=1), parse=_scores([1]))
+    zeros = executor.add(ptTest("zeros", cmdline="true"), iterations=ptConvergence(), parse=_scores([0] * 10))
+    executor.run()
+    assert failed.status == 'FAILED' and failed.attribs['iterations'] == "0"
+    assert zeros.attribs['converged'] == "yes" and zeros.attribs['ci95'] == "0.00%"
+    try:
+        executor.add("true", iterations=ptConvergence())
+        assert False, "no parse function"
+    except ptRuntimeException:
+        pass
+
+    def _exit(test, status, out, err):
+        sys.exit(1)
+
+    path = tempfile.mktemp()
+    suite = ptSuite(project_name="Test", save_to_file=path)
+    executor = ptExecutor(suite, parallelism=2)
+    running = executor.add(ptTest("running", cmdline="sleep 0.3; echo 1"), parse=_parse)
+    executor.add(ptTest("exit", cmdline="true"), iterations=1, parse=_exit)
+    queued = executor.add(ptTest("queued", cmdline="echo 2"), parse=_parse)
+    try:
+        executor.run()
+        assert False, "SystemExit is re-raised"
+    except SystemExit:
+        pass
+    assert running.status == 'SUCCESS' and list(running.scores) == [1] and not queued.scores
+    assert sorted(t['tag'] for t in json.load(open(path))['tests']) == ["exit", "running"]
+    os.unlink(path)
+
+    # the slots share the node shell, every test gets the output of its own command
+    executor = ptExecutor(nodes=[ptExecutorNode(slots=8)])
+    shared = [executor.add(ptTest("shared %d" % n, cmdline="sleep 0.0%d; echo %d" % (8 - n, n)), parse=_parse)
+              for n in range(8)]
+    executor.run()
+    assert [list(t.scores) for t in shared] == [[n] for n in range(8)]
+
+    assert ptExecutor().run() == []
+    try:
+        ptExecutor().add(ptTest("no cmdline"))
+        assert False, "no command line"
+    except ptRuntimeException:
+        pass
+    try:
+        ptExecutor().add("true", node="no such node")
+        assert False, "unknown node"
+    except ptRuntimeException:
+        pass
+
+    print("OK")
+
+
+if __name__ == "__main__":
+    _coverage()
@@ -0,0 +1,228 @@
+#!/usr/bin/env python
+
+from __future__ import print_function, absolute_import
+
+# -*- coding: utf-8 -*-
+__author__ = "perfguru87@gmail.com"
+__copyright__ = "Copyright 2018, The PerfTracker project"
+__license__ = "MIT"
+
+"""
+Streaming compression for the HTTP Content-Encoding values: gzip, deflate and zstd (if installed)
+and parallel block compression of big files to multi-stream bz2, xz or zstd
+"""
+
+import os
+import bz2
+import zlib
+import multiprocessing
+from multiprocessing.pool import ThreadPool
+from collections import deque
+
+try:
+    import lzma
+except ImportError:
+    lzma = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+class CompressException(RuntimeError):
+    pass
+
+
+# encoding -> zlib wbits
+_ZLIB_WBITS = {'gzip': 16 + zlib.MAX_WBITS, 'deflate': zlib.MAX_WBITS}
+
+
+def pt_compress_encodings():
+    """
+    Returns the list of supported encodings, the best compression first
+    """
+    return (['zstd'] if zstandard else []) + ['gzip', 'deflate']
+
+
+class ptCompressor:
+    def __init__(self, encoding, level=None):
+        """
+        encoding - Content-Encoding: 'gzip', 'deflate' or 'zstd'
+        level    - compression level, None - the encoding default
+        """
+        if encoding not in pt_compress_encodings():
+            raise CompressException("unsupported encoding '%s', supported: %s" %
+                                    (encoding, ", ".join(pt_compress_encodings())))
+        self.encoding = encoding
+        self.level = level
+
+    def __repr__(self):
+        return "ptCompressor('%s')" % self.encoding
+
+    def _compressobj(self):
+        if self.encoding == 'zstd':
+            return zstandard.ZstdCompressor(level=3 if self.level is None else self.level).compressobj()
+        return zlib.compressobj(6 if self.level is None else self.level, zlib.DEFLATED, _ZLIB_WBITS[self.encoding])
+
+    def compress(self, data):
+        c = self._compressobj()
+        return c.compress(data) + c.flush()
+
+    def chunks(self, chunks):
+        """
+        Compress the iterable of bytes chunks on the fly, only the compressor state is kept in memory
+        """
+        c = self._compressobj()
+        for chunk in chunks:
+            out = c.compress(chunk)
+            if out:
+                yield out
+        out = c.flush()
+        if out:
+            yield out
+
+
+# format -> default level
+_BLOCK_LEVELS = {'bz2': 9, 'xz': 6, 'zstd': 3}
+
+
+def pt_block_formats():
+    return ['bz2'] + (['xz'] if lzma else []) + (['zstd'] if zstandard else [])
+
+
+def _compress_block(fmt, level, data):
+    if fmt == 'bz2':
+        return bz2.compress(data, level)
+    if fmt == 'xz':
+        return lzma.compress(data, preset=level)
+    return zstandard.ZstdCompressor(level=level).compress(data)
+
+
+class ptBlockCompressor:
+    def __init__(self, fmt='bz2', workers=None, block_size=4 * 1024 * 1024, level=None):
+        """
+        fmt        - 'bz2', 'xz' or 'zstd', see pt_block_formats()
+        workers    - number of compressing threads (the compressors release the GIL), None - the number of CPUs
+        block_size - input block size, every block is compressed to a separate stream and the streams
+                     are concatenated, which is a valid file for the standard decompressors
+        level      - compression level, None - the format default
+        """
+        if fmt not in pt_block_formats():
+            raise CompressException("unsupported format '%s', supported: %s" % (fmt, ", ".join(pt_block_formats())))
+        assert block_size > 0
+
+        self.fmt = fmt
+        self.workers = workers if workers else multiprocessing.cpu_count()
+        self.block_size = block_size
+        self.level = _BLOCK_LEVELS[fmt] if level is None else level
+
+    def __repr__(self):
+        return "ptBlockCompressor('%s', workers=%d)" % (self.fmt, self.workers)
+
+    def _blocks(self, f):
+        while True:
+            block = f.read(self.block_size)
+            if not block:
+                break
+            yield block
+
+    def compress_file(self, src_path, dst_path):
+        """
+        Returns the compressed file size, at most 2 blocks per worker are kept in memory
+        """
+        with open(src_path, 'rb') as src, open(dst_path, 'wb') as dst:
+            if self.workers == 1 or os.path.getsize(src_path) <= self.block_size:
+                for block in self._blocks(src):
+                    dst.write(_compress_block(self.fmt, self.level, block))
+                return dst.tell()
+
+            # threads, not processes: no fork from a process which can have other threads running
+            pool = ThreadPool(self.workers)
+            try:
+                pending = deque()
+                for block in self._blocks(src):
+                    pending.append(pool.apply_async(_compress_block, (self.fmt, self.level, block)))
+                    if len(pending) >= 2 * self.workers:
+                        dst.write(pending.popleft().get())
+                while pending:
+                    dst.write(pending.popleft().get())
+            finally:
+                pool.terminate()
+                pool.join()
+            return dst.tell()
+
+
+##############################################################################
+# Autotests
+##############################################################################
+
+
+def _coverage():
+    import io
+    import gzip
+    import shutil
+    import tempfile
+
+    data = b"".join(b'{"tag": "test %d", "group": "group", "metrics": "loops/sec"}, ' % (n % 10) for n in range(10000))
+
+    for encoding in pt_compress_encodings():
+        c = ptCompressor(encoding)
+        whole = c.compress(data)
+        streamed = b"".join(c.chunks(data[i:i + 1000] for i in range(0, len(data), 1000)))
+        print(repr(c), len(data), "->", len(whole))
+        assert len(whole) * 10 < len(data)
+        if encoding == 'gzip':
+            assert gzip.GzipFile(fileobj=io.BytesIO(streamed)).read() == data
+        elif encoding == 'deflate':
+            assert zlib.decompress(streamed) == data
+        else:
+            assert zstandard.ZstdDecompressor().decompressobj().decompress(streamed) == data
+
+    assert b"".join(ptCompressor('deflate', level=1).chunks([])) == zlib.compress(b"", 1)
+
+    d = tempfile.mkdtemp()
+    try:
+        src = os.path.join(d, "src")
+        with open(src, 'wb') as f:
+            f.write(data + os.urandom(50000) + data)
+        orig = open(src, 'rb').read()
+
+        for fmt in pt_block_formats():
+            for workers in (1, 3):
+                c = ptBlockCompressor(fmt, workers=workers, block_size=100000)
+                size = c.compress_file(src, os.path.join(d, "dst"))
+                packed = open(os.path.join(d, "dst"), 'rb').read()
+                print(repr(c), len(orig), "->", size)
+                assert size == len(packed) < len(orig)
+                if fmt == 'bz2':
+                    assert bz2.decompress(packed) == orig
+                elif fmt == 'xz':
+                    assert lzma.decompress(packed) == orig
+                else:
+                    out = b""
+                    while packed:
+                        dobj = zstandard.ZstdDecompressor().decompressobj()
+                        out += dobj.decompress(packed)
+                        packed = dobj.unused_data
+                    assert out == orig
+
+        try:
+            ptBlockCompressor('lz4')
+            assert False, "lz4 is not supported"
+        except CompressException as e:
+            print(e)
+    finally:
+        shutil.rmtree(d)
+
+    try:
+        ptCompressor('brotli')
+        assert False, "brotli is not supported"
+    except CompressException as e:
+        print(e)
+
+    print("OK")
+
+
+if __name__ == "__main__":
+    _coverage()
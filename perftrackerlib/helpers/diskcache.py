@@ -0,0 +1,141 @@
+#!/usr/bin/env python
+
+from __future__ import print_function, absolute_import
+
+# -*- coding: utf-8 -*-
+__author__ = "perfguru87@gmail.com"
+__copyright__ = "Copyright 2018, The PerfTracker project"
+__license__ = "MIT"
+
+"""
+Persistent key-value cache: one small json file per key, replaced atomically, so several
+processes can share the cache directory without locking
+"""
+
+import os
+import json
+import time
+import errno
+import shutil
+import hashlib
+import logging
+import tempfile
+
+
+class ptDiskCache:
+    def __init__(self, cache_dir, namespace="default", ttl_sec=None, clock=time.time):
+        """
+        cache_dir - directory to keep the cache in: '~/.cache/perftrackerlib'
+        namespace - subdirectory for the keys of one kind: 'artifacts'
+        ttl_sec   - default entries time to live, None - forever
+        """
+        self.cache_dir = os.path.join(os.path.abspath(os.path.expanduser(cache_dir)), namespace)
+        self.ttl_sec = ttl_sec
+        self._clock = clock
+
+    def __repr__(self):
+        return "ptDiskCache('%s')" % self.cache_dir
+
+    def _path(self, key):
+        h = hashlib.sha1(key.encode('utf-8')).hexdigest()
+        return os.path.join(self.cache_dir, h[:2], h + ".json")
+
+    def get(self, key, default=None):
+        path = self._path(key)
+        try:
+            with open(path) as f:
+                entry = json.load(f)
+        except (IOError, OSError):
+            return default
+        except ValueError:
+            logging.debug("%s: broken cache entry %s" % (self.cache_dir, path))
+            return default
+
+        if entry.get('key') != key:
+            return default
+        if entry.get('expires') is not None and entry['expires'] <= self._clock():
+            self.delete(key)
+            return default
+        return entry['value']
+
+    def set(self, key, value, ttl_sec=None):
+        """
+        ttl_sec - time to live of this entry, None - the cache default
+        """
+        ttl_sec = self.ttl_sec if ttl_sec is None else ttl_sec
+        entry = {'key': key, 'value': value, 'expires': self._clock() + ttl_sec if ttl_sec else None}
+
+        path = self._path(key)
+        d = os.path.dirname(path)
+        if not os.path.isdir(d):
+            try:
+                os.makedirs(d)
+            except OSError as e:
+                if e.errno != errno.EEXIST:
+                    raise
+
+        fd, tmp = tempfile.mkstemp(dir=d, suffix=".tmp")
+        try:
+            with os.fdopen(fd, 'w') as f:
+                json.dump(entry, f)
+            os.rename(tmp, path)
+        except Exception:
+            os.unlink(tmp)
+            raise
+
+    def delete(self, key):
+        try:
+            os.unlink(self._path(key))
+        except OSError:
+            pass
+
+    def clear(self):
+        shutil.rmtree(self.cache_dir, ignore_errors=True)
+
+
+##############################################################################
+# Autotests
+##############################################################################
+
+
+def _coverage():
+    d = tempfile.mkdtemp()
+    try:
+        now = [1000.0]
+        c = ptDiskCache(d, "test", ttl_sec=10, clock=lambda: now[0])
+        print(repr(c))
+        assert c.get("a") is None and c.get("a", 1) == 1
+        c.set("a", {"uuid": "1"})
+        c.set("b", [1, 2], ttl_sec=100)
+        c.set("c", "forever", ttl_sec=0)
+        c.set("c", "forever!", ttl_sec=0)
+        assert c.get("a") == {"uuid": "1"}
+
+        # another instance (process) sees the same entries
+        assert ptDiskCache(d, "test", clock=lambda: now[0]).get("b") == [1, 2]
+        assert ptDiskCache(d, "other").get("b") is None
+
+        now[0] += 11
+        assert c.get("a") is None and not os.path.exists(c._path("a"))
+        assert c.get("b") == [1, 2]
+        now[0] += 1000
+        assert c.get("b") is None
+        assert c.get("c") == "forever!"
+
+        with open(c._path("c"), 'w') as f:
+            f.write("{broken")
+        assert c.get("c") is None
+        c.delete("c")
+        c.delete("c")
+
+        c.set("d", 1)
+        c.clear()
+        assert c.get("d") is None and not os.path.exists(c.cache_dir)
+    finally:
+        shutil.rmtree(d)
+
+    print("OK")
+
+
+if __name__ == "__main__":
+    _coverage()
@@ -0,0 +1,116 @@
+#!/usr/bin/env python
+
+from __future__ import print_function, absolute_import
+
+# -*- coding: utf-8 -*-
+__author__ = "perfguru87@gmail.com"
+__copyright__ = "Copyright 2018, The PerfTracker project"
+__license__ = "MIT"
+
+"""
+multipart/form-data request body streamed from a file, with the Content-Length known in advance
+"""
+
+import os
+import uuid
+
+
+def _quote(value):
+    # the HTML5 way of escaping the Content-Disposition parameters, the same as in urllib3
+    return value.replace('"', '%22').replace('\r', '%0D').replace('\n', '%0A')
+
+
+class ptMultipartBody:
+    def __init__(self, fields, file_field, filepath, filename=None, boundary=None, progress=None,
+                 block_size=1024 * 1024):
+        """
+        fields     - form fields sent before the file, None values are skipped: {'description': 'logs'}
+        file_field - name of the file field: 'file'
+        filepath   - file to stream, it is read block by block on every iteration over the body
+        filename   - file name to pass in the Content-Disposition, default is the filepath basename
+        boundary   - parts separator, random by default
+        progress   - function called with (bytes sent, total bytes) after every block
+        """
+        self.boundary = boundary if boundary else uuid.uuid4().hex
+        self.content_type = "multipart/form-data; boundary=%s" % self.boundary
+        self.filepath = filepath
+        self.progress = progress
+        self.block_size = block_size
+
+        head = []
+        for name, value in fields.items():
+            if value is None:
+                continue
+            head.append('--%s\r\nContent-Disposition: form-data; name="%s"\r\n\r\n%s\r\n' %
+                        (self.boundary, _quote(name), value))
+        head.append('--%s\r\nContent-Disposition: form-data; name="%s"; filename="%s"\r\n\r\n' %
+                    (self.boundary, _quote(file_field), _quote(filename or os.path.basename(filepath))))
+
+        self._head = "".join(head).encode('utf-8')
+        self._tail = ('\r\n--%s--\r\n' % self.boundary).encode('utf-8')
+        self._len = len(self._head) + os.path.getsize(filepath) + len(self._tail)
+
+    def __len__(self):
+        return self._len
+
+    def __iter__(self):
+        sent = 0
+        for block in self._blocks():
+            sent += len(block)
+            yield block
+            if self.progress:
+                self.progress(sent, self._len)
+
+    def _blocks(self):
+        yield self._head
+        with open(self.filepath, 'rb') as f:
+            while True:
+                block = f.read(self.block_size)
+                if not block:
+                    break
+                yield block
+        yield self._tail
+
+
+##############################################################################
+# Autotests
+##############################################################################
+
+
+def _coverage():
+    import email
+    import shutil
+    import tempfile
+
+    d = tempfile.mkdtemp()
+    try:
+        path = os.path.join(d, "data.bin")
+        data = os.urandom(100000)
+        with open(path, 'wb') as f:
+            f.write(data)
+
+        progress = []
+        body = ptMultipartBody({'description': 'my "file"', 'mime': None, 'inline': True}, 'file', path,
+                               progress=lambda sent, total: progress.append((sent, total)), block_size=30000)
+        raw = b"".join(body)
+        assert len(raw) == len(body)
+        assert progress[-1] == (len(body), len(body)) and len(progress) == 6
+        assert b"".join(body) == raw  # can be iterated again, e.g. on retry
+
+        parse = getattr(email, 'message_from_bytes', email.message_from_string)
+        msg = parse(("Content-Type: %s\r\n\r\n" % body.content_type).encode('utf-8') + raw)
+        parts = msg.get_payload()
+        print(repr(body.content_type), [p.get_param('name', header='content-disposition') for p in parts])
+        assert [p.get_param('name', header='content-disposition') for p in parts] == ['description', 'inline', 'file']
+        assert parts[0].get_payload() == 'my "file"'
+        assert parts[1].get_payload() == 'True'
+        assert parts[2].get_filename() == "data.bin"
+        assert parts[2].get_payload(decode=True) == data
+    finally:
+        shutil.rmtree(d)
+
+    print("OK")
+
+
+if __name__ == "__main__":
+    _coverage()
@@ -226,7 +226,10 @@ class ptShell:
 
     def execute(self, cmdline, raise_exc=True):
         self._debug("%s ..." % cmdline)
-        ret = self.shell(cmdline)
+        # not self.shell(cmdline): it keeps the result in the shell object, so the commands run on the
+        # shell by several threads at once could get each other's result. Every command runs on its own
+        # process or ssh channel, so the shell can be shared by the threads (e.g. the ptExecutor slots)
+        ret = self.shell.execute_command(cmdline, dict(self.shell), True, self.shell._check_err, None)
         if ret.exit_code():
             msg = "ERROR: %s: %s, exit status: %d\n%s %s" % (str(self), cmdline, ret.exit_code(), ret.stderr(),
                                                              ret.stdout())
@@ -0,0 +1,192 @@
+#!/usr/bin/env python
+
+from __future__ import print_function, absolute_import
+
+# -*- coding: utf-8 -*-
+__author__ = "perfguru87@gmail.com"
+__copyright__ = "Copyright 2018, The PerfTracker project"
+__license__ = "MIT"
+
+"""
+Retry policy with exponential backoff and a circuit breaker
+"""
+
+import time
+import random
+import logging
+import threading
+
+
+class CircuitOpenException(RuntimeError):
+    pass
+
+
+class ptRetryPolicy:
+    def __init__(self, max_attempts=4, backoff_sec=0.5, backoff_max_sec=30.0, jitter=0.5,
+                 retry_statuses=(429, 502, 503, 504)):
+        """
+        max_attempts    - total number of attempts including the first one, 1 - no retries
+        backoff_sec     - delay before the first retry, doubled on every next retry
+        backoff_max_sec - upper limit for a single delay
+        jitter          - fraction of the delay randomized to spread parallel clients: 0.5
+        retry_statuses  - HTTP statuses worth a retry: (429, 502, 503, 504), 500 is not retried by default
+                          since it is usually caused by the request itself and would be repeated
+        """
+        assert max_attempts >= 1
+        assert 0 <= jitter <= 1
+
+        self.max_attempts = max_attempts
+        self.backoff_sec = backoff_sec
+        self.backoff_max_sec = backoff_max_sec
+        self.jitter = jitter
+        self.retry_statuses = set(retry_statuses)
+
+    def retry_status(self, status_code):
+        return status_code in self.retry_statuses
+
+    def delay(self, attempt, retry_after=None):
+        """
+        attempt     - number of the failed attempt, starting from 1
+        retry_after - server suggested delay (sec), used if it is longer than the backoff
+        """
+        d = min(self.backoff_max_sec, self.backoff_sec * (2 ** (attempt - 1)))
+        d = d * (1 - self.jitter) + random.uniform(0, d * self.jitter)
+        if retry_after:
+            d = max(d, min(self.backoff_max_sec, retry_after))
+        return d
+
+    def sleep(self, attempt, retry_after=None):
+        d = self.delay(attempt, retry_after)
+        logging.debug("retry #%d in %.2f sec" % (attempt, d))
+        time.sleep(d)
+
+
+class ptCircuitBreaker:
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half-open'
+
+    def __init__(self, failure_threshold=5, reset_timeout_sec=30.0, clock=time.time):
+        """
+        failure_threshold - number of consecutive failures which opens the circuit
+        reset_timeout_sec - time the circuit stays open before a single trial request is let through
+        """
+        assert failure_threshold >= 1
+
+        self.failure_threshold = failure_threshold
+        self.reset_timeout_sec = reset_timeout_sec
+
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._failures = 0
+        self._opened_at = None
+        self._trial_in_progress = False
+
+    @property
+    def state(self):
+        with self._lock:
+            return self._state()
+
+    def _state(self):
+        if self._opened_at is None:
+            return self.CLOSED
+        if self._clock() - self._opened_at >= self.reset_timeout_sec:
+            return self.HALF_OPEN
+        return self.OPEN
+
+    def before_request(self):
+        with self._lock:
+            state = self._state()
+            if state == self.CLOSED:
+                return
+            if state == self.HALF_OPEN and not self._trial_in_progress:
+                self._trial_in_progress = True
+                return
+            raise CircuitOpenException("circuit breaker is open after %d consecutive failures, retry in %.1f sec" %
+                                       (self._failures, self._retry_in()))
+
+    def _retry_in(self):
+        if self._opened_at is None:
+            return 0
+        return max(0, self.reset_timeout_sec - (self._clock() - self._opened_at))
+
+    def success(self):
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+            self._trial_in_progress = False
+
+    def failure(self):
+        with self._lock:
+            self._failures += 1
+            if self._trial_in_progress or self._failures >= self.failure_threshold:
+                if self._opened_at is None or self._trial_in_progress:
+                    logging.warning("circuit breaker opened after %d consecutive failures" % self._failures)
+                self._opened_at = self._clock()
+            self._trial_in_progress = False
+
+    def release(self):
+        """
+        The request failed before the server could answer for a local reason (e.g. a broken request body),
+        the failure is not counted, but a half-open trial slot is freed for the next request
+        """
+        with self._lock:
+            self._trial_in_progress = False
+
+
+##############################################################################
+# Autotests
+##############################################################################
+
+
+def _coverage():
+    p = ptRetryPolicy(max_attempts=3, backoff_sec=1, backoff_max_sec=5, jitter=0)
+    assert p.delay(1) == 1
+    assert p.delay(3) == 4
+    assert p.delay(10) == 5
+    assert p.delay(1, retry_after=3) == 3
+    assert p.retry_status(503) and not p.retry_status(404) and not p.retry_status(500)
+
+    p = ptRetryPolicy(backoff_sec=0.001, jitter=1)
+    assert 0 <= p.delay(1) <= 0.001
+    p.sleep(1)
+
+    now = [0.0]
+    cb = ptCircuitBreaker(failure_threshold=2, reset_timeout_sec=10, clock=lambda: now[0])
+    cb.before_request()
+    cb.failure()
+    assert cb.state == cb.CLOSED
+    cb.failure()
+    assert cb.state == cb.OPEN
+
+    try:
+        cb.before_request()
+        assert False, "circuit breaker must be open"
+    except CircuitOpenException as e:
+        print(e)
+
+    now[0] = 11.0
+    assert cb.state == cb.HALF_OPEN
+    cb.before_request()  # the trial request
+    try:
+        cb.before_request()
+        assert False, "only one trial request is allowed"
+    except CircuitOpenException:
+        pass
+    cb.failure()
+    assert cb.state == cb.OPEN
+
+    now[0] = 22.0
+    cb.before_request()
+    cb.release()  # a local error, the next request is the trial
+    assert cb.state == cb.HALF_OPEN and cb._failures == 3
+    cb.before_request()
+    cb.success()
+    assert cb.state == cb.CLOSED
+    cb.before_request()
+
+    print("OK")
+
+
+if __name__ == "__main__":
+    _coverage()
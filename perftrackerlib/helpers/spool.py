@@ -0,0 +1,236 @@
+#!/usr/bin/env python
+
+from __future__ import print_function, absolute_import
+
+# -*- coding: utf-8 -*-
+__author__ = "perfguru87@gmail.com"
+__copyright__ = "Copyright 2018, The PerfTracker project"
+__license__ = "MIT"
+
+"""
+Durable append-only spool: a journal of json records plus blob files
+
+Every record is one json line appended and fsync'ed in a single write, so a crash can
+only leave a torn last line which is skipped on read. Blobs are copied into the spool
+directory before the record referencing them is written.
+"""
+
+import os
+import json
+import uuid
+import time
+import shutil
+import itertools
+import logging
+import tempfile
+from collections import OrderedDict
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+
+class SpoolException(RuntimeError):
+    pass
+
+
+class ptSpool:
+    JOURNAL = "journal.jsonl"
+    LOCK = "journal.lock"
+
+    def __init__(self, spool_dir):
+        self.spool_dir = os.path.abspath(os.path.expanduser(spool_dir))
+        if not os.path.isdir(self.spool_dir):
+            os.makedirs(self.spool_dir)
+        self._journal = os.path.join(self.spool_dir, self.JOURNAL)
+
+    def __repr__(self):
+        return "ptSpool('%s')" % self.spool_dir
+
+    def _lock(self):
+        f = open(os.path.join(self.spool_dir, self.LOCK), 'a')
+        if fcntl:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+        return f
+
+    @staticmethod
+    def _unlock(f):
+        if fcntl:
+            fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+        f.close()
+
+    def append(self, kind, key, meta=None, data=None, blob_path=None):
+        """
+        kind      - record type: 'job'
+        key       - object the record belongs to, used to deduplicate records: job uuid
+        meta      - small json-serializable dict: {'project_id': 1}
+        data      - json text stored as is (must be one line): '{"uuid": ...}',
+                    or a function returning the json text chunks, to store a big document without joining it
+        blob_path - file to copy into the spool
+        """
+        rec_id = uuid.uuid4().hex
+
+        blob = None
+        if blob_path:
+            blob = "%s.blob" % rec_id
+            fd, tmp = tempfile.mkstemp(dir=self.spool_dir, suffix=".tmp")
+            with os.fdopen(fd, 'wb') as dst, open(blob_path, 'rb') as src:
+                shutil.copyfileobj(src, dst)
+                dst.flush()
+                os.fsync(dst.fileno())
+            os.rename(tmp, os.path.join(self.spool_dir, blob))
+
+        head = json.dumps(OrderedDict([('id', rec_id), ('kind', kind), ('key', str(key)), ('time', time.time()),
+                                       ('meta', meta if meta else {}), ('blob', blob)]))
+        if data is None:
+            chunks = [head + "\n"]
+        elif callable(data):
+            chunks = itertools.chain(["%s, \"data\": " % head[:-1]], data(), ["}\n"])
+        else:
+            assert "\n" not in data
+            chunks = ["%s, \"data\": %s}\n" % (head[:-1], data)]
+
+        lock = self._lock()
+        try:
+            fd = os.open(self._journal, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+            try:
+                self._terminate(fd)
+                # a crash in the middle leaves a torn last line, which is skipped on read
+                try:
+                    for chunk in chunks:
+                        os.write(fd, chunk.encode('utf-8'))
+                except Exception:
+                    os.write(fd, b"\n")  # terminate the torn line, so it doesn't swallow the next record
+                    raise
+                os.fsync(fd)
+            finally:
+                os.close(fd)
+        finally:
+            self._unlock(lock)
+
+        logging.debug("%s: spooled %s record for %s" % (self.spool_dir, kind, key))
+        return rec_id
+
+    def _terminate(self, fd):
+        # a crash could leave a torn last line without the newline, the record must not be appended to it
+        size = os.fstat(fd).st_size
+        if not size:
+            return
+        with open(self._journal, 'rb') as f:
+            f.seek(size - 1)
+            if f.read(1) != b"\n":
+                os.write(fd, b"\n")
+
+    def _read(self):
+        if not os.path.exists(self._journal):
+            return []
+
+        records = []
+        with open(self._journal, 'rb') as f:
+            for n, line in enumerate(f):
+                try:
+                    rec = json.loads(line.decode('utf-8'), object_pairs_hook=OrderedDict)
+                except ValueError:
+                    logging.warning("%s: skipping broken record at line %d" % (self._journal, n + 1))
+                    continue
+                if rec.get('blob'):
+                    rec['blob'] = os.path.join(self.spool_dir, rec['blob'])
+                records.append(rec)
+        return records
+
+    def records(self):
+        """
+        Returns the list of spooled records in the order they were appended
+        """
+        lock = self._lock()
+        try:
+            return self._read()
+        finally:
+            self._unlock(lock)
+
+    def remove(self, record_ids):
+        """
+        Drop the records (and their blobs) which have been delivered
+        """
+        record_ids = set(record_ids)
+        if not record_ids:
+            return
+
+        lock = self._lock()
+        try:
+            keep = []
+            with open(self._journal, 'rb') as f:
+                for line in f:
+                    try:
+                        rec = json.loads(line.decode('utf-8'))
+                    except ValueError:
+                        continue
+                    if rec['id'] not in record_ids:
+                        keep.append(line)
+                    elif rec.get('blob'):
+                        blob = os.path.join(self.spool_dir, rec['blob'])
+                        if os.path.exists(blob):
+                            os.unlink(blob)
+
+            fd, tmp = tempfile.mkstemp(dir=self.spool_dir, suffix=".tmp")
+            with os.fdopen(fd, 'wb') as f:
+                f.writelines(keep)
+                f.flush()
+                os.fsync(f.fileno())
+            os.rename(tmp, self._journal)
+        finally:
+            self._unlock(lock)
+
+    def empty(self):
+        return not os.path.exists(self._journal) or os.path.getsize(self._journal) == 0
+
+
+##############################################################################
+# Autotests
+##############################################################################
+
+
+def _coverage():
+    d = tempfile.mkdtemp()
+    try:
+        s = ptSpool(os.path.join(d, "spool"))
+        assert s.empty()
+        assert s.records() == []
+        s.remove([])
+
+        r1 = s.append('job', 'job-1', meta={'project_id': 1}, data=json.dumps({'uuid': 'job-1', 'tests': [1]}))
+        blob = os.path.join(d, "file.txt")
+        with open(blob, 'w') as f:
+            f.write("blob data")
+        r2 = s.append('artifact', 'a-1', meta={'filename': 'file.txt'}, blob_path=blob)
+        s.append('job', 'job-1', data=lambda: iter(['{"uuid": "job-1", ', '"tests": [2]}']))
+
+        # emulate a crash in the middle of a write
+        with open(s._journal, 'ab') as f:
+            f.write(b'{"id": "torn", "kind": "jo')
+        r3 = s.append('job', 'job-2')
+
+        records = s.records()
+        print(repr(s), [r['kind'] for r in records])
+        assert [r['id'] for r in records] == [r1, r2, records[2]['id'], r3]
+        assert records[0]['data']['tests'] == [1]
+        assert records[0]['meta']['project_id'] == 1
+        assert open(records[1]['blob']).read() == "blob data"
+        assert not s.empty()
+
+        s.remove([r1, r2, r3])
+        records = s.records()
+        assert len(records) == 1 and records[0]['data']['tests'] == [2]
+        assert not [n for n in os.listdir(s.spool_dir) if n.endswith(".blob")]
+
+        s.remove([records[0]['id']])
+        assert s.empty()
+    finally:
+        shutil.rmtree(d)
+
+    print("OK")
+
+
+if __name__ == "__main__":
+    _coverage()
@@ -0,0 +1,345 @@
+#!/usr/bin/env python
+
+from __future__ import print_function, absolute_import, division
+
+# -*- coding: utf-8 -*-
+__author__ = "perfguru87@gmail.com"
+__copyright__ = "Copyright 2018, The PerfTracker project"
+__license__ = "MIT"
+
+"""
+Online statistics in constant memory: count, mean and variance (Welford), min, max and quantiles
+from a log-bucketed histogram with a bounded relative error (the DDSketch way). The accumulators
+can be merged, e.g. the per-thread or per-process ones. The values must be finite: inf and nan
+are rejected by ValueError, the stats are not changed then.
+"""
+
+import math
+import bisect
+from collections import OrderedDict
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+PT_STATS_QUANTILES = (50, 90, 99, 99.9)
+PT_STATS_NUMPY_MIN_SIZE = 256  # add_many() of smaller lists is done by python code
+
+# two-sided Student's t critical values by confidence level for the degrees of freedom in _pt_t_df
+_pt_t_df = (1, 2, 3, 4, 5, 6, 7, 8, 9, 10, 11, 12, 13, 14, 15, 16, 17, 18, 19, 20, 21, 22, 23, 24, 25, 26, 27, 28,
+            29, 30, 40, 60, 120)
+_pt_t_critical = {
+    0.9: (6.314, 2.920, 2.353, 2.132, 2.015, 1.943, 1.895, 1.860, 1.833, 1.812, 1.796, 1.782, 1.771, 1.761, 1.753,
+          1.746, 1.740, 1.734, 1.729, 1.725, 1.721, 1.717, 1.714, 1.711, 1.708, 1.706, 1.703, 1.701, 1.699, 1.697,
+          1.684, 1.671, 1.658, 1.645),
+    0.95: (12.706, 4.303, 3.182, 2.776, 2.571, 2.447, 2.365, 2.306, 2.262, 2.228, 2.201, 2.179, 2.160, 2.145, 2.131,
+           2.120, 2.110, 2.101, 2.093, 2.086, 2.080, 2.074, 2.069, 2.064, 2.060, 2.056, 2.052, 2.048, 2.045, 2.042,
+           2.021, 2.000, 1.980, 1.960),
+    0.99: (63.657, 9.925, 5.841, 4.604, 4.032, 3.707, 3.499, 3.355, 3.250, 3.169, 3.106, 3.055, 3.012, 2.977, 2.947,
+           2.921, 2.898, 2.878, 2.861, 2.845, 2.831, 2.819, 2.807, 2.797, 2.787, 2.779, 2.771, 2.763, 2.756, 2.750,
+           2.704, 2.660, 2.617, 2.576),
+}
+
+
+def pt_t_critical(df, confidence=0.95):
+    """
+    Two-sided Student's t critical value for the degrees of freedom and the confidence level: 0.9, 0.95 or 0.99,
+    the values between the table ones are interpolated by 1/df (the last one is for the infinite df)
+    """
+    values = _pt_t_critical[confidence]
+    assert df >= 1
+    if df > _pt_t_df[-1]:
+        lo, hi, w = values[-2], values[-1], 1.0 - float(_pt_t_df[-1]) / df
+        return lo + (hi - lo) * w
+    i = bisect.bisect_left(_pt_t_df, df)
+    if _pt_t_df[i] == df:
+        return values[i]
+    lo_df, hi_df = _pt_t_df[i - 1], _pt_t_df[i]
+    w = (1.0 / lo_df - 1.0 / df) / (1.0 / lo_df - 1.0 / hi_df)
+    return values[i - 1] + (values[i] - values[i - 1]) * w
+
+
+class ptStats:
+    def __init__(self, relative_accuracy=0.01):
+        """
+        relative_accuracy - max relative error of the quantiles: 0.01 - 1%, the number of buckets
+                            is ~ log(max / min) / (2 * relative_accuracy), e.g. ~1400 for 1ns..1000s
+        """
+        assert 0 < relative_accuracy < 1
+        self.relative_accuracy = relative_accuracy
+        self.count = 0
+        self.mean = 0.0
+        self.min = None
+        self.max = None
+
+        self._gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self._log_gamma = math.log(self._gamma)
+        self._m2 = 0.0
+        self._positive = {}  # bucket index -> count, the bucket i holds the values in (gamma^(i-1), gamma^i]
+        self._negative = {}  # the same for the absolute values of the negative ones
+        self._zeros = 0
+        self._loaded = None  # the summary the stats are loaded from, see from_summary()
+        self._unbucketed = 0  # the number of values not accounted in the buckets (loaded from summaries)
+
+    @classmethod
+    def from_summary(cls, summary, relative_accuracy=0.01):
+        """
+        ptStats of the summary() dict, e.g. loaded from json: the count, mean, stddev, min and max are restored,
+        the summary quantiles are reported until more values are added (they can't be restored from the summary)
+        """
+        s = cls(relative_accuracy)
+        if summary and summary.get('count'):
+            s.count = summary['count']
+            s.mean = float(summary['mean'])
+            s._m2 = (summary.get('stddev') or 0.0) ** 2 * (s.count - 1)
+            s.min = summary['min']
+            s.max = summary['max']
+            s._unbucketed = s.count
+            s._loaded = summary
+        return s
+
+    def __len__(self):
+        return self.count
+
+    def __repr__(self):
+        return "ptStats(count=%d, mean=%s, min=%s, max=%s)" % (self.count, self.mean, self.min, self.max)
+
+    def _bucket(self, value):
+        return int(math.ceil(math.log(value) / self._log_gamma))
+
+    @staticmethod
+    def _check(value):
+        if math.isinf(value) or math.isnan(value):
+            raise ValueError("ptStats: the value must be finite, got %r" % value)
+
+    def add(self, value):
+        self._check(value)
+        self._loaded = None
+        self.count += 1
+        delta = value - self.mean
+        self.mean += delta / self.count
+        self._m2 += delta * (value - self.mean)
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+
+        if value > 0:
+            i = self._bucket(value)
+            self._positive[i] = self._positive.get(i, 0) + 1
+        elif value < 0:
+            i = self._bucket(-value)
+            self._negative[i] = self._negative.get(i, 0) + 1
+        else:
+            self._zeros += 1
+
+    def add_many(self, values):
+        """
+        values - list, tuple, array or numpy array, vectorized with numpy if it is installed
+        """
+        if numpy is None or len(values) < PT_STATS_NUMPY_MIN_SIZE:
+            for v in values:
+                self._check(v)
+            for v in values:
+                self.add(v)
+            return
+
+        v = numpy.asarray(values, dtype=numpy.float64).ravel()
+        if not numpy.isfinite(v).all():
+            self._check(v[~numpy.isfinite(v)][0])
+        other = ptStats(self.relative_accuracy)
+        other.count = len(v)
+        other.mean = float(v.mean())
+        other._m2 = float(((v - other.mean) ** 2).sum())
+        other.min = float(v.min())
+        other.max = float(v.max())
+        for values, buckets in ((v[v > 0], other._positive), (-v[v < 0], other._negative)):
+            if len(values):
+                idx, counts = numpy.unique(numpy.ceil(numpy.log(values) / self._log_gamma), return_counts=True)
+                buckets.update(zip(idx.astype(int).tolist(), counts.tolist()))
+        other._zeros = int((v == 0).sum())
+        self.merge(other)
+
+    def merge(self, other):
+        """
+        Add the values accounted by the other ptStats with the same relative_accuracy
+        """
+        assert other.relative_accuracy == self.relative_accuracy
+        if not other.count:
+            return self
+
+        self._loaded = other._loaded if not self.count else None
+        self._unbucketed += other._unbucketed
+        count = self.count + other.count
+        delta = other.mean - self.mean
+        self._m2 += other._m2 + delta * delta * self.count * other.count / count
+        self.mean += delta * other.count / count
+        self.count = count
+        self.min = other.min if self.min is None else min(self.min, other.min)
+        self.max = other.max if self.max is None else max(self.max, other.max)
+
+        for buckets, other_buckets in ((self._positive, other._positive), (self._negative, other._negative)):
+            for i, n in other_buckets.items():
+                buckets[i] = buckets.get(i, 0) + n
+        self._zeros += other._zeros
+        return self
+
+    @property
+    def variance(self):
+        return self._m2 / (self.count - 1) if self.count > 1 else 0.0
+
+    @property
+    def stddev(self):
+        return math.sqrt(self.variance)
+
+    def confidence_interval(self, confidence=0.95):
+        """
+        Half-width of the confidence interval of the mean: the mean is within mean +- the returned value
+        with the given confidence (0.9, 0.95 or 0.99), None if there are less than 2 values
+        """
+        if self.count < 2:
+            return None
+        return pt_t_critical(self.count - 1, confidence) * self.stddev / math.sqrt(self.count)
+
+    def quantile(self, q):
+        """
+        q - quantile in [0, 1]: 0.99, returns None if there are no values
+        """
+        if not self.count:
+            return None
+        if self._unbucketed:
+            return self._loaded.get("p%g" % (q * 100)) if self._loaded is not None else None
+        rank = q * (self.count - 1)
+
+        seen = 0
+        for i in sorted(self._negative, reverse=True):
+            seen += self._negative[i]
+            if seen > rank:
+                return max(self.min, -self._value(i))
+        seen += self._zeros
+        if seen > rank:
+            return 0.0
+        for i in sorted(self._positive):
+            seen += self._positive[i]
+            if seen > rank:
+                return min(self.max, self._value(i))
+        return self.max
+
+    def _value(self, i):
+        # the value with the same relative error to both bucket bounds
+        return 2 * self._gamma ** i / (self._gamma + 1)
+
+    def summary(self, quantiles=PT_STATS_QUANTILES):
+        """
+        Returns {'count': ..., 'mean': ..., 'stddev': ..., 'min': ..., 'max': ..., 'p50': ..., ...},
+        the quantiles which can't be computed (see from_summary()) are skipped
+        """
+        if self._loaded is not None and quantiles == PT_STATS_QUANTILES:
+            return OrderedDict(self._loaded)
+        s = OrderedDict([('count', self.count), ('mean', self.mean), ('stddev', self.stddev),
+                         ('min', self.min), ('max', self.max)])
+        for q in quantiles:
+            value = self.quantile(q / 100.0)
+            if value is not None or not self._unbucketed:
+                s["p%g" % q] = value
+        return s
+
+
+def pt_stats_merge_summaries(summaries):
+    """
+    Merge the ptStats.summary() dicts, e.g. the ones loaded from json: the count, mean, stddev, min
+    and max are exact, the quantiles of several summaries can't be merged and are dropped
+    """
+    merged = ptStats()
+    for s in summaries:
+        merged.merge(ptStats.from_summary(s))
+    return merged.summary() if merged.count else None
+
+
+##############################################################################
+# Autotests
+##############################################################################
+
+
+def _coverage():
+    import json
+    import random
+
+    random.seed(1)
+    values = [random.lognormvariate(0, 2) for _ in range(20000)] + [0, 0, -1.5, -0.001, -200]
+    random.shuffle(values)
+
+    s = ptStats()
+    assert s.quantile(0.5) is None and not s and s.variance == 0
+    for v in values:
+        s.add(v)
+    print(repr(s), s.summary())
+
+    n = len(values)
+    mean = sum(values) / n
+    assert s.count == n and abs(s.mean - mean) < 1e-9 * abs(mean)
+    assert abs(s.variance - sum((v - mean) ** 2 for v in values) / (n - 1)) < 1e-9 * s.variance
+    assert s.min == min(values) and s.max == max(values)
+
+    ordered = sorted(values)
+    for q in (0, 0.0001, 0.001, 0.01, 0.1, 0.5, 0.9, 0.99, 0.999, 1):
+        exact = ordered[int(q * (n - 1))]
+        assert abs(s.quantile(q) - exact) <= s.relative_accuracy * abs(exact), (q, s.quantile(q), exact)
+    assert list(s.summary()) == ['count', 'mean', 'stddev', 'min', 'max', 'p50', 'p90', 'p99', 'p99.9']
+
+    # merged and bulk added accumulators are the same
+    parts = [ptStats(), ptStats(), ptStats()]
+    parts[0].add_many(values[:10])
+    parts[1].add_many(values[10:n // 2])
+    parts[2].add_many(values[n // 2:])
+    m = ptStats().merge(parts[0]).merge(parts[1]).merge(parts[2]).merge(ptStats())
+    assert m.count == n and abs(m.mean - s.mean) < 1e-9 * abs(s.mean)
+    assert abs(m.variance - s.variance) < 1e-9 * s.variance
+    assert (m.min, m.max, m._zeros) == (s.min, s.max, s._zeros)
+    assert m._positive == s._positive and m._negative == s._negative
+
+    merged = pt_stats_merge_summaries([p.summary() for p in parts] + [None, ptStats().summary()])
+    assert merged['count'] == n and abs(merged['mean'] - s.mean) < 1e-9 * abs(s.mean)
+    assert abs(merged['stddev'] - s.stddev) < 1e-9 * s.stddev and merged['max'] == s.max
+    assert pt_stats_merge_summaries([]) is None
+
+    # the stats loaded from a summary report it until more values are added, the moments stay exact
+    loaded = ptStats.from_summary(json.loads(json.dumps(parts[1].summary())))
+    assert loaded.summary() == parts[1].summary() and loaded.quantile(0.99) == parts[1].quantile(0.99)
+    loaded.add_many(values[n // 2:])
+    loaded.merge(parts[0])
+    assert loaded.count == n and abs(loaded.mean - s.mean) < 1e-9 * abs(s.mean) and loaded.max == s.max
+    assert abs(loaded.stddev - s.stddev) < 1e-9 * s.stddev and loaded.quantile(0.5) is None
+    assert list(loaded.summary()) == ['count', 'mean', 'stddev', 'min', 'max']
+    assert ptStats().merge(ptStats.from_summary(parts[2].summary())).summary() == parts[2].summary()
+    assert ptStats.from_summary(None).count == 0 and ptStats.from_summary(ptStats().summary()).quantile(0.5) is None
+
+    assert pt_t_critical(1) == 12.706 and pt_t_critical(30, 0.99) == 2.750 and pt_t_critical(10 ** 9) < 1.9601
+    assert 2.021 > pt_t_critical(50) > 2.000 and 1.980 > pt_t_critical(1000) > 1.960
+    ci = ptStats()
+    assert ci.confidence_interval() is None
+    ci.add_many([10, 12, 11, 13])
+    assert abs(ci.confidence_interval() - 3.182 * ci.stddev / 2) < 1e-12
+    assert ci.confidence_interval(0.99) > ci.confidence_interval() > ci.confidence_interval(0.9)
+
+    # the not finite values are rejected before any state is changed
+    for bad in (float('inf'), float('-inf'), float('nan')):
+        for add in (ci.add, lambda v: ci.add_many([1.0, v]), lambda v: ci.add_many([1.0] * 1000 + [v])):
+            try:
+                add(bad)
+                assert False, "%r is accepted" % bad
+            except ValueError:
+                pass
+    assert ci.count == 4 and ci.mean == 11.5 and ci.min == 10 and ci.max == 13 and not ci._zeros
+    assert sum(ci._positive.values()) == 4 and abs(ci.confidence_interval() - 3.182 * ci.stddev / 2) < 1e-12
+
+    z = ptStats(relative_accuracy=0.05)
+    z.add_many([0.0] * 3)
+    assert z.quantile(0.5) == 0.0 and z.stddev == 0.0
+
+    print("OK")
+
+
+if __name__ == "__main__":
+    _coverage()
@@ -21,6 +21,8 @@ perftracker client and some helpers)
 mkdir $RPM_BUILD_ROOT/bin
 touch $RPM_BUILD_ROOT/bin/pt-suite-uploader.py
 touch $RPM_BUILD_ROOT/bin/pt-artifact-ctl.py
+touch $RPM_BUILD_ROOT/bin/pt-spool-flush.py
+touch $RPM_BUILD_ROOT/bin/pt-suite-merge.py
 
 %post
 echo -e "\n====== Installing the perftracker-lib v%{_ver} from sources =======\n"
@@ -39,6 +41,8 @@ echo -e "\n====== The perftracker-lib uninstallation done =========\n"
 %ghost
 /bin/pt-suite-uploader.py
 /bin/pt-artifact-ctl.py
+/bin/pt-spool-flush.py
+/bin/pt-suite-merge.py
 
 %changelog
 * Mon Jul 20 2020 <perfguru87@gmail.com>
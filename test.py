@@ -19,8 +19,20 @@ libs = [("perftrackerlib/client.py", 73),
         ("perftrackerlib/helpers/timehelpers.py", 100),
         ("perftrackerlib/helpers/textparser.py", 100),
         ("perftrackerlib/helpers/html.py", 100),
+        ("perftrackerlib/helpers/retry.py", 95),
+        ("perftrackerlib/helpers/spool.py", 95),
+        ("perftrackerlib/helpers/compress.py", 90),
+        ("perftrackerlib/helpers/multipart.py", 95),
+        ("perftrackerlib/helpers/diskcache.py", 90),
+        ("perftrackerlib/helpers/stats.py", 90),
+        ("perftrackerlib/executor.py", 90),
         ]
 
+py3_libs = [("perftrackerlib/aioclient.py", 90)]  # async/await, python 3.5+, requires aiohttp
+
+if sys.version_info >= (3, 5):
+    libs += py3_libs
+
 
 tests = [("./tools/pt-artifact-ctl.py list"),
          ("./tools/pt-artifact-ctl.py upload ./test.py 11111111-4444-11e8-85cb-8c85907924ab -iz"),
@@ -34,6 +46,8 @@ tests = [("./tools/pt-artifact-ctl.py list"),
           "11111111-5555-11e8-85cb-8c85907924ab"),
          ("./tools/pt-suite-uploader.py -j ./examples/data/sample.json --pt-project Test --pt-replace "
           "11111111-5555-11e8-85cb-8c85907924ab"),
+         ("./tools/pt-suite-merge.py ./examples/data/job_shard1.json ./examples/data/job_shard2.json -j 2 "
+          "--pt-project Test --pt-replace 11111111-5555-11e8-85cb-8c85907924ab"),
          ]
 
 
@@ -88,7 +102,8 @@ def test_all():
 
     for lib, _ in libs:
         mod = lib2mod(lib)
-        test_one("python2.7 -m \"%s\"" % mod)
+        if (lib, _) not in py3_libs:
+            test_one("python2.7 -m \"%s\"" % mod)
         test_one("python3 -m \"%s\"" % mod)
 
 #   test_one("2to3 -p \"%s\"" % root)
@@ -8,8 +8,12 @@ __copyright__ = "Copyright 2018, The PerfTracker project"
 __license__ = "MIT"
 
 from optparse import OptionParser, OptionGroup, IndentedHelpFormatter
+from multiprocessing.pool import ThreadPool
+from collections import Counter
 import os
 import sys
+import glob
+import time
 import logging
 
 if sys.version_info >= (3, 0):
@@ -20,7 +24,7 @@ else:
 bindir, basename = os.path.split(sys.argv[0])
 sys.path.insert(0, os.path.join(bindir, ".."))
 
-from perftrackerlib.client import ptServer, ptArtifact, ptRuntimeException, ptJsonEncoder
+from perftrackerlib.client import ptServer, ptArtifact, ptRuntimeException, ptJsonEncoder, PT_SERVER_POOL_MAXSIZE
 
 from perftrackerlib import perftrackerlib_require_version
 perftrackerlib_require_version('0.0.30')
@@ -40,12 +44,141 @@ class formatter(IndentedHelpFormatter):
         return ret
 
 
-def run(opts, args, abort):
-    pt_server = ptServer(opts.pt_server_url)
+def show_progress(done, total):
+    if total:
+        sys.stderr.write("\r%5.1f%% %10.1f of %.1f MB" % (100.0 * done / total, done / 1048576.0, total / 1048576.0))
+    else:
+        sys.stderr.write("\r%10.1f MB" % (done / 1048576.0))
+    if done == total:
+        sys.stderr.write("\n")
+    sys.stderr.flush()
+
+
+def read_uuids(filename):
+    """
+    One UUID per line, the rest of the line is ignored, so the bulk-upload output can be used as is
+    """
+    f = sys.stdin if filename == "-" else open(filename)
+    try:
+        return [line.split()[0] for line in f if line.strip() and not line.startswith("#")]
+    finally:
+        if f is not sys.stdin:
+            f.close()
+
+
+def find_files(patterns):
+    files = []
+    for pattern in patterns:
+        if os.path.isdir(pattern):
+            for root, dirs, names in os.walk(pattern):
+                dirs.sort()
+                files += [os.path.join(root, n) for n in sorted(names)]
+        elif sys.version_info >= (3, 5):
+            files += sorted(p for p in glob.glob(pattern, recursive=True) if os.path.isfile(p))
+        else:
+            files += sorted(p for p in glob.glob(pattern) if os.path.isfile(p))
+    return sorted(set(files), key=files.index)
+
+
+def bulk_upload(pt_server, opts, filepath):
+    # the files are uploaded in parallel, so every one is compressed by a single process by default
+    artifact = ptArtifact(pt_server, compression_workers=opts.workers or 1, dedup=opts.dedup)
+    artifact.filename = os.path.basename(filepath)
+    artifact.mime = opts.mime
+    artifact.description = opts.description
+    artifact.ttl_days = opts.ttl
+    artifact.inline = opts.inline
+    artifact.compression = opts.compression
+    resp = artifact.upload(filepath)
+    return resp, "%s %s" % (artifact.uuid, filepath)
+
+
+def bulk_download(pt_server, opts, uuid, dirname):
+    filepath = os.path.join(dirname, uuid)
+    resp = ptArtifact(pt_server, uuid1=uuid).download(filepath, decompress=opts.decompress, resume=opts.resume)
+    return resp, "%s %s" % (uuid, filepath)
+
+
+def bulk_run(command, func, items, jobs):
+    """
+    Run func(item) -> (response, output line) for every item on a pool of threads,
+    print the output lines of succeeded items and the summary report, returns the number of failures
+    """
+    def _run(item):
+        try:
+            resp, line = func(item)
+        except (ptRuntimeException, IOError, OSError) as e:
+            return item, "error", str(e)
+        if resp is None:
+            return item, "spooled", line
+        if resp.status_code in (httplib.OK, httplib.PARTIAL_CONTENT):
+            return item, str(resp.status_code), line
+        return item, str(resp.status_code), "status %d" % resp.status_code
+
+    started = time.time()
+    statuses = Counter()
+    failures = []
+
+    pool = ThreadPool(max(1, min(jobs, len(items))))
+    try:
+        for item, status, line in pool.imap_unordered(_run, items):
+            statuses[status] += 1
+            if status in ("200", "206", "spooled"):
+                print(line)
+                sys.stdout.flush()
+            else:
+                failures.append((item, line))
+    finally:
+        pool.close()
+        pool.join()
 
+    sys.stderr.write("%s: %d of %d succeeded in %.1f sec\n" %
+                     (command, len(items) - len(failures), len(items), time.time() - started))
+    for status, count in sorted(statuses.items()):
+        sys.stderr.write("  %-8s %d\n" % (status, count))
+    for item, message in failures:
+        sys.stderr.write("failed: %s - %s\n" % (item, message))
+    return len(failures)
+
+
+def run_bulk(pt_server, opts, args, abort):
+    cmd = args[0]
+    if cmd == "bulk-upload" and len(args) >= 2:
+        files = find_files(args[1:])
+        if not files:
+            abort("no files found: %s" % " ".join(args[1:]))
+        return bulk_run(cmd, lambda f: bulk_upload(pt_server, opts, f), files, opts.jobs)
+
+    if cmd == "bulk-delete" and len(args) == 2:
+        return bulk_run(cmd, lambda u: (ptArtifact(pt_server, uuid1=u).delete(), u), read_uuids(args[1]), opts.jobs)
+
+    if cmd in ("bulk-link", "bulk-unlink") and len(args) == 3:
+        obj_uuid = args[1]
+
+        def _link(uuid):
+            a = ptArtifact(pt_server, uuid1=uuid)
+            return (a.link([obj_uuid]) if cmd == "bulk-link" else a.unlink([obj_uuid])), uuid
+        return bulk_run(cmd, _link, read_uuids(args[2]), opts.jobs)
+
+    if cmd == "bulk-download" and len(args) == 3:
+        if not os.path.isdir(args[1]):
+            os.makedirs(args[1])
+        return bulk_run(cmd, lambda u: bulk_download(pt_server, opts, u, args[1]), read_uuids(args[2]), opts.jobs)
+
+    abort()
+
+
+def run(pt_server, opts, args, abort):
     if len(args) == 0:
         abort("command is not specified")
 
+    if args[0].startswith("bulk-"):
+        if run_bulk(pt_server, opts, args, abort):
+            sys.exit(1)
+        return
+
+    progress = show_progress if sys.stderr.isatty() and not opts.verbose else None
+
     if args[0] in ("upload", "update") and len(args) >= 2 and len(args) <= 3:
         if args[0] == "upload":
             uuid = args[2] if len(args) >= 3 else None
@@ -55,7 +188,7 @@ def run(opts, args, abort):
             filepath = None
 
         filename = opts.filename if opts.filename else (os.path.basename(filepath) if filepath else None)
-        artifact = ptArtifact(pt_server, uuid1=uuid)
+        artifact = ptArtifact(pt_server, uuid1=uuid, compression_workers=opts.workers, dedup=opts.dedup)
 
         artifact.filename = filename
         artifact.mime = opts.mime
@@ -65,7 +198,14 @@ def run(opts, args, abort):
         artifact.compression = opts.compression
 
         if args[0] == "upload":
-            resp = artifact.upload(filepath)
+            resp = artifact.upload(filepath, progress=progress)
+            if resp is None:
+                print("server is unreachable, artifact UUID %s is spooled to %s" % (artifact.uuid, opts.spool_dir))
+                return
+            if opts.dedup and resp.status_code == httplib.OK:
+                # the response is either the upload or the existing artifact link (or info) response
+                print("status: %d - artifact UUID %s" % (resp.status_code, artifact.uuid))
+                return
         elif args[0] == "update":
             resp = artifact.update()
 
@@ -83,36 +223,36 @@ def run(opts, args, abort):
     elif args[0] == "download" and len(args) == 3:
         uuid = args[1]
         filepath = args[2]
-        resp = ptArtifact(pt_server, uuid1=uuid).download(filepath)
-        if resp.status_code == httplib.OK:
-            print("Artifact UUID %s saved to %s (%d bytes)" % (uuid, filepath, len(resp.content)))
+        resp = ptArtifact(pt_server, uuid1=uuid).download(filepath, decompress=opts.decompress,
+                                                          resume=opts.resume, progress=progress)
+        if resp.status_code in (httplib.OK, httplib.PARTIAL_CONTENT):
+            print("Artifact UUID %s saved to %s (%d bytes)" % (uuid, filepath, os.path.getsize(filepath)))
             return
     elif args[0] == "dump" and len(args) == 2:
         uuid = args[1]
-        resp = ptArtifact(pt_server, uuid1=uuid).download()
+        out = getattr(sys.stdout, 'buffer', sys.stdout)
+        resp = ptArtifact(pt_server, uuid1=uuid).write(out, decompress=opts.decompress)
         if resp.status_code == httplib.OK:
-            print(resp.text)
             return
     elif args[0] == "list":
         try:
             limit = int(args[1]) if len(args) >= 2 else 10
         except ValueError as e:
             abort("list limit must be a number, got: '%s'" % str(args[1]))
-        resp, artifacts = ptArtifact(pt_server).list(limit)
 
-        if resp.status_code == httplib.OK:
-            fmt = "%36s %10s %10s %6s %5s %7s %24s  %s"
-            print(fmt % ("UUID", "UPLOADED", "EXPIRES", "INLINE", "COMPR", "SIZE KB", "MIME", "NAME"))
-            for a in artifacts:
-                print(fmt % (a.uuid,
-                             a.uploaded_dt.strftime("%Y-%m-%d"),
-                             a.expires_dt.strftime("%Y-%m-%d"),
-                             "Yes" if a.inline else "No",
-                             "Yes" if a.compression else "No",
-                             "%.1f" % (a.size / 1024.0),
-                             a.mime,
-                             a.filename + (" (%s)" % a.description if a.description else "")))
-            return
+        # the artifacts are fetched page by page as they are printed
+        fmt = "%36s %10s %10s %6s %5s %7s %24s  %s"
+        print(fmt % ("UUID", "UPLOADED", "EXPIRES", "INLINE", "COMPR", "SIZE KB", "MIME", "NAME"))
+        for a in ptArtifact(pt_server).iterate(limit=limit):
+            print(fmt % (a.uuid,
+                         a.uploaded_dt.strftime("%Y-%m-%d"),
+                         a.expires_dt.strftime("%Y-%m-%d"),
+                         "Yes" if a.inline else "No",
+                         "Yes" if a.compression else "No",
+                         "%.1f" % (a.size / 1024.0),
+                         a.mime,
+                         a.filename + (" (%s)" % a.description if a.description else "")))
+        return
     else:
         abort()
 
@@ -131,11 +271,22 @@ def main():
     %prog [options] unlink ARTIFACT_UUID OBJECT_UUID
     %prog [options] list [LIMIT]
     %prog [options] download ARTIFACT_UUID ARTIFACT_FILE_TO_SAVE
+    %prog [options] dump ARTIFACT_UUID
+
+    %prog [options] bulk-upload DIR|FILE|GLOB [...]
+    %prog [options] bulk-delete UUIDS_FILE
+    %prog [options] bulk-link OBJECT_UUID UUIDS_FILE
+    %prog [options] bulk-unlink OBJECT_UUID UUIDS_FILE
+    %prog [options] bulk-download DIR UUIDS_FILE
+
+    UUIDS_FILE has one artifact UUID per line (e.g. the bulk-upload output), '-' is stdin
     """
 
     op = OptionParser(description=description, usage=usage, formatter=formatter())
     op.add_option("-v", "--verbose", default=0, action="count", help="enable verbose mode")
     op.add_option("-p", "--pt-server-url", default="http://127.0.0.1:9000", help="perftracker url, default %default")
+    op.add_option("-s", "--spool-dir", help="keep uploads in this directory while the server is unreachable, "
+                                            "see pt-spool-flush.py")
 
     og = OptionGroup(op, "'upload' and 'update' options")
     og.add_option("-d", "--description", help="artifact description")
@@ -144,11 +295,26 @@ def main():
     og.add_option("-f", "--filename", help="override artifact file name by given name")
     og.add_option("-z", "--compression", action="store_true", help="inline decompression on every file view or "
                                                                    "download")
+    og.add_option("-w", "--workers", type="int",
+                  help="number of threads compressing the file, default is the number of CPUs")
+    og.add_option("-D", "--dedup", action="store_true",
+                  help="link the artifact with the same content uploaded before instead of uploading the file")
     og.add_option("-i", "--inline", default=False, action="store_true", help="inline view in browser "
                                                                              "(do not download on click)")
     og.add_option("-t", "--ttl", default=180, help="time to live (days), default=%default, 0 - infinite")
     op.add_option_group(og)
 
+    og = OptionGroup(op, "'bulk-*' options")
+    og.add_option("-j", "--jobs", type="int", default=8, help="number of parallel requests, default %default")
+    op.add_option_group(og)
+
+    og = OptionGroup(op, "'download' and 'dump' options")
+    og.add_option("-x", "--decompress", action="store_true",
+                  help="decompress artifacts uploaded with compression (-z)")
+    og.add_option("-c", "--continue", dest="resume", action="store_true",
+                  help="resume a partial download of the file")
+    op.add_option_group(og)
+
     opts, args = op.parse_args()
 
     loglevel = logging.DEBUG if opts.verbose >= 2 else (logging.INFO if opts.verbose == 1 else logging.WARNING)
@@ -163,7 +329,9 @@ def main():
         sys.exit(-1)
 
     try:
-        run(opts, args, abort)
+        with ptServer(opts.pt_server_url, spool_dir=opts.spool_dir,
+                      pool_maxsize=max(PT_SERVER_POOL_MAXSIZE, opts.jobs)) as pt_server:
+            run(pt_server, opts, args, abort)
     except ptRuntimeException as e:
         logging.error(str(e))
         sys.exit(-1)
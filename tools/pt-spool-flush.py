@@ -0,0 +1,60 @@
+#!/usr/bin/env python
+
+from __future__ import print_function, absolute_import
+
+# -*- coding: utf-8 -*-
+__author__ = "perfguru87@gmail.com"
+__copyright__ = "Copyright 2018, The PerfTracker project"
+__license__ = "MIT"
+
+from optparse import OptionParser
+import os
+import sys
+import logging
+
+bindir, basename = os.path.split(sys.argv[0])
+sys.path.insert(0, os.path.join(bindir, ".."))
+
+from perftrackerlib.client import ptServer, ptRuntimeException
+
+from perftrackerlib import perftrackerlib_require_version
+perftrackerlib_require_version('0.1.8')
+
+
+def main():
+    usage = "usage: %prog [options] SPOOL_DIR"
+
+    description = "Upload job results and artifacts kept in the SPOOL_DIR (see --pt-spool-dir) while " \
+                  "the PerfTracker server was unreachable"
+
+    op = OptionParser(description=description, usage=usage)
+    op.add_option("-v", "--verbose", default=0, action="count", help="enable verbose mode")
+    op.add_option("-p", "--pt-server-url", default="http://127.0.0.1:9000", help="perftracker url, default %default")
+
+    opts, args = op.parse_args()
+
+    loglevel = logging.DEBUG if opts.verbose >= 2 else (logging.INFO if opts.verbose == 1 else logging.WARNING)
+    logging.basicConfig(level=loglevel, format="%(asctime)s - %(module)17s - %(levelname).3s - %(message)s",
+                        datefmt='%H:%M:%S')
+
+    if len(args) != 1:
+        op.print_usage()
+        print("error: SPOOL_DIR is required")
+        sys.exit(-1)
+
+    if not os.path.isdir(args[0]):
+        print("error: spool directory doesn't exist: %s" % args[0])
+        sys.exit(-1)
+
+    try:
+        with ptServer(opts.pt_server_url, spool_dir=args[0]) as pt_server:
+            delivered = pt_server.flushSpool()
+    except ptRuntimeException as e:
+        logging.error(str(e))
+        sys.exit(-1)
+
+    print("%d jobs and artifacts uploaded from %s" % (delivered, args[0]))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,118 @@
+#!/usr/bin/env python
+
+from __future__ import print_function, absolute_import
+
+# -*- coding: utf-8 -*-
+__author__ = "perfguru87@gmail.com"
+__copyright__ = "Copyright 2018, The PerfTracker project"
+__license__ = "MIT"
+
+from optparse import OptionParser
+from multiprocessing import Pool, cpu_count
+import os
+import sys
+import json
+import logging
+
+bindir, basename = os.path.split(sys.argv[0])
+sys.path.insert(0, os.path.join(bindir, ".."))
+
+from perftrackerlib.client import ptSuite, ptJsonEncoder, ptRuntimeException
+
+from perftrackerlib import perftrackerlib_require_version
+perftrackerlib_require_version('0.1.8')
+
+
+def load_suite(filename):
+    suite = ptSuite()
+    with open(filename, 'rb') as f:
+        suite.readJson(f)
+    return suite
+
+
+def merge_files(filenames):
+    """
+    Merge the job files in a worker process, returns the merged job json
+    """
+    suite = load_suite(filenames[0])
+    for filename in filenames[1:]:
+        suite.merge(load_suite(filename))
+    return ptJsonEncoder.wire(suite)
+
+
+def merge(filenames, jobs):
+    """
+    Every worker merges a contiguous range of the files, so the tests order is the files order,
+    the partial jobs are merged in this process
+    """
+    jobs = max(1, min(jobs, len(filenames)))
+    if jobs == 1:
+        docs = [merge_files(filenames)]
+    else:
+        step = (len(filenames) + jobs - 1) // jobs
+        pool = Pool(jobs)
+        try:
+            docs = pool.map(merge_files, [filenames[i:i + step] for i in range(0, len(filenames), step)])
+        finally:
+            pool.terminate()
+
+    suite = ptSuite()
+    suite.initFromJson(json.loads(docs[0]))
+    for doc in docs[1:]:
+        s = ptSuite()
+        s.initFromJson(json.loads(doc))
+        suite.merge(s)
+    return suite
+
+
+def main():
+    usage = "usage: %prog [options] JOB_FILE..."
+
+    description = "Merge the job results files (see --pt-to-file) of the runners sharing one benchmark matrix " \
+                  "into one job and upload it: the same tests scores are concatenated, the env nodes are merged"
+
+    op = OptionParser(description=description, usage=usage)
+    op.add_option("-v", "--verbose", default=0, action="count", help="enable verbose mode")
+    op.add_option("-j", "--jobs", type="int", default=cpu_count(),
+                  help="number of files loaded in parallel, default %default")
+
+    suite = ptSuite()
+    suite.addOptions(op)
+
+    opts, args = op.parse_args()
+
+    loglevel = logging.DEBUG if opts.verbose >= 2 else (logging.INFO if opts.verbose == 1 else logging.WARNING)
+    logging.basicConfig(level=loglevel, format="%(asctime)s - %(module)17s - %(levelname).3s - %(message)s",
+                        datefmt='%H:%M:%S')
+
+    if not args:
+        op.print_usage()
+        print("error: JOB_FILE is required")
+        sys.exit(-1)
+
+    for filename in args:
+        if not os.path.isfile(filename):
+            print("error: job file doesn't exist: %s" % filename)
+            sys.exit(-1)
+
+    try:
+        suite = merge(args, opts.jobs)
+    except (IOError, OSError, ValueError, ptRuntimeException) as e:
+        logging.error("can't merge the jobs: %s" % str(e))
+        sys.exit(-1)
+
+    suite.handleOptions(opts)
+    logging.info("%d jobs merged: %d tests, %d env nodes" % (len(args), len(suite.tests), len(suite.env_nodes)))
+
+    try:
+        if not suite.upload():
+            sys.exit(-1)
+    except ptRuntimeException as e:
+        logging.error(str(e))
+        sys.exit(-1)
+
+    print("%d jobs merged to %s: %d tests" % (len(args), suite._save_to_file or suite.uuid, len(suite.tests)))
+
+
+if __name__ == "__main__":
+    main()
@@ -141,15 +141,15 @@ def parse_text(suite, text):
                 elif tag == 'deviation':
                     test.deviations = [float(val)]
                 elif tag in ('scores', 'deviations'):
-                    test.__dict__[tag] = [float(v) for v in json.loads(val)]
+                    setattr(test, tag, [float(v) for v in json.loads(val)])
                 elif tag in ('duration_sec',):
-                    test.__dict__[tag] = float(val)
+                    setattr(test, tag, float(val))
                 elif tag in ('loops', 'errors', 'warnings'):
-                    test.__dict__[tag] = int(val)
+                    setattr(test, tag, int(val))
                 elif tag in ('tag', 'metrics', 'cmdline', 'group', 'category', 'description'):
-                    test.__dict__[tag] = val
+                    setattr(test, tag, val)
                 elif tag in ('less_better', ):
-                    test.__dict__[tag] = _bool(val)
+                    setattr(test, tag, _bool(val))
             except ValueError as e:
                 logging.error("error in line: %s" % line)
                 logging.error(str(e))